@@ -1,4 +1,9 @@
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404
+from django.urls import path
+from django.utils.html import format_html_join
+from .blob_store import is_blob_ref, open_blob
 from .models import AIRequest, AIConfiguration
 
 
@@ -10,7 +15,7 @@ class AIRequestAdmin(admin.ModelAdmin):
     ]
     list_filter = ['request_type', 'status', 'model_name', 'created_at']
     search_fields = ['prompt', 'response_text', 'user__username']
-    readonly_fields = ['created_at', 'updated_at', 'processing_time']
+    readonly_fields = ['created_at', 'updated_at', 'processing_time', 'image_urls', 'image_previews']
     ordering = ['-created_at']
     
     fieldsets = (
@@ -18,7 +23,7 @@ class AIRequestAdmin(admin.ModelAdmin):
             'fields': ('user', 'request_type', 'status', 'model_name')
         }),
         ('Request', {
-            'fields': ('prompt', 'image_urls', 'max_tokens', 'temperature')
+            'fields': ('prompt', 'image_urls', 'image_previews', 'max_tokens', 'temperature')
         }),
         ('Response', {
             'fields': ('response_text', 'response_tokens', 'processing_time', 'error_message')
@@ -28,6 +33,35 @@ class AIRequestAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+    
+    @admin.display(description='Imágenes')
+    def image_previews(self, obj):
+        # El navegador pide los archivos del almacén; la fila solo trae los digests
+        return format_html_join(
+            ' ', '<a href="{0}"><img src="{0}" loading="lazy" style="max-height: 120px;"></a>',
+            ((url,) for url in obj.image_file_urls())
+        )
+
+    def get_urls(self):
+        return [
+            path('<int:object_id>/images/<int:index>/', self.admin_site.admin_view(self.image_view),
+                 name='AI_API_airequest_image'),
+        ] + super().get_urls()
+
+    def image_view(self, request, object_id, index):
+        """Sirve una imagen del almacén privado a quien puede ver el AIRequest."""
+        obj = self.get_object(request, str(object_id))
+        if obj is None:
+            raise Http404
+        if not self.has_view_permission(request, obj):
+            raise PermissionDenied
+        if index >= len(obj.image_urls) or not is_blob_ref(obj.image_urls[index]):
+            raise Http404
+        item = obj.image_urls[index]
+        try:
+            return FileResponse(open_blob(item), content_type=item['content_type'])
+        except FileNotFoundError:
+            raise Http404
 
 
 @admin.register(AIConfiguration)
@@ -45,7 +79,7 @@ class AIConfigurationAdmin(admin.ModelAdmin):
             'fields': ('name', 'is_active')
         }),
         ('Endpoint', {
-            'fields': ('lightning_endpoint', 'api_key')
+            'fields': ('lightning_endpoint', 'api_key', 'max_concurrent_requests')
         }),
         ('Modelo', {
             'fields': ('model_name', 'max_tokens_default', 'temperature_default', 'timeout_seconds')
@@ -0,0 +1,357 @@
+"""
+Control de admisión para los endpoints que llaman al modelo.
+
+Las vistas de análisis son AllowAny y cada request iba directo a una GPU que
+atiende unas pocas a la vez: con carga, todas esperaban hasta el timeout.
+AdmissionController limita las requests en vuelo por proceso:
+
+- Límite global adaptativo (AIMD): sube +1 por "ventana" de requests que
+  terminan por debajo de la latencia objetivo y se multiplica por
+  AI_ADMISSION_BACKOFF cuando una request es lenta o falla. El objetivo es
+  AI_ADMISSION_TARGET_LATENCY o, si vale 0, la menor latencia observada x
+  AI_ADMISSION_LATENCY_TOLERANCE (estilo gradiente).
+- Límite fijo por usuario (o IP si es anónimo): 429 inmediato al superarlo.
+- Cola de espera acotada: si el límite global está lleno la request espera
+  hasta AI_ADMISSION_QUEUE_TIMEOUT; con la cola llena o al vencer la espera
+  responde 503. Ambas respuestas llevan Retry-After.
+
+Los lotes de imágenes (AI_API.batch_analysis) toman un solo cupo por usuario
+para todo el lote (admission_controlled(global_slot=False)) y un cupo global,
+sin clave de usuario, por cada llamada al modelo.
+"""
+import asyncio
+import functools
+import json
+import math
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+
+from .async_waiters import AsyncWaiters, wait_for_wakeup
+from .resilience import remaining_time
+
+# Cada cuántas muestras se olvida la latencia mínima (la carga del modelo cambia)
+MIN_LATENCY_WINDOW = 500
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Permit:
+    """
+    Cupo concedido; release() libera el cupo (idempotente). Con sample=False
+    la latencia no se usa para adaptar el límite (errores 4xx, análisis
+    cacheados, cliente desconectado). key=None es un cupo solo global y
+    global_slot=False uno solo por usuario.
+    """
+
+    def __init__(self, controller: 'AdmissionController', key: Optional[str], global_slot: bool = True):
+        self.controller = controller
+        self.key = key
+        self.global_slot = global_slot
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self, success: bool = True, sample: bool = True):
+        if self._released:
+            return
+        self._released = True
+        self.controller._release(self.key, success, time.monotonic() - self.started,
+                                 sample and self.global_slot, self.global_slot)
+
+
+class AdmissionController:
+    """Límite adaptativo compartido por los hilos (y el event loop) de un proceso."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        # Corrutinas en cola; _release las despierta junto con los hilos
+        self._async_waiters = AsyncWaiters()
+        self._limit: Optional[float] = None
+        self._in_flight = 0
+        self._waiting = 0
+        self._per_key: Dict[str, int] = {}
+        self._ewma_latency: Optional[float] = None
+        self._min_latency: Optional[float] = None
+        self._samples = 0
+        self._last_decrease = 0.0
+        self.rejected = {429: 0, 503: 0}
+
+    def _current_limit(self) -> float:
+        if self._limit is None:
+            self._limit = float(_setting('AI_ADMISSION_INITIAL_LIMIT', 4))
+        return self._limit
+
+    @property
+    def limit(self) -> int:
+        return max(1, int(self._current_limit()))
+
+    def _retry_after(self) -> int:
+        """Estimación de cuándo habrá cupo: la cola actual drenada al ritmo del límite."""
+        latency = self._ewma_latency or 1.0
+        rounds = (self._waiting + 1) / self.limit
+        return max(1, math.ceil(latency * rounds))
+
+    def _reject(self, status: int, reason: str):
+        self.rejected[status] += 1
+        raise AdmissionRejected(status, reason, self._retry_after())
+
+    def _check_user(self, key: str):
+        # Las requests en cola también cuentan para el límite por usuario
+        if self._per_key.get(key, 0) >= _setting('AI_ADMISSION_PER_USER_LIMIT', 2):
+            self._reject(429, 'Demasiados análisis simultáneos para este usuario')
+
+    def _enter(self, key: Optional[str]) -> Optional[Permit]:
+        """
+        Registra la request del usuario y la admite si hay cupo global; None
+        si debe esperar en la cola. Llamar con _condition tomado.
+        """
+        if key is not None:
+            self._check_user(key)
+        if self._in_flight >= self.limit and self._waiting >= _setting('AI_ADMISSION_MAX_QUEUE', 16):
+            self._reject(503, 'Servicio de IA saturado, intenta más tarde')
+        if key is not None:
+            self._per_key[key] = self._per_key.get(key, 0) + 1
+        if self._in_flight < self.limit:
+            self._in_flight += 1
+            return Permit(self, key)
+        self._waiting += 1
+        return None
+
+    def _admit_waiting(self, key: str, give_up_at: float) -> Optional[Permit]:
+        """Intenta admitir una request en cola; al vencer la espera la saca y rechaza."""
+        if self._in_flight < self.limit:
+            self._waiting -= 1
+            self._in_flight += 1
+            return Permit(self, key)
+        if time.monotonic() >= give_up_at:
+            self._waiting -= 1
+            self._forget(key)
+            self._reject(503, 'Tiempo de espera agotado en la cola de IA')
+        return None
+
+    def _forget(self, key: Optional[str]):
+        if key is None:
+            return
+        remaining = self._per_key.get(key, 1) - 1
+        if remaining:
+            self._per_key[key] = remaining
+        else:
+            self._per_key.pop(key, None)
+
+    def _wait_budget(self) -> float:
+        budget = _setting('AI_ADMISSION_QUEUE_TIMEOUT', 5.0)
+        remaining = remaining_time()
+        return budget if remaining is None else min(budget, remaining)
+
+    def reserve(self, key: str) -> Permit:
+        """Cupo solo por usuario, sin ocupar el límite global; 429 si el usuario no tiene cupo."""
+        with self._condition:
+            self._check_user(key)
+            self._per_key[key] = self._per_key.get(key, 0) + 1
+            return Permit(self, key, global_slot=False)
+
+    def acquire(self, key: Optional[str]) -> Permit:
+        """
+        Devuelve un Permit o lanza AdmissionRejected (429 por usuario, 503 por
+        saturación). Con key=None solo cuenta el límite global.
+        """
+        give_up_at = time.monotonic() + self._wait_budget()
+        with self._condition:
+            permit = self._enter(key)
+            while permit is None:
+                self._condition.wait(max(0.0, give_up_at - time.monotonic()))
+                permit = self._admit_waiting(key, give_up_at)
+            return permit
+
+    async def aacquire(self, key: Optional[str]) -> Permit:
+        """Igual que acquire pero espera un aviso de _release sin bloquear el event loop."""
+        give_up_at = time.monotonic() + self._wait_budget()
+        with self._condition:
+            permit = self._enter(key)
+            wakeup = self._async_waiters.register() if permit is None else None
+        while permit is None:
+            try:
+                await wait_for_wakeup(wakeup, give_up_at - time.monotonic())
+            except asyncio.CancelledError:
+                with self._condition:
+                    self._async_waiters.discard(wakeup)
+                    self._waiting -= 1
+                    self._forget(key)
+                raise
+            with self._condition:
+                self._async_waiters.discard(wakeup)
+                permit = self._admit_waiting(key, give_up_at)
+                if permit is None:
+                    wakeup = self._async_waiters.register()
+        return permit
+
+    def _target_latency(self) -> Optional[float]:
+        target = _setting('AI_ADMISSION_TARGET_LATENCY', 0.0)
+        if target:
+            return target
+        if self._min_latency is None:
+            return None
+        return self._min_latency * _setting('AI_ADMISSION_LATENCY_TOLERANCE', 2.0)
+
+    def _release(self, key: Optional[str], success: bool, latency: float, sample: bool, global_slot: bool = True):
+        with self._condition:
+            if global_slot:
+                self._in_flight -= 1
+            self._forget(key)
+            if sample:
+                self._adapt(success, latency)
+            self._condition.notify_all()
+            self._async_waiters.notify_all()
+
+    def _adapt(self, success: bool, latency: float):
+        limit = self._current_limit()
+        self._ewma_latency = latency if self._ewma_latency is None else 0.2 * latency + 0.8 * self._ewma_latency
+        if success:
+            self._samples += 1
+            if self._samples % MIN_LATENCY_WINDOW == 0:
+                self._min_latency = None
+            self._min_latency = latency if self._min_latency is None else min(self._min_latency, latency)
+
+        target = self._target_latency()
+        now = time.monotonic()
+        if not success or (target is not None and latency > target):
+            # Una sola reducción por latencia media: las requests que ya estaban
+            # en vuelo con el límite anterior no deben reducirlo otra vez
+            if now - self._last_decrease >= (self._ewma_latency or 0.0):
+                limit *= _setting('AI_ADMISSION_BACKOFF', 0.8)
+                self._last_decrease = now
+        elif self._in_flight + 1 >= int(limit):
+            # Solo crecer si el límite se estaba usando completo
+            limit += 1.0 / limit
+        self._limit = min(max(limit, _setting('AI_ADMISSION_MIN_LIMIT', 1)),
+                          _setting('AI_ADMISSION_MAX_LIMIT', 32))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._condition:
+            target = self._target_latency()
+            return {
+                'limit': self.limit,
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'ewma_latency': round(self._ewma_latency, 4) if self._ewma_latency is not None else None,
+                'target_latency': round(target, 4) if target is not None else None,
+                'rejected': dict(self.rejected),
+            }
+
+
+admission_controller = AdmissionController()
+
+
+def client_key(request, user) -> str:
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def _rejection_response(rejected: AdmissionRejected) -> JsonResponse:
+    response = JsonResponse(
+        {'success': False, 'error': rejected.reason, 'retry_after': rejected.retry_after},
+        status=rejected.status,
+    )
+    response['Retry-After'] = str(rejected.retry_after)
+    return response
+
+
+def _is_cache_hit(response) -> bool:
+    data = getattr(response, 'data', None)
+    if data is None:
+        try:
+            data = json.loads(response.content)
+        except (AttributeError, ValueError):
+            return False
+    return isinstance(data, dict) and bool(data.get('cache_hit'))
+
+
+def _finish(permit: Permit, response, sample_latency: bool = True):
+    """Libera el cupo al terminar la respuesta (al final del stream si es SSE)."""
+    if isinstance(response, StreamingHttpResponse):
+        content = response.streaming_content
+
+        def release_when_done():
+            try:
+                yield from content
+            except GeneratorExit:
+                permit.release(sample=False)
+                raise
+            except BaseException:
+                permit.release(False, sample=sample_latency)
+                raise
+            permit.release(True, sample=sample_latency)
+
+        response.streaming_content = release_when_done()
+        return response
+    status_code = getattr(response, 'status_code', 500)
+    if status_code >= 500:
+        permit.release(False, sample=sample_latency)
+    else:
+        # Solo las respuestas que esperaron al modelo miden su latencia
+        permit.release(True, sample=sample_latency and status_code == 200 and not _is_cache_hit(response))
+    return response
+
+
+def admission_controlled(view=None, *, sample_latency: bool = True, global_slot: bool = True):
+    """
+    Decorador para vistas (sync o async) que llaman al modelo; va debajo de
+    @api_view o @require_POST. Sin cupo responde 429/503 con Retry-After.
+    sample_latency=False para vistas cuya duración no es la de una llamada
+    al modelo; global_slot=False toma solo el cupo por usuario (la vista pide
+    los cupos globales de cada llamada, como los lotes).
+    """
+    if view is None:
+        return functools.partial(admission_controlled, sample_latency=sample_latency, global_slot=global_slot)
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not _setting('AI_ADMISSION_ENABLED', True):
+                return await view(request, *args, **kwargs)
+            key = client_key(request, await request.auser())
+            try:
+                if global_slot:
+                    permit = await admission_controller.aacquire(key)
+                else:
+                    permit = admission_controller.reserve(key)
+            except AdmissionRejected as rejected:
+                return _rejection_response(rejected)
+            try:
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                permit.release(False)
+                raise
+            return _finish(permit, response, sample_latency)
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not _setting('AI_ADMISSION_ENABLED', True):
+            return view(request, *args, **kwargs)
+        key = client_key(request, getattr(request, 'user', None))
+        try:
+            permit = admission_controller.acquire(key) if global_slot else admission_controller.reserve(key)
+        except AdmissionRejected as rejected:
+            return _rejection_response(rejected)
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            permit.release(False)
+            raise
+        return _finish(permit, response, sample_latency)
+    return wrapper
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AiApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'AI_API'
+    
+    def ready(self):
+        """Importar signals cuando la app esté lista"""
+        import AI_API.signals
@@ -0,0 +1,48 @@
+"""
+Espera async de un cupo protegido por un threading.Condition.
+
+Los cupos (réplicas del balanceador, admisión) los liberan tanto hilos como
+corrutinas. Una corrutina no puede esperar en la Condition sin bloquear el
+event loop, así que registra un asyncio.Future; quien libera el cupo lo
+resuelve con loop.call_soon_threadsafe desde cualquier hilo.
+"""
+import asyncio
+from typing import List, Optional, Tuple
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AsyncWaiters:
+    """Futures de corrutinas en espera. Todos los métodos van con la Condition tomada."""
+
+    def __init__(self):
+        self._futures: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def register(self) -> asyncio.Future:
+        """Future que se resuelve en el próximo notify_all (llamar desde el event loop)."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._futures.append((loop, future))
+        return future
+
+    def discard(self, future: Optional[asyncio.Future]):
+        self._futures = [(loop, waiter) for loop, waiter in self._futures if waiter is not future]
+
+    def notify_all(self):
+        futures, self._futures = self._futures, []
+        for loop, future in futures:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                pass  # el event loop ya se cerró
+
+    def __len__(self) -> int:
+        return len(self._futures)
+
+
+async def wait_for_wakeup(future: asyncio.Future, timeout: float):
+    """Espera el aviso hasta `timeout` segundos; al vencer no lanza excepción."""
+    await asyncio.wait({future}, timeout=max(0.0, timeout))
@@ -0,0 +1,136 @@
+"""
+Análisis de varias imágenes de producto en una sola request.
+
+Las imágenes idénticas (mismo SHA-256) se analizan una vez. El resto se
+preprocesa en paralelo y pasa al modelo con hasta AI_BATCH_CONCURRENCY
+llamadas simultáneas. Con el servidor LitServe (readmeAssets/server.py) esas
+llamadas concurrentes se agrupan en lotes de GPU. Los resultados se producen
+en orden de llegada, no en el orden de subida.
+
+Con admission=True cada llamada al modelo pide un cupo global al control de
+admisión (los aciertos de caché no lo necesitan). El cupo por usuario lo toma
+la vista una sola vez para todo el lote, así que las llamadas no compiten
+con las demás requests del mismo usuario.
+"""
+import contextvars
+import functools
+import hashlib
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import connection
+
+from .admission import AdmissionRejected, admission_controller
+from .image_prep import ImageTooLarge, prepare_upload_image
+from .perceptual_hash import ImageFingerprint
+from .services import ProductAIService
+
+
+def _analyze(ai_service: ProductAIService, image_url: str, perceptual_hash: Optional[ImageFingerprint], user,
+             admit: Optional[Callable[[], Any]]) -> Dict[str, Any]:
+    try:
+        return ai_service.analyze_product_complete(image_url, user=user, perceptual_hash=perceptual_hash,
+                                                   admit=admit)
+    except AdmissionRejected as rejected:
+        return {'success': False, 'error': rejected.reason, 'retry_after': rejected.retry_after}
+    except Exception as e:
+        return {'success': False, 'error': f"Unexpected error: {str(e)}"}
+    finally:
+        # Cada hilo del pool abre su propia conexión (caché por dHash)
+        connection.close()
+
+
+def _content_digest(upload) -> str:
+    """SHA-256 del archivo subido leyendo por bloques (no carga la imagen completa)."""
+    sha256 = hashlib.sha256()
+    for chunk in upload.chunks():
+        sha256.update(chunk)
+    upload.seek(0)
+    return sha256.hexdigest()
+
+
+def iter_batch_analysis(uploads: List[UploadedFile], ai_service: ProductAIService, user=None,
+                        concurrency: Optional[int] = None,
+                        admission: bool = False) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Produce ('result', {...}) por cada archivo subido a medida que termina y
+    al final ('done', resumen).
+    """
+    start_time = time.time()
+    concurrency = concurrency or getattr(settings, 'AI_BATCH_CONCURRENCY', 8)
+    admit = None
+    if admission and getattr(settings, 'AI_ADMISSION_ENABLED', True):
+        admit = functools.partial(admission_controller.acquire, None)
+        # Más hilos que el límite global solo esperarían en la cola de admisión
+        concurrency = min(concurrency, admission_controller.limit)
+
+    # SHA-256 de los bytes subidos -> posiciones con ese contenido
+    groups: Dict[str, List[int]] = {}
+    for index, upload in enumerate(uploads):
+        groups.setdefault(_content_digest(upload), []).append(index)
+
+    # Los callbacks corren en hilos del pool: el contexto (deadline del
+    # request) se copia aquí para cada llamada al modelo
+    context = contextvars.copy_context()
+    finished: "queue.Queue[Tuple[str, Dict[str, Any]]]" = queue.Queue()
+    # Los hilos de preparación solo esperan al pool de procesos de image_prep
+    prep_workers = getattr(settings, 'AI_IMAGE_WORKERS', 2) or os.cpu_count() or 1
+    prep_pool = ThreadPoolExecutor(max_workers=min(len(groups), prep_workers) or 1)
+    model_pool = ThreadPoolExecutor(max_workers=min(len(groups), concurrency) or 1)
+
+    def deliver(digest: str, future):
+        if not future.cancelled():
+            finished.put((digest, future.result()))
+
+    def submit_analysis(digest: str, prep_future):
+        if prep_future.cancelled():
+            return
+        try:
+            image_url, perceptual_hash = prep_future.result()
+        except ImageTooLarge as e:
+            finished.put((digest, {'success': False, 'error': str(e)}))
+            return
+        except Exception:
+            finished.put((digest, {'success': False, 'error': 'Imagen inválida'}))
+            return
+        try:
+            model_future = model_pool.submit(context.copy().run, _analyze, ai_service, image_url, perceptual_hash, user, admit)
+        except RuntimeError:
+            return  # el pool ya se cerró: el cliente abandonó el stream
+        model_future.add_done_callback(lambda future: deliver(digest, future))
+
+    try:
+        for digest, indexes in groups.items():
+            prep_future = prep_pool.submit(prepare_upload_image, uploads[indexes[0]])
+            prep_future.add_done_callback(lambda future, digest=digest: submit_analysis(digest, future))
+
+        succeeded = 0
+        for _ in range(len(groups)):
+            digest, result = finished.get()
+            indexes = groups[digest]
+            for index in indexes:
+                succeeded += bool(result.get('success'))
+                yield 'result', {
+                    'index': index,
+                    'filename': uploads[index].name,
+                    # Las copias repetidas reutilizan el análisis de la primera
+                    'duplicate_of': indexes[0] if index != indexes[0] else None,
+                    **result,
+                }
+
+        yield 'done', {
+            'total': len(uploads),
+            'unique': len(groups),
+            'succeeded': succeeded,
+            'failed': len(uploads) - succeeded,
+            'processing_time': round(time.time() - start_time, 3),
+        }
+    finally:
+        # Si el cliente corta el stream se descartan las imágenes pendientes
+        prep_pool.shutdown(wait=False, cancel_futures=True)
+        model_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,77 @@
+"""
+Almacén de imágenes direccionado por contenido para los AIRequest.
+
+Las vistas envían las imágenes al modelo como data URLs (base64 de cientos de
+KB). En lugar de guardar ese texto en AIRequest.image_urls, los bytes se
+escriben una sola vez en el storage privado 'ai_blobs' (por defecto
+AI_BLOB_ROOT/ab/<sha256>.jpg, fuera de MEDIA_ROOT y sin URL pública) y el
+registro guarda solo una referencia {sha256, size, content_type}. La misma
+imagen enviada varias veces ocupa un único archivo. El admin las sirve con
+una vista propia que exige permiso de lectura sobre el AIRequest.
+"""
+import base64
+import hashlib
+import mimetypes
+from typing import Any, Dict, List, Union
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+
+BLOB_STORAGE = 'ai_blobs'
+
+ImageRef = Union[str, Dict[str, Any]]
+
+
+def is_blob_ref(item: ImageRef) -> bool:
+    return isinstance(item, dict) and 'sha256' in item
+
+
+def blob_storage():
+    return storages[BLOB_STORAGE]
+
+
+def blob_name(sha256: str, content_type: str) -> str:
+    extension = mimetypes.guess_extension(content_type) or '.bin'
+    return f"{sha256[:2]}/{sha256}{extension}"
+
+
+def store_image(image_url: ImageRef) -> ImageRef:
+    """
+    Guarda el contenido de una data URL y devuelve su referencia. Las URLs
+    normales (http, rutas de media) y las referencias ya guardadas se
+    devuelven sin cambios.
+    """
+    if not isinstance(image_url, str) or not image_url.startswith('data:') or ',' not in image_url:
+        return image_url
+    header, data = image_url.split(',', 1)
+    content_type = header[5:].split(';', 1)[0] or 'application/octet-stream'
+    try:
+        content = base64.b64decode(data)
+    except ValueError:
+        return image_url
+
+    sha256 = hashlib.sha256(content).hexdigest()
+    name = blob_name(sha256, content_type)
+    storage = blob_storage()
+    if not storage.exists(name):
+        storage.save(name, ContentFile(content))
+    return {'sha256': sha256, 'size': len(content), 'content_type': content_type}
+
+
+def externalize_image_urls(image_urls: List[ImageRef]) -> List[ImageRef]:
+    """Reemplaza las data URLs de la lista por referencias al almacén."""
+    return [store_image(item) for item in image_urls or []]
+
+
+def resolve_image_url(item: ImageRef) -> str:
+    """Reconstruye la data URL de una referencia (lee el archivo)."""
+    if not is_blob_ref(item):
+        return item
+    with open_blob(item) as blob:
+        data = base64.b64encode(blob.read()).decode('utf-8')
+    return f"data:{item['content_type']};base64,{data}"
+
+
+def open_blob(item: Dict[str, Any]):
+    """Archivo del almacén para una referencia (lo cierra quien lo abre)."""
+    return blob_storage().open(blob_name(item['sha256'], item['content_type']), 'rb')
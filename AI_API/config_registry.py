@@ -0,0 +1,96 @@
+"""
+Registro en memoria de la AIConfiguration activa.
+
+Antes cada Gemma3Service hacía su propia consulta a AIConfiguration y abría
+un requests.Session nuevo. El registro guarda la configuración activa por
+proceso. post_save/post_delete de AIConfiguration la invalidan al instante
+(ver AI_API.signals). Los demás procesos (workers, otros servidores) detectan
+el cambio al revalidar updated_at cada AI_CONFIG_REFRESH_SECONDS, así que lo
+editado en el admin aplica sin reiniciar y sin una consulta por request.
+"""
+import threading
+import time
+from typing import List, Optional
+
+from django.conf import settings
+from django.db.models import Count, Max, Q
+
+from .models import AIConfiguration
+
+
+class AIConfigRegistry:
+    """
+    Caché de proceso de la configuración activa. Es thread-safe, y la
+    instancia que devuelve es compartida, así que se trata como solo lectura.
+    """
+
+    def __init__(self, refresh_seconds: Optional[float] = None):
+        self.refresh_seconds = refresh_seconds
+        self._configs: Optional[List[AIConfiguration]] = None
+        self._stamp = None
+        self._checked_at = 0.0
+        # RLock: crear la configuración por defecto dispara post_save -> invalidate()
+        self._lock = threading.RLock()
+
+    def _refresh_interval(self) -> float:
+        if self.refresh_seconds is not None:
+            return self.refresh_seconds
+        return getattr(settings, 'AI_CONFIG_REFRESH_SECONDS', 30)
+
+    def active(self) -> AIConfiguration:
+        """Configuración activa; solo consulta la base al cargar o revalidar."""
+        return self.active_all()[0]
+
+    def active_all(self) -> List[AIConfiguration]:
+        """Todas las configuraciones activas por id; la primera es la principal."""
+        configs = self._configs
+        if configs is not None and time.monotonic() - self._checked_at < self._refresh_interval():
+            return configs
+        with self._lock:
+            if self._configs is None:
+                self._load()
+            elif time.monotonic() - self._checked_at >= self._refresh_interval():
+                # Revalidación barata: solo recargar si alguna configuración cambió
+                if self._current_stamp() != self._stamp:
+                    self._load()
+                self._checked_at = time.monotonic()
+            return self._configs
+
+    def invalidate(self):
+        with self._lock:
+            self._configs = None
+            self._stamp = None
+
+    def _current_stamp(self):
+        stats = AIConfiguration.objects.aggregate(
+            updated=Max('updated_at'), total=Count('id'), active=Count('id', filter=Q(is_active=True))
+        )
+        return stats['updated'], stats['total'], stats['active']
+
+    def _load(self):
+        from .services import (
+            DEFAULT_MAX_TOKENS, DEFAULT_TEMPERATURE, DEFAULT_TIMEOUT,
+            LIGHTNING_AI_API_KEY, LIGHTNING_AI_ENDPOINT, MODEL_NAME,
+        )
+
+        configs = list(AIConfiguration.objects.filter(is_active=True).order_by('id'))
+        if not configs:
+            # Crear configuración por defecto si no existe
+            config, _ = AIConfiguration.objects.get_or_create(
+                name='default',
+                defaults={
+                    'lightning_endpoint': LIGHTNING_AI_ENDPOINT,
+                    'api_key': LIGHTNING_AI_API_KEY,
+                    'model_name': MODEL_NAME,
+                    'max_tokens_default': DEFAULT_MAX_TOKENS,
+                    'temperature_default': DEFAULT_TEMPERATURE,
+                    'timeout_seconds': DEFAULT_TIMEOUT,
+                },
+            )
+            configs = [config]
+        self._configs = configs
+        self._stamp = self._current_stamp()
+        self._checked_at = time.monotonic()
+
+
+ai_config_registry = AIConfigRegistry()
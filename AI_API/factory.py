@@ -4,6 +4,67 @@ from typing import Optional
 from .ports import AIGenerationClient
 from .services import Gemma3Service
 from .mock_service import MockAIService
+from .health import provider_health
+from .config_registry import ai_config_registry
+from .resilience import ResilientAIClient
+from .load_balancer import LoadBalancedAIClient
+
+
+def _resilience_enabled() -> bool:
+    return getattr(settings, 'AI_CIRCUIT_BREAKER_ENABLED', True)
+
+
+def _balanced_configs():
+    """Configuraciones a balancear, o None si hay una sola o AI_LB_STRATEGY es 'failover'."""
+    configs = ai_config_registry.active_all()
+    if len(configs) < 2 or getattr(settings, 'AI_LB_STRATEGY', 'p2c') == 'failover':
+        return None
+    return configs
+
+
+def _load_balanced_client(configs, make_client, fallback=None):
+    """Un cliente por réplica (con su propio breaker si está habilitado) detrás del balanceador."""
+    wrap = ResilientAIClient if _resilience_enabled() else (lambda client: client)
+    backends = [(wrap(make_client(config)), config.max_concurrent_requests) for config in configs]
+    return LoadBalancedAIClient(backends, fallback=fallback)
+
+
+def _gemma_client():
+    """
+    Gemma3Service con breaker. Con varias configuraciones activas reparte entre
+    ellas; con AI_LB_STRATEGY='failover' usa la segunda solo para hedging.
+    """
+    configs = _balanced_configs()
+    if configs:
+        return _load_balanced_client(configs, Gemma3Service)
+    if not _resilience_enabled():
+        return Gemma3Service()
+    configs = ai_config_registry.active_all()
+    secondary = Gemma3Service(configs[1]) if len(configs) > 1 else None
+    return ResilientAIClient(Gemma3Service(configs[0]), secondary)
+
+
+def _inprocess_client():
+    from .streaming_client import InProcessChatClient
+    configs = _balanced_configs()
+    if configs:
+        return _load_balanced_client(
+            configs,
+            lambda config: InProcessChatClient(config=config, fallback_to_mock=False),
+            fallback=MockAIService(),
+        )
+    # Sin argumentos el cliente toma endpoint, API key, modelo y timeout de la configuración activa
+    if not _resilience_enabled():
+        return InProcessChatClient()
+    # El breaker necesita ver los errores reales: el fallback al mock lo hace el decorador
+    primary = InProcessChatClient(fallback_to_mock=False)
+    secondary = next(
+        (InProcessChatClient(config=config, fallback_to_mock=False)
+         for config in ai_config_registry.active_all()
+         if config.lightning_endpoint.rstrip('/') != primary.endpoint),
+        None,
+    )
+    return ResilientAIClient(primary, secondary, fallback=MockAIService())
 
 
 def create_ai_client(provider: Optional[str] = None, use_fallback: bool = True) -> AIGenerationClient:
@@ -11,7 +72,7 @@ def create_ai_client(provider: Optional[str] = None, use_fallback: bool = True)
     Simple Factory que devuelve una estrategia de cliente de IA según configuración.
     Usa Strategy a través del puerto AIGenerationClient.
     
-    settings.AI_PROVIDER puede ser: 'gemma' (default), 'openai', 'mock', etc.
+    settings.AI_PROVIDER puede ser: 'gemma' (default), 'openai', 'mock', 'inprocess', etc.
     """
     selected = (provider or getattr(settings, 'AI_PROVIDER', 'gemma') or 'gemma').lower()
 
@@ -24,26 +85,26 @@ def create_ai_client(provider: Optional[str] = None, use_fallback: bool = True)
             return Gemma3Service()
     elif selected == 'mock':
         return MockAIService()
+    elif selected == 'inprocess':
+        return _inprocess_client()
     elif selected == 'clientpy':
+        # Adaptador legado: lanza client.py en un subprocess por request
         from .client_py_adapter import ClientPyAdapter
         return ClientPyAdapter()
 
-    # Por defecto usa Gemma3Service, pero con fallback a mock si falla
+    # Por defecto usa Gemma3Service, pero con fallback a mock si el último
+    # sondeo en segundo plano lo marcó caído (sin I/O en esta llamada)
     if use_fallback:
+        if not provider_health.is_healthy('gemma'):
+            print("⚠️ Servicio principal no disponible, usando mock service")
+            return MockAIService()
         try:
-            # Probar si el servicio principal funciona
-            service = Gemma3Service()
-            health = service.health_check()
-            if health.get('status') == 'healthy':
-                return service
-            else:
-                print("⚠️ Servicio principal no disponible, usando mock service")
-                return MockAIService()
+            return _gemma_client()
         except Exception as e:
             print(f"⚠️ Error con servicio principal: {e}, usando mock service")
             return MockAIService()
     
     # Sin fallback, usar servicio principal directamente
-    return Gemma3Service()
+    return _gemma_client()
 
 
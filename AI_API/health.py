@@ -0,0 +1,93 @@
+"""
+Estado de salud de los proveedores de IA, medido en segundo plano.
+
+create_ai_client hacía un health_check() HTTP (timeout de 10 s) antes de
+devolver cada cliente. Ahora un hilo sondea cada proveedor registrado cada
+AI_HEALTH_CHECK_INTERVAL segundos y guarda el último resultado; la fábrica
+solo lee ese estado. Mientras no haya una primera medición el proveedor se
+considera disponible (estado 'unknown').
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+UNKNOWN = {'status': 'unknown'}
+
+
+def _probe_gemma() -> Dict[str, Any]:
+    from .services import Gemma3Service
+    return Gemma3Service().health_check()
+
+
+class ProviderHealthMonitor:
+    """
+    Caché del último health check por proveedor. Las lecturas no hacen I/O;
+    el hilo de sondeo arranca con la primera lectura.
+    """
+
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = interval
+        self._probes: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._statuses: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def register(self, name: str, probe: Callable[[], Dict[str, Any]]):
+        self._probes[name] = probe
+
+    def status(self, name: str) -> Dict[str, Any]:
+        self._ensure_started()
+        return self._statuses.get(name, UNKNOWN)
+
+    def is_healthy(self, name: str) -> bool:
+        return self.status(name).get('status') != 'unhealthy'
+
+    def refresh(self, name: Optional[str] = None):
+        """Olvida el estado (p.ej. al cambiar la configuración) y pide un sondeo inmediato."""
+        if name is None:
+            self._statuses.clear()
+        else:
+            self._statuses.pop(name, None)
+        self._wakeup.set()
+
+    def probe_now(self, name: str) -> Dict[str, Any]:
+        """Sondea un proveedor en el hilo actual y actualiza el estado cacheado."""
+        try:
+            result = self._probes[name]()
+        except Exception as e:
+            result = {'status': 'unhealthy', 'error': str(e)}
+        result = dict(result, checked_at=time.time())
+        previous = self._statuses.get(name, UNKNOWN).get('status')
+        self._statuses[name] = result
+        if previous != result.get('status'):
+            print(f"🩺 Proveedor {name}: {previous} -> {result.get('status')}")
+        return result
+
+    def _interval(self) -> float:
+        if self.interval is not None:
+            return self.interval
+        return getattr(settings, 'AI_HEALTH_CHECK_INTERVAL', 15)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ai-health-prober', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            for name in list(self._probes):
+                self.probe_now(name)
+            close_old_connections()
+            self._wakeup.wait(self._interval())
+            self._wakeup.clear()
+
+
+provider_health = ProviderHealthMonitor()
+provider_health.register('gemma', _probe_gemma)
@@ -0,0 +1,131 @@
+"""
+Normalización de las imágenes subidas antes de enviarlas al modelo.
+
+Antes la vista leía la subida completa a memoria y la decodificaba a
+resolución completa en el hilo del request (dHash incluido), así que una foto
+de 40 MP costaba cientos de MB y segundos de CPU con el GIL tomado. Ahora:
+
+- Los límites de bytes (AI_UPLOAD_MAX_BYTES) y de píxeles
+  (AI_UPLOAD_MAX_PIXELS) se validan antes de decodificar; el de píxeles con
+  solo leer la cabecera.
+- Los JPEG se decodifican con Image.draft(): libjpeg escala 1/2, 1/4 u 1/8
+  en el dominio DCT, sin materializar la imagen completa.
+- El trabajo corre en un pool de AI_IMAGE_WORKERS procesos con a lo sumo
+  AI_IMAGE_MAX_PENDING imágenes en curso. Las subidas grandes (archivo
+  temporal de Django) se leen desde disco en el proceso hijo, sin copiarlas
+  a memoria.
+"""
+import base64
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple, Union
+
+from django.conf import settings
+from PIL import Image
+
+from .perceptual_hash import ImageFingerprint, fingerprint
+
+MAX_SIZE = (800, 600)
+JPEG_QUALITY = 85
+
+
+class ImageTooLarge(ValueError):
+    """La subida supera AI_UPLOAD_MAX_BYTES o AI_UPLOAD_MAX_PIXELS (HTTP 413)."""
+
+
+def normalize_image(source: Union[str, bytes], max_pixels: int) -> Tuple[str, Optional[ImageFingerprint]]:
+    """
+    Decodifica (ruta o bytes), reduce a MAX_SIZE y devuelve (data URL JPEG,
+    huella perceptual o None). Corre en los procesos del pool, así que no usa settings.
+    """
+    with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as image:
+        # Image.open solo leyó la cabecera: rechazar antes de decodificar
+        if image.width * image.height > max_pixels:
+            raise ImageTooLarge(
+                f"La imagen tiene {image.width}x{image.height} píxeles (máximo {max_pixels})"
+            )
+        if image.format == 'JPEG':
+            # Escalado en el dominio DCT: el resultado sigue siendo >= MAX_SIZE
+            image.draft('RGB', MAX_SIZE)
+        image.load()
+
+        # Huella perceptual para reutilizar análisis de fotos casi idénticas
+        perceptual_hash = fingerprint(image)
+
+        if image.width > MAX_SIZE[0] or image.height > MAX_SIZE[1]:
+            image.thumbnail(MAX_SIZE, Image.Resampling.LANCZOS)
+
+        output = io.BytesIO()
+        image.convert('RGB').save(output, format='JPEG', quality=JPEG_QUALITY)
+
+    image_base64 = base64.b64encode(output.getvalue()).decode('utf-8')
+    return f"data:image/jpeg;base64,{image_base64}", perceptual_hash
+
+
+class ImageNormalizer:
+    """Pool de procesos perezoso y acotado para normalize_image."""
+
+    def __init__(self):
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = None
+
+    def _workers(self) -> int:
+        return getattr(settings, 'AI_IMAGE_WORKERS', 2)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: los procesos hijos no heredan hilos ni conexiones del servidor
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self._workers(), mp_context=multiprocessing.get_context('spawn')
+                )
+                self._slots = threading.BoundedSemaphore(getattr(settings, 'AI_IMAGE_MAX_PENDING', 16))
+            return self._pool
+
+    def normalize(self, source: Union[str, bytes]) -> Tuple[str, Optional[ImageFingerprint]]:
+        max_pixels = getattr(settings, 'AI_UPLOAD_MAX_PIXELS', 50_000_000)
+        if not self._workers():
+            return normalize_image(source, max_pixels)
+        pool = self._get_pool()
+        with self._slots:
+            try:
+                return pool.submit(normalize_image, source, max_pixels).result()
+            except BrokenProcessPool:
+                # Un hijo murió (p.ej. sin memoria): el próximo request crea otro pool
+                with self._lock:
+                    if self._pool is pool:
+                        self._pool = None
+                raise
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+image_normalizer = ImageNormalizer()
+
+
+def prepare_upload_image(image_file):
+    """
+    Valida y normaliza una imagen subida (UploadedFile o archivo en memoria)
+    y devuelve (data URL, dHash). Lanza ImageTooLarge si supera los límites.
+    """
+    max_bytes = getattr(settings, 'AI_UPLOAD_MAX_BYTES', 20 * 1024 * 1024)
+    size = getattr(image_file, 'size', None)
+    if size is not None and size > max_bytes:
+        raise ImageTooLarge(f"La imagen pesa {size} bytes (máximo {max_bytes})")
+
+    if hasattr(image_file, 'temporary_file_path'):
+        # Subida grande: Django ya la escribió a disco, el proceso hijo la lee de ahí
+        return image_normalizer.normalize(image_file.temporary_file_path())
+
+    content = image_file.read(max_bytes + 1)
+    if len(content) > max_bytes:
+        raise ImageTooLarge(f"La imagen pesa más de {max_bytes} bytes")
+    return image_normalizer.normalize(content)
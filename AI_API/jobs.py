@@ -0,0 +1,348 @@
+"""
+Cola de trabajos persistente para el análisis de imágenes.
+
+Cada trabajo es un AIRequest que recorre los estados existentes:
+pending -> processing -> completed / failed. La vista solo encola y devuelve
+el id; un pool de workers (comando run_ai_workers) reclama trabajos con un
+UPDATE condicional, así que varios procesos pueden drenar la misma tabla sin
+tomar dos veces el mismo trabajo. Un trabajo en processing cuyo lock supera el
+visibility timeout se considera abandonado y vuelve a la cola.
+
+Los trabajos se marcan con request_type='analysis_job' para no confundirlos
+con el log de Gemma3Service, y se consultan por su public_id (UUID), no por
+el id secuencial. La callback_url solo puede apuntar a hosts de
+AI_JOB_CALLBACK_ALLOWED_HOSTS o, si está vacío, a direcciones públicas; en
+ese caso la dirección se vuelve a comprobar al abrir el socket, para que un
+DNS que cambia entre la validación y el POST no lleve a la red interna.
+"""
+import ipaddress
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .blob_store import externalize_image_urls
+from .models import AIRequest
+from .perceptual_hash import ImageFingerprint, from_signed64, to_signed64
+
+
+JOB_REQUEST_TYPE = 'analysis_job'
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+class InvalidCallbackURL(ValueError):
+    """La callback_url no es http(s) o apunta a una dirección no permitida."""
+
+
+def _host_allowed(host: str, allowed_hosts) -> bool:
+    # Mismo formato que ALLOWED_HOSTS: 'api.ejemplo.com' exacto o '.ejemplo.com' con subdominios
+    for pattern in allowed_hosts:
+        pattern = pattern.lower()
+        if host == pattern or (pattern.startswith('.') and (host.endswith(pattern) or host == pattern[1:])):
+            return True
+    return False
+
+
+def _is_public_address(address: str) -> bool:
+    return ipaddress.ip_address(address.split('%')[0]).is_global
+
+
+def validate_callback_url(url: str) -> str:
+    """
+    Devuelve la URL si se le puede hacer POST sin exponer la red interna
+    (SSRF); si no, lanza InvalidCallbackURL. Se valida al encolar y otra vez
+    antes de notificar, porque el DNS puede cambiar entre medio.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise InvalidCallbackURL('callback_url debe ser una URL http(s)')
+    host = parts.hostname.lower()
+    allowed_hosts = _setting('AI_JOB_CALLBACK_ALLOWED_HOSTS', [])
+    if allowed_hosts:
+        if not _host_allowed(host, allowed_hosts):
+            raise InvalidCallbackURL('callback_url apunta a un host no permitido')
+        return url
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or None, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise InvalidCallbackURL('No se pudo resolver el host de callback_url')
+    for address in addresses:
+        if not _is_public_address(address):
+            raise InvalidCallbackURL('callback_url apunta a una dirección privada o local')
+    return url
+
+
+class _PublicPeerMixin:
+    """Comprueba la dirección a la que se conectó el socket antes de enviar nada."""
+
+    def _new_conn(self):
+        sock = super()._new_conn()
+        if not _setting('AI_JOB_CALLBACK_ALLOWED_HOSTS', []) and not _is_public_address(sock.getpeername()[0]):
+            sock.close()
+            raise InvalidCallbackURL('callback_url resolvió a una dirección privada o local al conectar')
+        return sock
+
+
+class _PublicHTTPConnection(_PublicPeerMixin, HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicPeerMixin, HTTPSConnection):
+    pass
+
+
+class _PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _PublicHTTPConnection
+
+
+class _PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _PublicHTTPSConnection
+
+
+class PublicAddressAdapter(HTTPAdapter):
+    """HTTPAdapter cuyas conexiones solo se abren hacia direcciones públicas."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _PublicHTTPConnectionPool,
+            'https': _PublicHTTPSConnectionPool,
+        }
+
+
+def _build_callback_session() -> requests.Session:
+    session = requests.Session()
+    # Sin proxies del entorno: la dirección comprobada al conectar sería la del proxy
+    session.trust_env = False
+    adapter = PublicAddressAdapter()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+callback_session = _build_callback_session()
+
+
+def enqueue_analysis(image_url: str, user=None, perceptual_hash: Optional[ImageFingerprint] = None,
+                     callback_url: str = '') -> AIRequest:
+    """Crea el trabajo en estado pending y lo devuelve sin esperar al modelo."""
+    from .services import PRODUCT_ANALYSIS_PROMPT
+
+    return AIRequest.objects.create(
+        user=user,
+        request_type=JOB_REQUEST_TYPE,
+        status='pending',
+        prompt=PRODUCT_ANALYSIS_PROMPT,
+        image_urls=externalize_image_urls([image_url]),
+        perceptual_hash=to_signed64(perceptual_hash.dhash) if perceptual_hash else None,
+        perceptual_color=perceptual_hash.color if perceptual_hash else None,
+        callback_url=callback_url or '',
+        max_tokens=500,
+        temperature=0.7,
+    )
+
+
+def reclaim_stuck_jobs(visibility_timeout: Optional[int] = None, max_attempts: Optional[int] = None) -> int:
+    """
+    Devuelve a pending los trabajos cuyo worker murió (lock vencido) y marca
+    como failed los que ya agotaron sus intentos.
+    """
+    visibility_timeout = visibility_timeout or _setting('AI_JOB_VISIBILITY_TIMEOUT', 600)
+    max_attempts = max_attempts or _setting('AI_JOB_MAX_ATTEMPTS', 3)
+    cutoff = timezone.now() - timedelta(seconds=visibility_timeout)
+    stuck = AIRequest.objects.filter(
+        request_type=JOB_REQUEST_TYPE, status='processing'
+    ).filter(Q(locked_at__lt=cutoff) | Q(locked_at__isnull=True))
+
+    failed = stuck.filter(attempts__gte=max_attempts).update(
+        status='failed',
+        error_message='El trabajo superó el número máximo de intentos',
+        locked_by='',
+        locked_at=None,
+        updated_at=timezone.now(),
+    )
+    retried = stuck.filter(attempts__lt=max_attempts).update(
+        status='pending', locked_by='', locked_at=None, updated_at=timezone.now()
+    )
+    return failed + retried
+
+
+def claim_next_job(worker_id: str) -> Optional[AIRequest]:
+    """
+    Reclama el trabajo pending más antiguo. El UPDATE filtra por status, así
+    que si otro worker lo tomó primero simplemente se prueba el siguiente.
+    """
+    candidates = (
+        AIRequest.objects.filter(request_type=JOB_REQUEST_TYPE, status='pending')
+        .order_by('created_at')
+        .values_list('id', 'attempts')[:10]
+    )
+    for job_id, attempts in candidates:
+        claimed = AIRequest.objects.filter(id=job_id, status='pending').update(
+            status='processing',
+            locked_by=worker_id,
+            locked_at=timezone.now(),
+            attempts=attempts + 1,
+            updated_at=timezone.now(),
+        )
+        if claimed:
+            return AIRequest.objects.get(id=job_id)
+    return None
+
+
+def run_job(ai_request: AIRequest, provider: Optional[str] = None) -> AIRequest:
+    """
+    Ejecuta el análisis de un trabajo reclamado y guarda el resultado. Si
+    mientras tanto el lock pasó a otro worker (visibility timeout vencido), el
+    resultado se descarta y no se notifica: el trabajo ya es del otro.
+    """
+    from .factory import create_ai_client
+    from .services import ProductAIService
+
+    start_time = time.time()
+    perceptual_hash = None
+    if ai_request.perceptual_hash is not None and ai_request.perceptual_color is not None:
+        perceptual_hash = ImageFingerprint(from_signed64(ai_request.perceptual_hash), ai_request.perceptual_color)
+    try:
+        ai_service = ProductAIService(ai_client=create_ai_client(provider=provider or _setting('AI_JOB_PROVIDER', None)))
+        result = ai_service.analyze_product_complete(
+            ai_request.resolved_image_urls()[0],
+            user=ai_request.user,
+            perceptual_hash=perceptual_hash,
+        )
+    except Exception as e:
+        result = {'success': False, 'error': f"Unexpected error: {str(e)}"}
+
+    if result.get('success'):
+        outcome = {'status': 'completed', 'result': result['data'], 'error_message': None}
+    else:
+        outcome = {'status': 'failed', 'result': ai_request.result,
+                   'error_message': result.get('error', 'Error en el análisis de IA')}
+    outcome.update(processing_time=time.time() - start_time, locked_by='', locked_at=None, updated_at=timezone.now())
+    finished = AIRequest.objects.filter(
+        pk=ai_request.pk, status='processing', locked_by=ai_request.locked_by
+    ).update(**outcome)
+    if not finished:
+        print(f"⚠️ Job {ai_request.public_id} was reclaimed by another worker; dropping result")
+        return ai_request
+    for field, value in outcome.items():
+        setattr(ai_request, field, value)
+
+    if ai_request.callback_url:
+        notify_callback(ai_request)
+    return ai_request
+
+
+def job_payload(ai_request: AIRequest) -> dict:
+    """Representación pública de un trabajo (sin prompt ni imagen)."""
+    return {
+        'job_id': str(ai_request.public_id),
+        'status': ai_request.status,
+        'data': ai_request.result,
+        'error': ai_request.error_message,
+        'attempts': ai_request.attempts,
+        'processing_time': ai_request.processing_time,
+        'created_at': ai_request.created_at.isoformat() if ai_request.created_at else None,
+    }
+
+
+def notify_callback(ai_request: AIRequest):
+    """POST best-effort del resultado a la callback_url del trabajo."""
+    try:
+        validate_callback_url(ai_request.callback_url)
+        # Sin seguir redirecciones: podrían llevar a la red interna
+        callback_session.post(ai_request.callback_url, json=job_payload(ai_request), timeout=10, allow_redirects=False)
+    except (InvalidCallbackURL, requests.exceptions.RequestException) as e:
+        print(f"⚠️ Callback failed for job {ai_request.public_id}: {str(e)}")
+
+
+class JobWorkerPool:
+    """
+    Pool de hilos que drena la cola. Cada hilo reclama y ejecuta un trabajo a
+    la vez; concurrency define cuántos análisis corren en paralelo.
+    """
+
+    def __init__(self, concurrency: Optional[int] = None, poll_interval: Optional[float] = None,
+                 provider: Optional[str] = None, visibility_timeout: Optional[int] = None):
+        self.concurrency = concurrency or _setting('AI_JOB_CONCURRENCY', 4)
+        self.poll_interval = poll_interval or _setting('AI_JOB_POLL_INTERVAL', 1.0)
+        self.provider = provider
+        self.visibility_timeout = visibility_timeout
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.concurrency):
+            thread = threading.Thread(target=self._loop, args=(f"{self.worker_prefix}:{index}",), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        reaper = threading.Thread(target=self._reaper_loop, daemon=True)
+        reaper.start()
+        self._threads.append(reaper)
+
+    def stop(self, wait: bool = True):
+        """Pide a los hilos que terminen; con wait=True espera a que lo hagan."""
+        self.request_stop()
+        if wait:
+            self.join()
+
+    def request_stop(self):
+        self._stop.set()
+
+    def join(self):
+        # join con timeout para que las señales se atiendan en el hilo principal
+        for thread in self._threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+
+    def run_until_empty(self) -> int:
+        """Procesa trabajos en el hilo actual hasta vaciar la cola (útil con --once)."""
+        reclaim_stuck_jobs(self.visibility_timeout)
+        processed = 0
+        while True:
+            job = claim_next_job(f"{self.worker_prefix}:once")
+            if job is None:
+                return processed
+            run_job(job, self.provider)
+            processed += 1
+
+    def _loop(self, worker_id: str):
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                job = claim_next_job(worker_id)
+                if job is None:
+                    self._stop.wait(self.poll_interval)
+                    continue
+                run_job(job, self.provider)
+            except Exception as e:
+                print(f"⚠️ Worker {worker_id} error: {str(e)}")
+                self._stop.wait(self.poll_interval)
+        close_old_connections()
+
+    def _reaper_loop(self):
+        interval = max(self.poll_interval, 5)
+        while not self._stop.wait(interval):
+            close_old_connections()
+            try:
+                reclaim_stuck_jobs(self.visibility_timeout)
+            except Exception as e:
+                print(f"⚠️ Reaper error: {str(e)}")
+        close_old_connections()
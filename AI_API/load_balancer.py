@@ -0,0 +1,308 @@
+"""
+Balanceo de carga entre varias réplicas de Gemma (una AIConfiguration activa
+por réplica).
+
+LoadBalancedAIClient implementa el puerto AIGenerationClient repartiendo
+cada request entre los clientes de todas las configuraciones activas:
+
+- Estrategia 'p2c' (power of two choices, default): toma dos réplicas al
+  azar y usa la de menor (requests en vuelo + 1) x latencia EWMA.
+  'least_outstanding' usa la de menos requests en vuelo.
+- Cada réplica tiene un tope de requests simultáneas
+  (AIConfiguration.max_concurrent_requests). Si todas están llenas la request
+  espera un cupo hasta AI_LB_QUEUE_TIMEOUT o el deadline del request.
+- Tras AI_LB_EJECT_AFTER fallos seguidos una réplica sale de la rotación por
+  AI_LB_EJECT_SECONDS; una request fallida se reintenta en otra réplica.
+
+El estado (en vuelo, EWMA, expulsiones) es por proceso y compartido entre
+hilos, igual que los circuit breakers.
+"""
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .async_waiters import AsyncWaiters, wait_for_wakeup
+from .resilience import DeadlineExceeded, endpoint_key, remaining_time
+
+EWMA_ALPHA = 0.3
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+class EndpointState:
+    """Contadores de una réplica; se modifican solo con _condition tomado."""
+
+    def __init__(self, key: str, max_concurrency: int):
+        self.key = key
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+    def has_capacity(self) -> bool:
+        return self.outstanding < self.max_concurrency
+
+    def score(self) -> float:
+        # Sin mediciones todavía se asume la latencia media para no acaparar la réplica nueva
+        return (self.outstanding + 1) * (self.ewma_latency or 1.0)
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            'endpoint': self.key,
+            'outstanding': self.outstanding,
+            'max_concurrency': self.max_concurrency,
+            'ewma_latency': round(self.ewma_latency, 4) if self.ewma_latency is not None else None,
+            'ejected': self.is_ejected(now),
+            'requests': self.requests,
+            'errors': self.errors,
+        }
+
+
+_states: Dict[str, EndpointState] = {}
+_condition = threading.Condition()
+# Corrutinas esperando un cupo; _release las despierta junto con los hilos
+_async_waiters = AsyncWaiters()
+
+
+def get_endpoint_state(key: str, max_concurrency: int) -> EndpointState:
+    with _condition:
+        state = _states.get(key)
+        if state is None:
+            state = _states[key] = EndpointState(key, max_concurrency)
+        else:
+            # El tope puede haber cambiado en el admin
+            state.max_concurrency = max_concurrency
+        return state
+
+
+def endpoint_snapshots() -> List[Dict[str, Any]]:
+    now = time.monotonic()
+    with _condition:
+        return [state.snapshot(now) for state in _states.values()]
+
+
+def _client_model_name(client) -> str:
+    config = getattr(client, 'config', None)
+    return getattr(config, 'model_name', None) or getattr(client, 'model_name', '') or ''
+
+
+def _failure(error: str) -> Dict[str, Any]:
+    return {'success': False, 'error': error, 'processing_time': 0.0, 'request_id': None}
+
+
+class LoadBalancedAIClient:
+    """
+    Cliente que reparte las requests entre varios AIGenerationClient. Recibe
+    pares (cliente, tope de concurrencia). La identidad del modelo (para las
+    llaves de caché) es la de todas las réplicas, no la de la primera; los
+    demás atributos no definidos aquí se delegan al primer cliente.
+    """
+
+    def __init__(self, backends: List[Tuple[Any, int]], strategy: Optional[str] = None, fallback=None):
+        if not backends:
+            raise ValueError("LoadBalancedAIClient necesita al menos un backend")
+        self.backends = [(client, get_endpoint_state(endpoint_key(client), limit)) for client, limit in backends]
+        self.strategy = strategy or _setting('AI_LB_STRATEGY', 'p2c')
+        self.fallback = fallback
+
+    def __getattr__(self, name):
+        return getattr(self.backends[0][0], name)
+
+    @property
+    def config(self):
+        # No hay una única AIConfiguration: quien necesite el modelo usa model_name
+        return None
+
+    @property
+    def model_names(self) -> FrozenSet[str]:
+        """Modelos que pueden responder una request del balanceador."""
+        return frozenset(_client_model_name(client) for client, _ in self.backends)
+
+    @property
+    def model_name(self) -> str:
+        """El modelo común de las réplicas o, si difieren, todos ellos ordenados ('a+b')."""
+        return '+'.join(sorted(self.model_names))
+
+    def _choose(self, exclude) -> Optional[Tuple[Any, EndpointState]]:
+        """Elige y reserva una réplica (llamar con _condition tomado)."""
+        now = time.monotonic()
+        candidates = [
+            (client, state) for client, state in self.backends
+            if state.key not in exclude and not state.is_ejected(now) and state.has_capacity()
+        ]
+        if not candidates:
+            return None
+        if self.strategy == 'least_outstanding':
+            choice = min(candidates, key=lambda item: (item[1].outstanding, item[1].ewma_latency or 0.0))
+        elif len(candidates) > 1:
+            choice = min(random.sample(candidates, 2), key=lambda item: item[1].score())
+        else:
+            choice = candidates[0]
+        choice[1].outstanding += 1
+        choice[1].requests += 1
+        return choice
+
+    def _all_unavailable(self, exclude) -> bool:
+        now = time.monotonic()
+        return all(state.key in exclude or state.is_ejected(now) for _, state in self.backends)
+
+    def _wait_budget(self) -> float:
+        budget = _setting('AI_LB_QUEUE_TIMEOUT', 30.0)
+        remaining = remaining_time()
+        return budget if remaining is None else min(budget, remaining)
+
+    def _acquire(self, exclude) -> Optional[Tuple[Any, EndpointState]]:
+        give_up_at = time.monotonic() + self._wait_budget()
+        with _condition:
+            while True:
+                choice = self._choose(exclude)
+                if choice is not None or self._all_unavailable(exclude):
+                    return choice
+                # Todas las réplicas están llenas: esperar a que se libere un cupo
+                left = give_up_at - time.monotonic()
+                if left <= 0:
+                    return None
+                _condition.wait(left)
+
+    async def _aacquire(self, exclude) -> Optional[Tuple[Any, EndpointState]]:
+        give_up_at = time.monotonic() + self._wait_budget()
+        wakeup = None
+        try:
+            while True:
+                with _condition:
+                    _async_waiters.discard(wakeup)
+                    choice = self._choose(exclude)
+                    if choice is not None or self._all_unavailable(exclude):
+                        return choice
+                    left = give_up_at - time.monotonic()
+                    if left <= 0:
+                        return None
+                    wakeup = _async_waiters.register()
+                await wait_for_wakeup(wakeup, left)
+        except asyncio.CancelledError:
+            with _condition:
+                _async_waiters.discard(wakeup)
+            raise
+
+    @staticmethod
+    def _release(state: EndpointState, success: bool, duration: float):
+        with _condition:
+            state.outstanding -= 1
+            if success:
+                state.consecutive_failures = 0
+                state.ewma_latency = duration if state.ewma_latency is None else (
+                    EWMA_ALPHA * duration + (1 - EWMA_ALPHA) * state.ewma_latency
+                )
+            else:
+                state.errors += 1
+                state.consecutive_failures += 1
+                if state.consecutive_failures >= _setting('AI_LB_EJECT_AFTER', 3):
+                    eject_seconds = _setting('AI_LB_EJECT_SECONDS', 30)
+                    state.ejected_until = time.monotonic() + eject_seconds
+                    state.consecutive_failures = 0
+                    print(f"⛔ Endpoint {state.key} fuera de rotación por {eject_seconds}s")
+            _condition.notify_all()
+            _async_waiters.notify_all()
+
+    def generate_response(self, prompt: str, image_urls: List[str] = None,
+                          max_tokens: int = None, temperature: float = None,
+                          request_type: str = 'chat', user=None) -> Dict[str, Any]:
+        kwargs = dict(prompt=prompt, image_urls=image_urls, max_tokens=max_tokens,
+                      temperature=temperature, request_type=request_type, user=user)
+        result = None
+        tried = set()
+        for _ in range(1 + _setting('AI_LB_RETRIES', 1)):
+            choice = self._acquire(tried)
+            if choice is None:
+                break
+            client, state = choice
+            tried.add(state.key)
+            start = time.monotonic()
+            try:
+                result = client.generate_response(**kwargs)
+            except Exception as e:
+                result = _failure(f"Unexpected error: {str(e)}")
+            self._release(state, bool(result.get('success')), time.monotonic() - start)
+            if result.get('success'):
+                return result
+        if self.fallback is not None:
+            return self.fallback.generate_response(**kwargs)
+        return result or _failure("No hay réplicas de IA disponibles")
+
+    async def agenerate_response(self, prompt: str, image_urls: List[str] = None,
+                                 max_tokens: int = None, temperature: float = None,
+                                 request_type: str = 'chat', user=None) -> Dict[str, Any]:
+        kwargs = dict(prompt=prompt, image_urls=image_urls, max_tokens=max_tokens,
+                      temperature=temperature, request_type=request_type, user=user)
+        result = None
+        tried = set()
+        for _ in range(1 + _setting('AI_LB_RETRIES', 1)):
+            choice = await self._aacquire(tried)
+            if choice is None:
+                break
+            client, state = choice
+            tried.add(state.key)
+            start = time.monotonic()
+            try:
+                result = await self._acall(client, kwargs)
+            except (Exception, asyncio.CancelledError) as e:
+                self._release(state, False, time.monotonic() - start)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                result = _failure(f"Unexpected error: {str(e)}")
+                continue
+            self._release(state, bool(result.get('success')), time.monotonic() - start)
+            if result.get('success'):
+                return result
+        if self.fallback is not None:
+            return await self._acall(self.fallback, kwargs)
+        return result or _failure("No hay réplicas de IA disponibles")
+
+    @staticmethod
+    async def _acall(client, kwargs):
+        agenerate = getattr(client, 'agenerate_response', None)
+        if agenerate is not None:
+            return await agenerate(**kwargs)
+        return await sync_to_async(client.generate_response, thread_sensitive=False)(**kwargs)
+
+    def stream_response(self, prompt: str, image_urls: Optional[List[str]] = None,
+                        max_tokens: Optional[int] = None, temperature: Optional[float] = None):
+        """Stream desde una réplica elegida con la misma estrategia (sin reintento)."""
+        choice = self._acquire(set())
+        if choice is None:
+            raise DeadlineExceeded("No hay réplicas de IA disponibles")
+        client, state = choice
+        start = time.monotonic()
+        success = False
+        try:
+            for text in client.stream_response(prompt, image_urls, max_tokens, temperature):
+                yield text
+            success = True
+        except GeneratorExit:
+            success = True
+            raise
+        finally:
+            self._release(state, success, time.monotonic() - start)
+
+    def health_check(self) -> Dict[str, Any]:
+        """Sano si al menos una réplica responde."""
+        checks = [client.health_check() for client, _ in self.backends]
+        healthy = [check for check in checks if check.get('status') == 'healthy']
+        return {
+            'status': 'healthy' if healthy else 'unhealthy',
+            'endpoints': checks,
+            'healthy_endpoints': len(healthy),
+        }
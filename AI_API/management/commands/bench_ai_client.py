@@ -0,0 +1,72 @@
+"""
+Benchmark del overhead por request: cliente en proceso vs. subprocess por análisis
+"""
+import base64
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from AI_API.standin_server import start_standin_server
+from AI_API.streaming_client import InProcessChatClient
+
+# Equivalente al camino de ClientPyAdapter: intérprete nuevo, imports y un
+# cliente HTTP recién creado (sin conexiones reutilizadas) por cada request.
+SUBPROCESS_SCRIPT = """
+import sys, json, requests
+with open(sys.argv[2], 'rb') as f:
+    f.read()
+r = requests.post(sys.argv[1] + '/v1/chat/completions', json={'stream': True}, stream=True)
+print(''.join(line.decode() for line in r.iter_lines() if line))
+"""
+
+
+class Command(BaseCommand):
+    help = 'Compara la latencia por request del cliente en proceso contra el camino con subprocess'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=30, help='Requests por variante')
+
+    def handle(self, *args, **options):
+        server, url = start_standin_server()
+        image_url = 'data:image/jpeg;base64,' + base64.b64encode(os.urandom(150_000)).decode('ascii')
+        n = options['requests']
+
+        client = InProcessChatClient(endpoint=url, api_key='bench')
+        in_process = self._measure(n, lambda: client.generate_response('bench', [image_url]))
+
+        def legacy():
+            _, data = image_url.split(',', 1)
+            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
+                temp_file.write(base64.b64decode(data))
+            try:
+                subprocess.run(
+                    [sys.executable, '-c', SUBPROCESS_SCRIPT, url, temp_file.name],
+                    capture_output=True, text=True, timeout=60, check=True,
+                )
+            finally:
+                os.unlink(temp_file.name)
+
+        subprocess_path = self._measure(n, legacy)
+        server.shutdown()
+
+        for name, timings in (('subprocess', subprocess_path), ('in-process', in_process)):
+            self.stdout.write(
+                f'{name:>11}: p50={statistics.median(timings):.1f}ms '
+                f'p95={timings[int(len(timings) * 0.95) - 1]:.1f}ms'
+            )
+        saved = statistics.median(subprocess_path) - statistics.median(in_process)
+        self.stdout.write(self.style.SUCCESS(f'Overhead eliminado por request (p50): {saved:.1f}ms'))
+
+    @staticmethod
+    def _measure(n, func):
+        timings = []
+        for _ in range(n):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return sorted(timings)
@@ -0,0 +1,83 @@
+"""
+Benchmark del endpoint de análisis por lotes contra el análisis imagen por imagen
+"""
+import io
+import json
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from PIL import Image
+
+from AI_API.factory import create_ai_client
+from AI_API.image_prep import prepare_upload_image
+from AI_API.services import ProductAIService
+from AI_API.standin_server import start_standin_server
+from AI_API.views import analyze_product_image_batch
+
+
+def _random_photo(width: int = 1200, height: int = 900) -> bytes:
+    # Ruido aleatorio: cada imagen es distinta para la caché por contenido y por dHash
+    image = Image.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Mide imágenes/s del endpoint por lotes vs. una llamada por imagen (mock y servidor stand-in)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,100', help='Tamaños de lote separados por coma')
+        parser.add_argument('--latency', type=float, default=0.2, help='Segundos por generación del stand-in')
+        parser.add_argument('--replica-concurrency', type=int, default=8,
+                            help='Generaciones simultáneas del stand-in (lotes de GPU)')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        photos = [_random_photo() for _ in range(max(sizes) * 2)]
+        server, url = start_standin_server(
+            first_token_delay=options['latency'], max_concurrency=options['replica_concurrency']
+        )
+        settings.LIGHTNING_AI_ENDPOINT = url
+
+        offset = 0
+        for provider in ('mock', 'inprocess'):
+            settings.AI_BATCH_PROVIDER = provider
+            label = 'mock' if provider == 'mock' else 'stand-in'
+            for size in sizes:
+                # Fotos distintas en cada corrida para no medir aciertos de caché
+                batch, offset = photos[offset % len(photos):][:size], offset + size
+                sequential = self._sequential(provider, batch)
+                batched = self._batch(batch)
+                self.stdout.write(
+                    f"{label:>8} N={size:<4} secuencial: {size / sequential:7.1f} img/s   "
+                    f"lote: {size / batched:7.1f} img/s   (x{sequential / batched:.1f})"
+                )
+        server.shutdown()
+
+    @staticmethod
+    def _sequential(provider, photos):
+        ai_service = ProductAIService(ai_client=create_ai_client(provider=provider))
+        start = time.perf_counter()
+        for content in photos:
+            image_url, perceptual_hash = prepare_upload_image(io.BytesIO(content))
+            ai_service.analyze_product_complete(image_url, perceptual_hash=perceptual_hash)
+        return time.perf_counter() - start
+
+    def _batch(self, photos):
+        files = [SimpleUploadedFile(f'{i}.jpg', content, 'image/jpeg') for i, content in enumerate(photos)]
+        request = RequestFactory().post('/api/ai/analyze-product/batch/', {'images': files})
+        request.user = AnonymousUser()
+        start = time.perf_counter()
+        response = analyze_product_image_batch(request)
+        events = b''.join(response.streaming_content).decode('utf-8')
+        elapsed = time.perf_counter() - start
+        done = json.loads(events.rsplit('data: ', 1)[1])
+        if done.get('failed'):
+            self.stderr.write(f"  {done['failed']} imágenes fallaron")
+        return elapsed
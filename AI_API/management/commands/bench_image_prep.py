@@ -0,0 +1,101 @@
+"""
+Benchmark de la normalización de imágenes subidas: camino anterior (decodificar
+a resolución completa) contra image_prep.normalize_image (draft + límites)
+"""
+import base64
+import io
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from AI_API.image_prep import normalize_image
+from AI_API.perceptual_hash import dhash
+
+# (nombre, ancho, alto, formatos)
+CASES = [
+    ('1 MP', 1200, 900, ('JPEG', 'PNG', 'WEBP')),
+    ('12 MP', 4000, 3000, ('JPEG', 'PNG', 'WEBP')),
+    ('40 MP', 7296, 5472, ('JPEG',)),
+]
+
+
+def _legacy_prepare(path: str):
+    """Copia del camino anterior de la vista (solo como referencia)."""
+    with open(path, 'rb') as source:
+        image_content = source.read()
+    image = Image.open(io.BytesIO(image_content))
+    perceptual_hash = dhash(image)
+    if image.width > 800 or image.height > 600:
+        image.thumbnail((800, 600), Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    image.convert('RGB').save(output, format='JPEG', quality=85)
+    return f"data:image/jpeg;base64,{base64.b64encode(output.getvalue()).decode('utf-8')}", perceptual_hash
+
+
+def _peak_rss_kb() -> int:
+    """
+    Pico de RSS del proceso. VmHWM se reinicia con exec; ru_maxrss no (el
+    hijo heredaría el pico del proceso que generó las fotos).
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure(variant: str, path: str):
+    """Corre en un proceso nuevo: devuelve (ms, MB de memoria pico añadidos)."""
+    before = _peak_rss_kb()
+    start = time.perf_counter()
+    if variant == 'legacy':
+        _legacy_prepare(path)
+    else:
+        normalize_image(path, max_pixels=100_000_000)
+    elapsed = (time.perf_counter() - start) * 1000
+    peak = _peak_rss_kb() - before
+    return elapsed, peak / 1024
+
+
+def _photo(width: int, height: int) -> Image.Image:
+    # Degradados con ruido leve: comprime como una foto, no como ruido puro
+    red = Image.linear_gradient('L').resize((width, height))
+    green = Image.radial_gradient('L').resize((width, height))
+    blue = Image.effect_noise((width, height), 24)
+    return Image.merge('RGB', (red, green, blue))
+
+
+class Command(BaseCommand):
+    help = 'Compara tiempo y memoria pico de la normalización de imágenes por tamaño y formato'
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('spawn')
+        with tempfile.TemporaryDirectory() as directory:
+            for name, width, height, formats in CASES:
+                photo = _photo(width, height)
+                for image_format in formats:
+                    path = os.path.join(directory, f'{width}x{height}.{image_format.lower()}')
+                    photo.save(path, format=image_format, quality=90)
+                    size_mb = os.path.getsize(path) / (1024 * 1024)
+
+                    results = {}
+                    for variant in ('legacy', 'draft'):
+                        # Un proceso limpio por medición para que la memoria pico sea comparable
+                        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                            results[variant] = pool.submit(_measure, variant, path).result()
+
+                    (legacy_ms, legacy_mb), (new_ms, new_mb) = results['legacy'], results['draft']
+                    self.stdout.write(
+                        f"{name:>6} {image_format:<5} ({size_mb:5.1f} MB): "
+                        f"antes {legacy_ms:7.1f} ms / {legacy_mb:6.1f} MB   "
+                        f"ahora {new_ms:7.1f} ms / {new_mb:6.1f} MB"
+                    )
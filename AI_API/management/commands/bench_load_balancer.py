@@ -0,0 +1,71 @@
+"""
+Benchmark del balanceador contra varias réplicas stand-in locales
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from AI_API.load_balancer import LoadBalancedAIClient, endpoint_snapshots
+from AI_API.standin_server import start_standin_server
+from AI_API.streaming_client import InProcessChatClient
+
+
+class Command(BaseCommand):
+    help = 'Mide el throughput del LoadBalancedAIClient con 1..N réplicas stand-in y la expulsión de una réplica caída'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replicas', type=int, default=3, help='Número máximo de réplicas')
+        parser.add_argument('--requests', type=int, default=60, help='Requests por corrida')
+        parser.add_argument('--clients', type=int, default=16, help='Requests concurrentes')
+        parser.add_argument('--replica-concurrency', type=int, default=2,
+                            help='Generaciones simultáneas por réplica (y tope del balanceador)')
+        parser.add_argument('--latency', type=float, default=0.1, help='Segundos por generación')
+        parser.add_argument('--strategy', default='p2c', choices=['p2c', 'least_outstanding'])
+
+    def handle(self, *args, **options):
+        limit = options['replica_concurrency']
+        servers = [
+            start_standin_server(first_token_delay=options['latency'], max_concurrency=limit)
+            for _ in range(options['replicas'])
+        ]
+
+        for count in range(1, len(servers) + 1):
+            client = self._client([url for _, url in servers[:count]], limit, options['strategy'])
+            elapsed, failures = self._run(client, options['requests'], options['clients'])
+            self.stdout.write(
+                f"{count} réplica(s): {options['requests'] / elapsed:6.1f} req/s "
+                f"({elapsed:.2f}s, {failures} fallos)"
+            )
+
+        # Una réplica caída: tras AI_LB_EJECT_AFTER fallos sale de la rotación y
+        # las requests fallidas se reintentan en otra réplica
+        down_server, down_url = servers[0]
+        down_server.shutdown()
+        down_server.server_close()
+        client = self._client([url for _, url in servers], limit, options['strategy'])
+        elapsed, failures = self._run(client, options['requests'], options['clients'])
+        self.stdout.write(
+            f"Con {down_url} caída: {options['requests'] / elapsed:6.1f} req/s ({failures} fallos)"
+        )
+
+        for snapshot in endpoint_snapshots():
+            self.stdout.write(f"  {snapshot}")
+        for server, _ in servers[1:]:
+            server.shutdown()
+
+    @staticmethod
+    def _client(urls, limit, strategy):
+        backends = [
+            (InProcessChatClient(endpoint=url, api_key='bench', fallback_to_mock=False), limit)
+            for url in urls
+        ]
+        return LoadBalancedAIClient(backends, strategy=strategy)
+
+    @staticmethod
+    def _run(client, n, concurrency):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda _: client.generate_response('bench'), range(n)))
+        elapsed = time.perf_counter() - start
+        return elapsed, sum(1 for result in results if not result.get('success'))
@@ -0,0 +1,59 @@
+"""
+Benchmark de búsqueda de casi-duplicados en el índice multi-índice de dHashes
+"""
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from AI_API.perceptual_hash import MultiIndexHash
+
+
+class Command(BaseCommand):
+    help = 'Mide la latencia de búsqueda por distancia de Hamming sobre hashes aleatorios'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1_000_000, help='Cantidad de hashes almacenados')
+        parser.add_argument('--queries', type=int, default=200, help='Cantidad de búsquedas')
+        parser.add_argument(
+            '--max-distance',
+            type=int,
+            default=getattr(settings, 'AI_PHASH_MAX_DISTANCE', 6),
+            help='Umbral de distancia de Hamming',
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(1234)
+        size, max_distance = options['size'], options['max_distance']
+
+        start = time.perf_counter()
+        index = MultiIndexHash()
+        stored = []
+        for i in range(size):
+            value = rng.getrandbits(64)
+            index.add(value, i)
+            if i % 1000 == 0:
+                stored.append(value)
+        self.stdout.write(f'Índice construido con {len(index)} hashes en {time.perf_counter() - start:.1f}s')
+
+        timings = []
+        found = 0
+        for _ in range(options['queries']):
+            # Consulta = hash guardado con algunos bits alterados (casi-duplicado)
+            query = rng.choice(stored)
+            for bit in rng.sample(range(64), rng.randint(0, max_distance)):
+                query ^= 1 << bit
+            start = time.perf_counter()
+            found += bool(index.search(query, max_distance))
+            timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'distancia<={max_distance}: p50={statistics.median(timings):.2f}ms '
+                f'p95={timings[int(len(timings) * 0.95) - 1]:.2f}ms '
+                f'encontrados={found}/{options["queries"]}'
+            )
+        )
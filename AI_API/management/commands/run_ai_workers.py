@@ -0,0 +1,70 @@
+"""
+Comando para ejecutar los workers de la cola de análisis de imágenes
+"""
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from AI_API.jobs import JobWorkerPool
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta un pool de workers que procesa los trabajos de análisis pendientes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=getattr(settings, 'AI_JOB_CONCURRENCY', 4),
+            help='Cantidad de trabajos procesados en paralelo',
+        )
+        parser.add_argument(
+            '--provider',
+            default=None,
+            help="Proveedor de IA para los trabajos (p.ej. 'inprocess', 'mock'); default: AI_JOB_PROVIDER",
+        )
+        parser.add_argument(
+            '--visibility-timeout',
+            type=int,
+            default=None,
+            help='Segundos tras los cuales un trabajo en processing se considera abandonado',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=None,
+            help='Segundos de espera cuando la cola está vacía',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Procesar los trabajos pendientes y terminar',
+        )
+
+    def handle(self, *args, **options):
+        pool = JobWorkerPool(
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            provider=options['provider'],
+            visibility_timeout=options['visibility_timeout'],
+        )
+
+        if options['once']:
+            processed = pool.run_until_empty()
+            self.stdout.write(self.style.SUCCESS(f'✅ {processed} trabajos procesados'))
+            return
+
+        def shutdown(signum, frame):
+            self.stdout.write('Deteniendo workers...')
+            pool.request_stop()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        pool.start()
+        self.stdout.write(
+            self.style.SUCCESS(f'🚀 {pool.concurrency} workers procesando la cola ({pool.worker_prefix})')
+        )
+        pool.join()
+        self.stdout.write(self.style.SUCCESS('Workers detenidos'))
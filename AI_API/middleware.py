@@ -0,0 +1,53 @@
+"""
+Middleware que fija el deadline de cada request HTTP para las llamadas al
+modelo (ver AI_API.resilience).
+"""
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from .resilience import reset_deadline, set_deadline
+
+DEADLINE_HEADER = 'HTTP_X_REQUEST_TIMEOUT'
+
+
+def _request_deadline(request):
+    """
+    Segundos disponibles: AI_REQUEST_DEADLINE_SECONDS, acotado por el header
+    X-Request-Timeout si el cliente (o el proxy) manda uno menor.
+    """
+    deadline = getattr(settings, 'AI_REQUEST_DEADLINE_SECONDS', None)
+    header = request.META.get(DEADLINE_HEADER)
+    if header:
+        try:
+            requested = float(header)
+        except ValueError:
+            requested = None
+        if requested is not None and requested > 0:
+            deadline = min(deadline, requested) if deadline else requested
+    return deadline
+
+
+@sync_and_async_middleware
+def RequestDeadlineMiddleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            deadline = _request_deadline(request)
+            if not deadline:
+                return await get_response(request)
+            token = set_deadline(deadline)
+            try:
+                return await get_response(request)
+            finally:
+                reset_deadline(token)
+    else:
+        def middleware(request):
+            deadline = _request_deadline(request)
+            if not deadline:
+                return get_response(request)
+            token = set_deadline(deadline)
+            try:
+                return get_response(request)
+            finally:
+                reset_deadline(token)
+    return middleware
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI_API', '0002_remove_productaigeneration_ai_request_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyzedImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dhash', models.BigIntegerField(help_text='dHash de 64 bits (almacenado con signo)')),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('model_name', models.CharField(max_length=100)),
+                ('prompt_version', models.CharField(max_length=20)),
+                ('analysis', models.JSONField(help_text='Resultado de analyze_product_complete')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Analyzed Image',
+                'verbose_name_plural': 'Analyzed Images',
+            },
+        ),
+    ]
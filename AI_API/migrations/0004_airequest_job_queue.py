@@ -0,0 +1,54 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI_API', '0003_analyzedimage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='airequest',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='airequest',
+            name='callback_url',
+            field=models.URLField(blank=True, help_text='URL notificada (POST) al terminar el trabajo'),
+        ),
+        migrations.AddField(
+            model_name='airequest',
+            name='locked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='airequest',
+            name='locked_by',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='airequest',
+            name='perceptual_hash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='airequest',
+            name='result',
+            field=models.JSONField(blank=True, help_text='Resultado parseado del análisis en segundo plano', null=True),
+        ),
+        migrations.AlterField(
+            model_name='airequest',
+            name='request_type',
+            field=models.CharField(choices=[('product_description', 'Descripción de Producto'), ('image_analysis', 'Análisis de Imagen'), ('text_generation', 'Generación de Texto'), ('chat', 'Chat Conversacional'), ('product_analysis', 'Análisis de Producto')], default='chat', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='airequest',
+            index=models.Index(fields=['status', 'created_at'], name='airequest_status_created_idx'),
+        ),
+    ]
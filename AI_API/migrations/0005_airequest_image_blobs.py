@@ -0,0 +1,83 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:25
+
+import base64
+import hashlib
+import mimetypes
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import migrations, models
+
+
+BATCH_SIZE = 500
+
+
+# Copia de AI_API.blob_store: la migración no debe cambiar si el módulo cambia
+def _blob_name(sha256, content_type):
+    extension = mimetypes.guess_extension(content_type) or '.bin'
+    return f"{sha256[:2]}/{sha256}{extension}"
+
+
+def _store_image(image_url):
+    if not isinstance(image_url, str) or not image_url.startswith('data:') or ',' not in image_url:
+        return image_url
+    header, data = image_url.split(',', 1)
+    content_type = header[5:].split(';', 1)[0] or 'application/octet-stream'
+    try:
+        content = base64.b64decode(data)
+    except ValueError:
+        return image_url
+    sha256 = hashlib.sha256(content).hexdigest()
+    name = _blob_name(sha256, content_type)
+    storage = storages['ai_blobs']
+    if not storage.exists(name):
+        storage.save(name, ContentFile(content))
+    return {'sha256': sha256, 'size': len(content), 'content_type': content_type}
+
+
+def _resolve_image_url(item):
+    if not (isinstance(item, dict) and 'sha256' in item):
+        return item
+    with storages['ai_blobs'].open(_blob_name(item['sha256'], item['content_type']), 'rb') as blob:
+        data = base64.b64encode(blob.read()).decode('utf-8')
+    return f"data:{item['content_type']};base64,{data}"
+
+
+def _rewrite_image_urls(apps, convert):
+    AIRequest = apps.get_model('AI_API', 'AIRequest')
+    changed = []
+    for ai_request in AIRequest.objects.only('id', 'image_urls').iterator(chunk_size=BATCH_SIZE):
+        image_urls = [convert(item) for item in ai_request.image_urls or []]
+        if image_urls != ai_request.image_urls:
+            ai_request.image_urls = image_urls
+            changed.append(ai_request)
+        if len(changed) >= BATCH_SIZE:
+            AIRequest.objects.bulk_update(changed, ['image_urls'])
+            changed = []
+    if changed:
+        AIRequest.objects.bulk_update(changed, ['image_urls'])
+
+
+def externalize_images(apps, schema_editor):
+    """Mueve las data URLs guardadas al almacén de blobs y deja solo la referencia."""
+    _rewrite_image_urls(apps, _store_image)
+
+
+def inline_images(apps, schema_editor):
+    _rewrite_image_urls(apps, _resolve_image_url)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI_API', '0004_airequest_job_queue'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='airequest',
+            name='image_urls',
+            field=models.JSONField(blank=True, default=list, help_text='URLs de imágenes enviadas; las data URLs se guardan como referencias al almacén (AI_API.blob_store)'),
+        ),
+        migrations.RunPython(externalize_images, inline_images),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI_API', '0005_airequest_image_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiconfiguration',
+            name='max_concurrent_requests',
+            field=models.PositiveIntegerField(default=8, help_text='Requests simultáneas que el balanceador envía a este endpoint'),
+        ),
+    ]
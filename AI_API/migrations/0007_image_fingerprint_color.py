@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI_API', '0006_aiconfiguration_max_concurrent_requests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='airequest',
+            name='perceptual_color',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analyzedimage',
+            name='color',
+            field=models.IntegerField(blank=True, help_text='Color medio RGB (0xRRGGBB)', null=True),
+        ),
+    ]
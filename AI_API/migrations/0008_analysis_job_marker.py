@@ -0,0 +1,75 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:40
+
+import uuid
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 500
+
+
+def assign_public_ids(apps, schema_editor):
+    AIRequest = apps.get_model('AI_API', 'AIRequest')
+    changed = []
+    for ai_request in AIRequest.objects.filter(public_id__isnull=True).only('id').iterator(chunk_size=BATCH_SIZE):
+        ai_request.public_id = uuid.uuid4()
+        changed.append(ai_request)
+        if len(changed) >= BATCH_SIZE:
+            AIRequest.objects.bulk_update(changed, ['public_id'])
+            changed = []
+    if changed:
+        AIRequest.objects.bulk_update(changed, ['public_id'])
+
+
+def mark_jobs(apps, schema_editor):
+    """
+    Los trabajos compartían request_type='product_analysis' con el log de
+    Gemma3Service, que dejaba en processing las llamadas que fallaban. Las
+    filas en processing se dan por fallidas; de las pending solo son trabajos
+    las que llegaron a tener intentos, callback o huella.
+    """
+    AIRequest = apps.get_model('AI_API', 'AIRequest')
+    legacy = AIRequest.objects.filter(request_type='product_analysis')
+    legacy.filter(
+        models.Q(status='pending') & (
+            models.Q(attempts__gt=0) | ~models.Q(callback_url='') | models.Q(perceptual_hash__isnull=False)
+        )
+    ).update(request_type='analysis_job')
+    legacy.filter(status__in=['pending', 'processing']).update(
+        status='failed',
+        error_message='Interrumpido: registro anterior a la cola de trabajos',
+        locked_by='',
+        locked_at=None,
+    )
+
+
+def unmark_jobs(apps, schema_editor):
+    AIRequest = apps.get_model('AI_API', 'AIRequest')
+    AIRequest.objects.filter(request_type='analysis_job').update(request_type='product_analysis')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI_API', '0007_image_fingerprint_color'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='airequest',
+            name='public_id',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(assign_public_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='airequest',
+            name='public_id',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='airequest',
+            name='request_type',
+            field=models.CharField(choices=[('product_description', 'Descripción de Producto'), ('image_analysis', 'Análisis de Imagen'), ('text_generation', 'Generación de Texto'), ('chat', 'Chat Conversacional'), ('product_analysis', 'Análisis de Producto'), ('analysis_job', 'Trabajo de Análisis')], default='chat', max_length=20),
+        ),
+        migrations.RunPython(mark_jobs, unmark_jobs),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:05
+
+import mimetypes
+
+from django.core.files.storage import default_storage, storages
+from django.db import migrations
+
+
+# Antes de esta migración los blobs vivían en MEDIA_ROOT (servido en /media/)
+PUBLIC_PREFIX = 'ai_images'
+
+
+def _blob_names(apps):
+    AIRequest = apps.get_model('AI_API', 'AIRequest')
+    names = set()
+    for image_urls in AIRequest.objects.values_list('image_urls', flat=True).iterator(chunk_size=500):
+        for item in image_urls or []:
+            if isinstance(item, dict) and 'sha256' in item:
+                extension = mimetypes.guess_extension(item['content_type']) or '.bin'
+                names.add(f"{item['sha256'][:2]}/{item['sha256']}{extension}")
+    return names
+
+
+def _move(source, source_name, target, target_name):
+    if not source.exists(source_name):
+        return
+    if not target.exists(target_name):
+        with source.open(source_name, 'rb') as blob:
+            target.save(target_name, blob)
+    source.delete(source_name)
+
+
+def move_to_private_storage(apps, schema_editor):
+    for name in _blob_names(apps):
+        _move(default_storage, f'{PUBLIC_PREFIX}/{name}', storages['ai_blobs'], name)
+
+
+def move_to_media(apps, schema_editor):
+    for name in _blob_names(apps):
+        _move(storages['ai_blobs'], name, default_storage, f'{PUBLIC_PREFIX}/{name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AI_API', '0009_analyzedimage_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_to_private_storage, move_to_media),
+    ]
@@ -3,10 +3,11 @@
 Servicio de IA Mock para desarrollo y testing
 """
 
+import asyncio
 import json
 import time
 import random
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterator, List, Any, Optional
 
 class MockAIService:
     """
@@ -25,12 +26,34 @@ class MockAIService:
         """
         Genera una respuesta mock basada en el prompt
         """
-        start_time = time.time()
-        
         # Simular tiempo de procesamiento
         processing_time = random.uniform(1.0, 3.0)
         time.sleep(min(processing_time, 0.1))  # Solo sleep real si es muy corto
         
+        return self._build_result(prompt, request_type, processing_time)
+    
+    async def agenerate_response(self, prompt: str, image_urls: List[str] = None,
+                                 max_tokens: int = None, temperature: float = None,
+                                 request_type: str = 'chat', user=None) -> Dict[str, Any]:
+        """
+        Versión async: la espera simulada no bloquea el event loop
+        """
+        processing_time = random.uniform(1.0, 3.0)
+        await asyncio.sleep(min(processing_time, 0.1))
+        
+        return self._build_result(prompt, request_type, processing_time)
+    
+    def stream_response(self, prompt: str, image_urls: List[str] = None,
+                        max_tokens: int = None, temperature: float = None) -> Iterator[str]:
+        """
+        Simula el stream de tokens del modelo con el análisis de producto mock
+        """
+        response = self._generate_product_analysis() if image_urls else self._generate_general_response(prompt)
+        for i in range(0, len(response), 8):
+            time.sleep(0.01)
+            yield response[i:i + 8]
+    
+    def _build_result(self, prompt: str, request_type: str, processing_time: float) -> Dict[str, Any]:
         # Generar respuesta basada en el tipo de request
         if request_type == 'product_analysis':
             response = self._generate_product_analysis()
@@ -86,6 +109,9 @@ class MockAIService:
             'endpoint': 'mock-service',
             'message': 'Mock AI service is running'
         }
+    
+    async def ahealth_check(self) -> Dict[str, Any]:
+        return self.health_check()
 
 # Función para crear el cliente mock
 def create_mock_ai_client():
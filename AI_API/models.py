@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -11,6 +13,8 @@ class AIRequest(models.Model):
         ('image_analysis', 'Análisis de Imagen'),
         ('text_generation', 'Generación de Texto'),
         ('chat', 'Chat Conversacional'),
+        ('product_analysis', 'Análisis de Producto'),
+        ('analysis_job', 'Trabajo de Análisis'),
     ]
     
     STATUS_CHOICES = [
@@ -20,13 +24,18 @@ class AIRequest(models.Model):
         ('failed', 'Fallido'),
     ]
     
+    # Identificador público: request_id de la API y token de consulta de los trabajos
+    public_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     request_type = models.CharField(max_length=20, choices=REQUEST_TYPES, default='chat')
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     
     # Datos de entrada
     prompt = models.TextField(help_text="Prompt o texto enviado al modelo")
-    image_urls = models.JSONField(default=list, blank=True, help_text="URLs de imágenes enviadas")
+    image_urls = models.JSONField(
+        default=list, blank=True,
+        help_text="URLs de imágenes enviadas; las data URLs se guardan como referencias al almacén (AI_API.blob_store)"
+    )
     model_name = models.CharField(max_length=100, default='google/gemma-3-4b-it')
     max_tokens = models.IntegerField(default=256)
     temperature = models.FloatField(default=0.7)
@@ -36,6 +45,15 @@ class AIRequest(models.Model):
     response_tokens = models.IntegerField(default=0)
     processing_time = models.FloatField(default=0.0, help_text="Tiempo de procesamiento en segundos")
     
+    # Cola de trabajos (ver AI_API.jobs)
+    result = models.JSONField(blank=True, null=True, help_text="Resultado parseado del análisis en segundo plano")
+    perceptual_hash = models.BigIntegerField(blank=True, null=True)
+    perceptual_color = models.IntegerField(blank=True, null=True)
+    callback_url = models.URLField(blank=True, help_text="URL notificada (POST) al terminar el trabajo")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    
     # Metadatos
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -45,6 +63,9 @@ class AIRequest(models.Model):
         ordering = ['-created_at']
         verbose_name = 'AI Request'
         verbose_name_plural = 'AI Requests'
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='airequest_status_created_idx'),
+        ]
     
     def __str__(self):
         return f"AI Request {self.id} - {self.request_type} - {self.status}"
@@ -56,6 +77,20 @@ class AIRequest(models.Model):
     @property
     def is_multimodal(self):
         return self.has_images and self.prompt
+    
+    def resolved_image_urls(self):
+        """Imágenes tal como se enviaron al modelo (data URLs leídas del almacén)"""
+        from .blob_store import resolve_image_url
+        return [resolve_image_url(item) for item in self.image_urls]
+    
+    def image_file_urls(self):
+        """URLs de las imágenes (las del almacén, vía la vista del admin), sin leer su contenido"""
+        from django.urls import reverse
+        from .blob_store import is_blob_ref
+        return [
+            reverse('admin:AI_API_airequest_image', args=[self.pk, index]) if is_blob_ref(item) else item
+            for index, item in enumerate(self.image_urls)
+        ]
 
 
 # Eliminado AIUsageStats - No necesario para funcionalidad básica
@@ -72,6 +107,9 @@ class AIConfiguration(models.Model):
     max_tokens_default = models.IntegerField(default=256)
     temperature_default = models.FloatField(default=0.7)
     timeout_seconds = models.IntegerField(default=300)
+    max_concurrent_requests = models.PositiveIntegerField(
+        default=8, help_text="Requests simultáneas que el balanceador envía a este endpoint"
+    )
     is_active = models.BooleanField(default=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
@@ -85,4 +123,27 @@ class AIConfiguration(models.Model):
         return f"AI Config: {self.name} - {'Active' if self.is_active else 'Inactive'}"
 
 
+class AnalyzedImage(models.Model):
+    """
+    Huella perceptual (dHash) de una imagen ya analizada junto con el análisis
+    obtenido, para reutilizarlo con fotos casi idénticas
+    """
+    dhash = models.BigIntegerField(help_text="dHash de 64 bits (almacenado con signo)")
+    color = models.IntegerField(blank=True, null=True, help_text="Color medio RGB (0xRRGGBB)")
+    # Solo se reutiliza para el mismo usuario
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    model_name = models.CharField(max_length=100)
+    prompt_version = models.CharField(max_length=20)
+    analysis = models.JSONField(help_text="Resultado de analyze_product_complete")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Analyzed Image'
+        verbose_name_plural = 'Analyzed Images'
+
+    def __str__(self):
+        return f"Analyzed Image {self.id} - {self.dhash & 0xFFFFFFFFFFFFFFFF:016x}"
+
+
 # Eliminado ProductAIGeneration - No necesario para funcionalidad básica
\ No newline at end of file
@@ -0,0 +1,259 @@
+"""
+Hash perceptual (dHash) e índice multi-índice para detectar imágenes casi idénticas.
+
+Dos fotos del mismo producto a distinta resolución o compresión JPEG producen
+dHashes a pocos bits de distancia de Hamming, así que se puede reutilizar el
+análisis guardado en vez de volver a llamar al modelo de visión.
+
+El dHash solo mira la forma en escala de grises, así que la huella
+(ImageFingerprint) lleva además el color medio, que también tiene que
+coincidir: la misma foto en otro color es otro producto. Las imágenes casi
+lisas no tienen huella (todas dan dHash 0); para ellas solo vale la caché
+por contenido exacto.
+
+La reutilización es por usuario: una foto parecida de otra persona no recibe
+su análisis (que puede describir un producto que nunca publicó).
+"""
+import threading
+import time
+from itertools import combinations
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+from PIL import Image, ImageStat
+
+HASH_SIZE = 8  # 8x8 = hash de 64 bits
+# Diferencia mínima (0-255) en algún canal de la miniatura para que la imagen tenga textura
+LOW_TEXTURE_RANGE = 16
+
+
+class ImageFingerprint(NamedTuple):
+    """dHash de 64 bits y color medio RGB empaquetado en 24 bits (0xRRGGBB)."""
+    dhash: int
+    color: int
+
+
+def dhash(image: Image.Image, hash_size: int = HASH_SIZE) -> int:
+    """
+    Difference hash: reduce a (hash_size+1) x hash_size en escala de grises y
+    compara cada píxel con su vecino de la derecha.
+    """
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    width = hash_size + 1
+    for row in range(hash_size):
+        offset = row * width
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def fingerprint(image: Image.Image) -> Optional[ImageFingerprint]:
+    """Huella perceptual de la imagen, o None si es demasiado lisa para compararla."""
+    # Color y textura sobre una miniatura RGB: es barato y no depende de la resolución
+    stats = ImageStat.Stat(image.convert('RGB').resize((16, 16), Image.Resampling.BOX))
+    if max(high - low for low, high in stats.extrema) < LOW_TEXTURE_RANGE:
+        return None
+    red, green, blue = (round(channel) for channel in stats.mean)
+    return ImageFingerprint(dhash(image), (red << 16) | (green << 8) | blue)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def color_distance(a: int, b: int) -> int:
+    """Mayor diferencia entre canales (0-255) de dos colores 0xRRGGBB."""
+    return max(abs(((a >> shift) & 0xFF) - ((b >> shift) & 0xFF)) for shift in (16, 8, 0))
+
+
+def to_signed64(value: int) -> int:
+    """Convierte un hash de 64 bits sin signo al rango de BigIntegerField."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def from_signed64(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class MultiIndexHash:
+    """
+    Índice de hashing multi-índice (Norouzi et al.) sobre distancia de Hamming.
+
+    El hash de 64 bits se parte en `chunks` trozos y cada trozo indexa una
+    tabla. Por el principio del palomar, si dos hashes están a distancia <= r
+    al menos un trozo está a distancia <= r // chunks, así que basta con sondear
+    los vecinos cercanos de cada trozo y verificar los candidatos.
+    """
+
+    def __init__(self, chunks: int = 4, bits: int = 64):
+        self.chunks = chunks
+        self.chunk_bits = bits // chunks
+        self._mask = (1 << self.chunk_bits) - 1
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in range(chunks)]
+        self._entries: List[Tuple[int, Any]] = []
+
+    def _split(self, hash_value: int) -> List[int]:
+        return [(hash_value >> (i * self.chunk_bits)) & self._mask for i in range(self.chunks)]
+
+    def add(self, hash_value: int, value: Any):
+        position = len(self._entries)
+        self._entries.append((hash_value, value))
+        for table, part in zip(self._tables, self._split(hash_value)):
+            table.setdefault(part, []).append(position)
+
+    def _neighbours(self, part: int, radius: int):
+        yield part
+        for r in range(1, radius + 1):
+            for bits in combinations(range(self.chunk_bits), r):
+                flipped = part
+                for bit in bits:
+                    flipped ^= 1 << bit
+                yield flipped
+
+    def search(self, hash_value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """Devuelve [(distancia, valor)] ordenado de más cercano a más lejano."""
+        radius = max_distance // self.chunks
+        seen = set()
+        results = []
+        for table, part in zip(self._tables, self._split(hash_value)):
+            for probe in self._neighbours(part, radius):
+                for position in table.get(probe, ()):
+                    if position in seen:
+                        continue
+                    seen.add(position)
+                    stored_hash, value = self._entries[position]
+                    distance = hamming(hash_value, stored_hash)
+                    if distance <= max_distance:
+                        results.append((distance, value))
+        results.sort(key=lambda item: item[0])
+        return results
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class NearDuplicateIndex:
+    """
+    Índice en memoria de los AnalyzedImage guardados, un MultiIndexHash por
+    (modelo, versión de prompt). Las filas nuevas de otros procesos se
+    incorporan de forma incremental: como mucho AI_PHASH_SYNC_BATCH filas cada
+    AI_PHASH_SYNC_INTERVAL segundos, con la consulta fuera del lock de las
+    búsquedas. La carga inicial corre en un hilo de fondo (warm_in_background)
+    y mientras tanto las búsquedas usan lo que ya se cargó.
+
+    Las filas sin color (anteriores a la huella con color) o sin usuario
+    nunca coinciden.
+    """
+
+    def __init__(self):
+        self._indexes: Dict[Tuple[str, str], MultiIndexHash] = {}
+        self._last_id = 0
+        # _lock protege los índices; _sync_lock deja una sola sincronización a la vez
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._synced_at: Optional[float] = None
+        self._warm_thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _batch_size() -> int:
+        return getattr(settings, 'AI_PHASH_SYNC_BATCH', 5000)
+
+    def _load_batch(self) -> int:
+        """Lee el siguiente bloque de filas (sin el lock de búsqueda) y lo agrega al índice."""
+        from .models import AnalyzedImage
+
+        rows = list(
+            AnalyzedImage.objects.filter(id__gt=self._last_id)
+            .order_by('id')
+            .values_list('id', 'dhash', 'color', 'user_id', 'model_name', 'prompt_version')[:self._batch_size()]
+        )
+        with self._lock:
+            for row_id, signed_hash, color, user_id, model_name, prompt_version in rows:
+                if color is not None and user_id is not None:
+                    self._index(model_name, prompt_version).add(from_signed64(signed_hash), (row_id, color, user_id))
+            if rows:
+                self._last_id = rows[-1][0]
+        return len(rows)
+
+    def refresh(self):
+        """Sincronización acotada desde el hilo del request; no espera a otra en curso."""
+        interval = getattr(settings, 'AI_PHASH_SYNC_INTERVAL', 1.0)
+        if self._synced_at is not None and time.monotonic() - self._synced_at < interval:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._load_batch()
+            self._synced_at = time.monotonic()
+        finally:
+            self._sync_lock.release()
+
+    def warm(self):
+        """Carga todas las filas pendientes por bloques."""
+        with self._sync_lock:
+            while self._load_batch() == self._batch_size():
+                pass
+            self._synced_at = time.monotonic()
+
+    def warm_in_background(self):
+        """Arranca (una vez) la carga inicial en un hilo de fondo."""
+        with self._lock:
+            if self._warm_thread is not None:
+                return
+            self._warm_thread = threading.Thread(target=self._warm_and_close, name='phash-warm', daemon=True)
+        self._warm_thread.start()
+
+    def _warm_and_close(self):
+        try:
+            self.warm()
+        except Exception as e:
+            print(f"⚠️ Near-duplicate index warm-up failed: {str(e)}")
+        finally:
+            connection.close()
+
+    def _index(self, model_name: str, prompt_version: str) -> MultiIndexHash:
+        return self._indexes.setdefault((model_name, prompt_version), MultiIndexHash())
+
+    def find(self, image: ImageFingerprint, model_name: str, prompt_version: str,
+             max_distance: int, max_color_distance: int, user_id: Optional[int]) -> Optional[Tuple[int, Any]]:
+        """
+        Devuelve (distancia, AnalyzedImage) del vecino más cercano del mismo
+        usuario cuyo color medio también coincide, o None.
+        """
+        from .models import AnalyzedImage
+
+        if user_id is None:
+            return None
+        if getattr(settings, 'AI_PHASH_WARM_IN_BACKGROUND', True):
+            self.warm_in_background()
+        self.refresh()
+        with self._lock:
+            matches = self._index(model_name, prompt_version).search(image.dhash, max_distance)
+        for distance, (row_id, color, owner_id) in matches:
+            if owner_id == user_id and color_distance(image.color, color) <= max_color_distance:
+                stored = AnalyzedImage.objects.filter(id=row_id).first()
+                return (distance, stored) if stored else None
+        return None
+
+    def add(self, image: ImageFingerprint, sha256: str, model_name: str, prompt_version: str,
+            analysis: Dict[str, Any], user_id: Optional[int]):
+        from .models import AnalyzedImage
+
+        if user_id is None:
+            return
+        AnalyzedImage.objects.create(
+            dhash=to_signed64(image.dhash),
+            color=image.color,
+            user_id=user_id,
+            sha256=sha256,
+            model_name=model_name,
+            prompt_version=prompt_version,
+            analysis=analysis,
+        )
+        # La fila nueva se incorpora al índice en la próxima sincronización
+
+
+near_duplicate_index = NearDuplicateIndex()
@@ -21,3 +21,22 @@ class AIGenerationClient(Protocol):
         ...
 
 
+class AsyncAIGenerationClient(Protocol):
+    """
+    Variante async del puerto para vistas ASGI: la espera al modelo no ocupa
+    un hilo del servidor.
+    """
+
+    async def agenerate_response(
+        self,
+        prompt: str,
+        image_urls: Optional[List[str]] = None,
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        request_type: str = "chat",
+        user: Any = None,
+    ) -> Dict[str, Any]:
+        ...
+
+    async def ahealth_check(self) -> Dict[str, Any]:
+        ...
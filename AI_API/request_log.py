@@ -0,0 +1,93 @@
+"""
+Escritura diferida del log de requests al modelo (AIRequest).
+
+Gemma3Service antes hacía tres escrituras por llamada (create, save a
+processing y save completo con la respuesta), todas reescribiendo el prompt y
+las imágenes. Ahora la llamada solo arma el AIRequest final en memoria y lo
+encola; un hilo de fondo lo inserta con bulk_create cuando el buffer llega a
+AI_REQUEST_LOG_BATCH_SIZE o cada AI_REQUEST_LOG_FLUSH_INTERVAL segundos. Al
+terminar el proceso se vacía lo pendiente (atexit).
+"""
+import atexit
+import threading
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .blob_store import externalize_image_urls
+from .models import AIRequest
+
+
+class RequestLogWriter:
+    """
+    Buffer en memoria de AIRequest terminados. record() nunca toca la base de
+    datos; las inserciones ocurren en el hilo flusher o en flush().
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, flush_interval: Optional[float] = None,
+                 max_buffer: Optional[int] = None):
+        self.batch_size = batch_size or getattr(settings, 'AI_REQUEST_LOG_BATCH_SIZE', 50)
+        self.flush_interval = flush_interval or getattr(settings, 'AI_REQUEST_LOG_FLUSH_INTERVAL', 2.0)
+        self.max_buffer = max_buffer or getattr(settings, 'AI_REQUEST_LOG_MAX_BUFFER', 5000)
+        self.dropped = 0
+        self._buffer: List[AIRequest] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def record(self, ai_request: AIRequest):
+        """Encola el registro terminado; no bloquea en la base de datos."""
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                # Base de datos caída o muy lenta: se descarta el registro más antiguo
+                self._buffer.pop(0)
+                self.dropped += 1
+            self._buffer.append(ai_request)
+            pending = len(self._buffer)
+            if self._thread is None:
+                self._start()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Inserta todo lo pendiente; devuelve cuántos registros se guardaron."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            try:
+                for ai_request in batch:
+                    # Las imágenes van al almacén de blobs; la fila guarda solo su digest
+                    ai_request.image_urls = externalize_image_urls(ai_request.image_urls)
+                AIRequest.objects.bulk_create(batch, batch_size=self.batch_size)
+            except Exception as e:
+                print(f"⚠️ Request log flush failed ({len(batch)} registros): {str(e)}")
+                with self._lock:
+                    # Se reintenta en el próximo flush sin superar max_buffer
+                    room = self.max_buffer - len(self._buffer)
+                    if room > 0:
+                        self._buffer[:0] = batch[-room:]
+                return 0
+            return len(batch)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='ai-request-log', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            close_old_connections()
+
+
+request_log_writer = RequestLogWriter()
+atexit.register(request_log_writer.flush)
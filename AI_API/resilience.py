@@ -0,0 +1,460 @@
+"""
+Circuit breaker, requests con cobertura (hedging) y deadline por request para
+los clientes de IA.
+
+Cuando el endpoint de Lightning se degrada, cada llamada esperaba el
+timeout_seconds completo antes de fallar y los workers se acumulaban. Con
+ResilientAIClient:
+
+- Un CircuitBreaker por endpoint (compartido entre hilos) se abre cuando la
+  tasa de fallos o de llamadas lentas en la ventana supera el umbral. Mientras
+  está abierto las llamadas fallan al instante; pasado AI_BREAKER_OPEN_SECONDS
+  deja pasar una llamada de prueba (half-open).
+- Si hay un endpoint secundario (segunda AIConfiguration activa) y el primario
+  no respondió tras su p95 de latencia, se lanza la misma request al
+  secundario y gana la primera respuesta exitosa.
+- RequestDeadlineMiddleware fija un deadline por request HTTP; los clientes
+  recortan sus timeouts con bounded_timeout() para no seguir esperando al
+  modelo cuando el cliente HTTP ya se fue.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar('ai_request_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def set_deadline(seconds: float):
+    """Fija el deadline del contexto actual; devuelve el token para reset_deadline."""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    return _deadline.set(min(deadline, current) if current is not None else deadline)
+
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """Segundos hasta el deadline del request actual (None si no hay deadline)."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def bounded_timeout(timeout: float) -> float:
+    """Recorta un timeout al tiempo que le queda al request; falla si ya venció."""
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceeded("Se agotó el tiempo del request")
+    return min(timeout, remaining)
+
+
+def stream_with_deadline(iterable):
+    """
+    Envuelve el cuerpo de un StreamingHttpResponse para que conserve el
+    deadline del request. RequestDeadlineMiddleware lo resetea al devolver la
+    respuesta, antes de que Django empiece a iterar el stream; el deadline se
+    captura al crear la respuesta (en la vista) y se reaplica en cada paso.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return iterable
+
+    def generator():
+        iterator = iter(iterable)
+        try:
+            while True:
+                token = _deadline.set(deadline)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    _deadline.reset(token)
+                yield item
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                token = _deadline.set(deadline)
+                try:
+                    close()
+                finally:
+                    _deadline.reset(token)
+
+    return generator()
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+class CircuitBreaker:
+    """
+    Breaker por ventana deslizante de las últimas `window` llamadas. Una
+    llamada cuenta como fallo si no fue exitosa o si tardó más de
+    slow_call_seconds.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, window: Optional[int] = None, min_calls: Optional[int] = None,
+                 failure_rate: Optional[float] = None, slow_call_seconds: Optional[float] = None,
+                 open_seconds: Optional[float] = None):
+        self.name = name
+        self.window = window or _setting('AI_BREAKER_WINDOW', 20)
+        self.min_calls = min_calls or _setting('AI_BREAKER_MIN_CALLS', 5)
+        self.failure_rate = failure_rate or _setting('AI_BREAKER_FAILURE_RATE', 0.5)
+        self.slow_call_seconds = slow_call_seconds or _setting('AI_BREAKER_SLOW_CALL_SECONDS', 30)
+        self.open_seconds = open_seconds or _setting('AI_BREAKER_OPEN_SECONDS', 30)
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=self.window)
+        self._latencies = deque(maxlen=200)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Indica si se puede llamar al endpoint; en half-open solo pasa una llamada."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record(self, success: bool, duration: float):
+        failed = not success or duration >= self.slow_call_seconds
+        with self._lock:
+            if success:
+                self._latencies.append(duration)
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+                if failed:
+                    self._open()
+                else:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                    print(f"🟢 Circuit {self.name}: closed")
+                return
+            self._outcomes.append(failed)
+            if (self.state == self.CLOSED and len(self._outcomes) >= self.min_calls
+                    and sum(self._outcomes) / len(self._outcomes) >= self.failure_rate):
+                self._open()
+
+    def abandon(self, duration: float):
+        """
+        La llamada se canceló sin resultado (perdedora del hedge o deadline):
+        cuenta como fallo solo si ya era lenta; si no, libera la sonda de
+        half-open para que otra llamada pueda probar el endpoint.
+        """
+        if duration >= self.slow_call_seconds:
+            self.record(False, duration)
+            return
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def _open(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        print(f"🔴 Circuit {self.name}: open for {self.open_seconds}s")
+
+    def latency_percentile(self, q: float, min_samples: int = 20) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            failures = sum(self._outcomes)
+            return {
+                'name': self.name,
+                'state': self.state,
+                'calls': len(self._outcomes),
+                'failure_rate': round(failures / len(self._outcomes), 4) if self._outcomes else 0.0,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_hedge_executor = None
+_hedge_slots = None
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Breaker compartido por proceso para un endpoint."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def breaker_snapshots() -> List[Dict[str, Any]]:
+    return [breaker.snapshot() for breaker in list(_breakers.values())]
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _hedge_executor, _hedge_slots
+    if _hedge_executor is None:
+        with _breakers_lock:
+            if _hedge_executor is None:
+                max_workers = _setting('AI_HEDGE_MAX_WORKERS', 32)
+                _hedge_slots = threading.BoundedSemaphore(max_workers)
+                _hedge_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-hedge')
+    return _hedge_executor
+
+
+def _reserve_hedge_thread() -> bool:
+    """
+    Reserva un hilo libre del pool de hedging sin esperar. Si el pool está
+    lleno la llamada sigue en el hilo que la hizo, sin hedging: el tamaño del
+    pool limita cuántas llamadas se cubren a la vez, no cuántas se hacen.
+    """
+    _executor()
+    return _hedge_slots.acquire(blocking=False)
+
+
+def endpoint_key(client) -> str:
+    config = getattr(client, 'config', None)
+    return (getattr(config, 'lightning_endpoint', None) or getattr(client, 'endpoint', None)
+            or type(client).__name__)
+
+
+def _failure(error: str, **extra) -> Dict[str, Any]:
+    return {'success': False, 'error': error, 'processing_time': 0.0, 'request_id': None, **extra}
+
+
+class ResilientAIClient:
+    """
+    Decora un AIGenerationClient con breaker, hedging a un secundario y
+    deadline. Si todo falla y hay `fallback` (p.ej. el mock) se usa ese.
+    Los demás atributos (config, model_name, health_check...) se delegan al
+    cliente primario.
+    """
+
+    def __init__(self, primary, secondary=None, fallback=None):
+        self.primary = primary
+        self.secondary = secondary
+        self.fallback = fallback
+        self.breaker = get_breaker(endpoint_key(primary))
+        self.secondary_breaker = get_breaker(endpoint_key(secondary)) if secondary is not None else None
+
+    def __getattr__(self, name):
+        return getattr(self.primary, name)
+
+    def _hedge_delay(self) -> Optional[float]:
+        if self.secondary is None or not _setting('AI_HEDGE_ENABLED', True):
+            return None
+        p95 = self.breaker.latency_percentile(0.95)
+        if p95 is None:
+            return _setting('AI_HEDGE_DEFAULT_DELAY', 10.0)
+        return max(p95, _setting('AI_HEDGE_MIN_DELAY', 0.5))
+
+    @staticmethod
+    def _deadline_left() -> Optional[float]:
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded("Se agotó el tiempo del request")
+        return remaining
+
+    def _call(self, client, breaker: CircuitBreaker, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.monotonic()
+        try:
+            result = client.generate_response(**kwargs)
+        except Exception as e:
+            result = _failure(f"Unexpected error: {str(e)}")
+        breaker.record(bool(result.get('success')), time.monotonic() - start)
+        return result
+
+    def _submit(self, client, breaker, kwargs):
+        """Lanza la llamada en el pool; requiere un hilo reservado con _reserve_hedge_thread."""
+        # Copiar el contexto para que el deadline llegue al hilo
+        context = contextvars.copy_context()
+        try:
+            future = _executor().submit(context.run, self._call, client, breaker, kwargs)
+        except BaseException:
+            _hedge_slots.release()
+            raise
+        future.add_done_callback(lambda _: _hedge_slots.release())
+        return future
+
+    def generate_response(self, prompt: str, image_urls: List[str] = None,
+                          max_tokens: int = None, temperature: float = None,
+                          request_type: str = 'chat', user=None) -> Dict[str, Any]:
+        kwargs = dict(prompt=prompt, image_urls=image_urls, max_tokens=max_tokens,
+                      temperature=temperature, request_type=request_type, user=user)
+        try:
+            result = self._generate(kwargs)
+        except DeadlineExceeded as e:
+            result = _failure(str(e), deadline_exceeded=True)
+        if not result.get('success') and self.fallback is not None:
+            return self.fallback.generate_response(**kwargs)
+        return result
+
+    def _generate(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        result = None
+        remaining = self._deadline_left()
+        if self.breaker.allow():
+            delay = self._hedge_delay()
+            if delay is not None and _reserve_hedge_thread():
+                # Con hedging el primario va al pool para poder quedarse con
+                # la primera respuesta exitosa de los dos endpoints
+                futures = [self._submit(self.primary, self.breaker, kwargs)]
+                done, _ = wait(futures, timeout=min(delay, remaining) if remaining is not None else delay)
+                if not done and _reserve_hedge_thread():
+                    if self.secondary_breaker.allow():
+                        print(f"⏱️ Hedging to secondary endpoint after {delay:.2f}s")
+                        futures.append(self._submit(self.secondary, self.secondary_breaker, kwargs))
+                    else:
+                        _hedge_slots.release()
+                result = self._first_success(futures)
+            else:
+                # Sin secundario al que cubrir la llamada corre en el hilo que la hizo
+                result = self._call(self.primary, self.breaker, kwargs)
+            if result.get('success'):
+                return result
+        else:
+            result = _failure(f"Circuit open for {self.breaker.name}", circuit_open=True)
+
+        # Reintento en el secundario si el primario falló o tiene el circuito abierto
+        if self.secondary is not None:
+            self._deadline_left()
+            if self.secondary_breaker.allow():
+                return self._call(self.secondary, self.secondary_breaker, kwargs)
+        return result
+
+    def _first_success(self, futures) -> Dict[str, Any]:
+        pending = set(futures)
+        result = None
+        while pending:
+            done, pending = wait(pending, timeout=self._deadline_left(), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded("Se agotó el tiempo del request")
+            for future in done:
+                result = future.result()
+                if result.get('success'):
+                    return result
+        return result
+
+    async def agenerate_response(self, prompt: str, image_urls: List[str] = None,
+                                 max_tokens: int = None, temperature: float = None,
+                                 request_type: str = 'chat', user=None) -> Dict[str, Any]:
+        """Versión async: mismas reglas, con tareas de asyncio en vez de hilos."""
+        kwargs = dict(prompt=prompt, image_urls=image_urls, max_tokens=max_tokens,
+                      temperature=temperature, request_type=request_type, user=user)
+        try:
+            result = await self._agenerate(kwargs)
+        except DeadlineExceeded as e:
+            result = _failure(str(e), deadline_exceeded=True)
+        if not result.get('success') and self.fallback is not None:
+            return await self._acall_client(self.fallback, kwargs)
+        return result
+
+    @staticmethod
+    async def _acall_client(client, kwargs):
+        agenerate = getattr(client, 'agenerate_response', None)
+        if agenerate is not None:
+            return await agenerate(**kwargs)
+        return await sync_to_async(client.generate_response, thread_sensitive=False)(**kwargs)
+
+    async def _acall(self, client, breaker: CircuitBreaker, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.monotonic()
+        try:
+            result = await self._acall_client(client, kwargs)
+        except asyncio.CancelledError:
+            # CancelledError no es Exception: sin esto una sonda cancelada dejaría el breaker trabado
+            breaker.abandon(time.monotonic() - start)
+            raise
+        except Exception as e:
+            result = _failure(f"Unexpected error: {str(e)}")
+        breaker.record(bool(result.get('success')), time.monotonic() - start)
+        return result
+
+    async def _agenerate(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        result = None
+        remaining = self._deadline_left()
+        if self.breaker.allow():
+            tasks = [asyncio.ensure_future(self._acall(self.primary, self.breaker, kwargs))]
+            delay = self._hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=min(delay, remaining) if remaining is not None else delay)
+                if not done and self.secondary_breaker.allow():
+                    tasks.append(asyncio.ensure_future(self._acall(self.secondary, self.secondary_breaker, kwargs)))
+            result = await self._afirst_success(tasks)
+            if result.get('success'):
+                return result
+        else:
+            result = _failure(f"Circuit open for {self.breaker.name}", circuit_open=True)
+
+        if self.secondary is not None:
+            self._deadline_left()
+            if self.secondary_breaker.allow():
+                return await self._afirst_success(
+                    [asyncio.ensure_future(self._acall(self.secondary, self.secondary_breaker, kwargs))]
+                )
+        return result
+
+    async def _afirst_success(self, tasks) -> Dict[str, Any]:
+        pending = set(tasks)
+        result = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=self._deadline_left(), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise DeadlineExceeded("Se agotó el tiempo del request")
+                for task in done:
+                    result = task.result()
+                    if result.get('success'):
+                        return result
+            return result
+        finally:
+            # La request perdedora del hedge no sigue ocupando una conexión
+            for task in pending:
+                task.cancel()
+
+    def stream_response(self, prompt: str, image_urls: Optional[List[str]] = None,
+                        max_tokens: Optional[int] = None, temperature: Optional[float] = None):
+        """Stream del primario protegido por el breaker (sin hedging: los tokens ya se enviaron)."""
+        stream = getattr(self.primary, 'stream_response', None)
+        if stream is None:
+            raise AttributeError('stream_response')
+        if not self.breaker.allow():
+            raise RuntimeError(f"Circuit open for {self.breaker.name}")
+        start = time.monotonic()
+        success = False
+        try:
+            for text in stream(prompt, image_urls, max_tokens, temperature):
+                yield text
+            success = True
+        except GeneratorExit:
+            # El consumidor cortó el stream; no es un fallo del endpoint
+            success = True
+            raise
+        finally:
+            self.breaker.record(success, time.monotonic() - start)
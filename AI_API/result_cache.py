@@ -0,0 +1,80 @@
+"""
+Caché de resultados de análisis de productos, direccionada por contenido.
+
+La llave combina el SHA-256 de los bytes de la imagen normalizada, la versión
+del prompt y el nombre del modelo, así que volver a subir la misma foto no
+vuelve a llamar al modelo. Usa el framework de caché de Django (alias
+'ai_results'); el TTL y el tamaño máximo (desalojo LRU) se configuran en
+settings.CACHES.
+"""
+import base64
+import hashlib
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+CACHE_ALIAS = 'ai_results'
+KEY_PREFIX = 'ai:analysis'
+HITS_KEY = f'{KEY_PREFIX}:stats:hits'
+MISSES_KEY = f'{KEY_PREFIX}:stats:misses'
+
+
+def image_digest(image_url: str) -> str:
+    """
+    SHA-256 del contenido de la imagen. Para data URLs se decodifica el base64
+    y se hashean los bytes; para URLs normales se hashea la URL.
+    """
+    if image_url.startswith('data:') and ',' in image_url:
+        _, data = image_url.split(',', 1)
+        try:
+            return hashlib.sha256(base64.b64decode(data)).hexdigest()
+        except ValueError:
+            pass
+    return hashlib.sha256(image_url.encode('utf-8')).hexdigest()
+
+
+class AnalysisResultCache:
+    """
+    Guarda el resultado parseado de analyze_product_complete por contenido.
+    Solo se almacenan análisis exitosos.
+    """
+
+    def __init__(self, alias: str = CACHE_ALIAS, timeout: Optional[int] = None):
+        try:
+            self.cache = caches[alias]
+        except InvalidCacheBackendError:
+            self.cache = caches['default']
+        self.timeout = timeout if timeout is not None else getattr(settings, 'AI_RESULT_CACHE_TTL', 3600)
+
+    @staticmethod
+    def make_key(digest: str, prompt_version: str, model_name: str) -> str:
+        return f'{KEY_PREFIX}:{prompt_version}:{model_name}:{digest}'
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        result = self.cache.get(key)
+        self._incr(HITS_KEY if result is not None else MISSES_KEY)
+        return result
+
+    def set(self, key: str, result: Dict[str, Any]):
+        self.cache.set(key, result, self.timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.cache.get(HITS_KEY, 0)
+        misses = self.cache.get(MISSES_KEY, 0)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else 0.0,
+            'ttl_seconds': self.timeout,
+        }
+
+    def _incr(self, key: str):
+        # Los contadores no expiran; add() es atómico en los backends de Django
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, 1, None)
@@ -10,12 +10,13 @@ class AIRequestSerializer(serializers.ModelSerializer):
     user_username = serializers.CharField(source='user.username', read_only=True)
     has_images = serializers.BooleanField(read_only=True)
     is_multimodal = serializers.BooleanField(read_only=True)
+    image_files = serializers.ListField(source='image_file_urls', child=serializers.CharField(), read_only=True)
     
     class Meta:
         model = AIRequest
         fields = [
             'id', 'user', 'user_username', 'request_type', 'status',
-            'prompt', 'image_urls', 'model_name', 'max_tokens', 'temperature',
+            'prompt', 'image_urls', 'image_files', 'model_name', 'max_tokens', 'temperature',
             'response_text', 'response_tokens', 'processing_time',
             'created_at', 'updated_at', 'error_message',
             'has_images', 'is_multimodal'
@@ -1,11 +1,19 @@
+import re
 import requests
 import time
 import json
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, Iterator, List, Any, Optional, Tuple
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.utils import timezone
 from .models import AIRequest, AIConfiguration
 from .ports import AIGenerationClient
+from .result_cache import AnalysisResultCache, image_digest
+from .perceptual_hash import ImageFingerprint, near_duplicate_index
+from .request_log import request_log_writer
+from .config_registry import ai_config_registry
+from .resilience import bounded_timeout
+from .streaming_client import aiter_chat_deltas, get_async_http_client, get_pooled_session, httpx, iter_chat_deltas
 # Configuración directa desde settings
 LIGHTNING_AI_ENDPOINT = getattr(settings, 'LIGHTNING_AI_ENDPOINT', 'https://8001-01k4ap2fswtrsc3fyamsj261fp.cloudspaces.litng.ai')
 LIGHTNING_AI_API_KEY = getattr(settings, 'LIGHTNING_AI_API_KEY', 'gemma3-litserve')
@@ -14,45 +22,38 @@ DEFAULT_MAX_TOKENS = 256
 DEFAULT_TEMPERATURE = 0.7
 DEFAULT_TIMEOUT = 30  # Reducido para evitar timeouts
 
+# Cambiar la versión al modificar el prompt invalida los resultados cacheados
+PRODUCT_ANALYSIS_PROMPT_VERSION = 'v1'
+PRODUCT_ANALYSIS_PROMPT = """Analiza esta imagen de producto y genera información completa para un e-commerce. 
+        Responde SOLO en formato JSON con la siguiente estructura exacta:
+        {
+            "title": "Título atractivo del producto (máximo 60 caracteres)",
+            "description": "Descripción detallada y convincente del producto (máximo 200 palabras)",
+            "suggested_category": "Categoría más apropiada para este producto (debe ser una de: Ropa, Electrónicos, Hogar, Deportes, Libros, Juguetes, Belleza, Automotriz, Jardín, Oficina)",
+            "tags": "tag1, tag2, tag3, tag4, tag5",
+            "price_suggestion": "Precio estimado en USD basado en el producto"
+        }
+        
+        El título debe ser atractivo y optimizado para SEO.
+        La descripción debe destacar características clave y beneficios.
+        La categoría DEBE ser una de estas opciones exactas: Ropa, Electrónicos, Hogar, Deportes, Libros, Juguetes, Belleza, Automotriz, Jardín, Oficina.
+        Los tags deben ser palabras clave útiles para búsqueda.
+        El precio debe ser realista basado en el tipo de producto."""
+
 class Gemma3Service:
     """
     Servicio para interactuar con el modelo Gemma 3 desplegado en Lightning AI
     """
     
-    def __init__(self):
-        self.config = self._get_active_config()
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {self.config.api_key}'
-        })
-        # Configurar timeout y headers más robustos
-        self.session.timeout = 30
-        self.session.headers.update({
-            'User-Agent': 'Django-AI-Client/1.0',
-            'Connection': 'keep-alive',
-            'Accept': 'application/json',
-        })
+    def __init__(self, config: Optional[AIConfiguration] = None):
+        # Configuración cacheada por proceso y pool de conexiones compartido:
+        # instanciar el servicio no consulta la base ni abre conexiones nuevas
+        self.config = config or self._get_active_config()
+        self.session = get_pooled_session(self.config.api_key)
     
     def _get_active_config(self) -> AIConfiguration:
         """Obtiene la configuración activa de IA"""
-        try:
-            config = AIConfiguration.objects.filter(is_active=True).first()
-            if not config:
-                # Crear configuración por defecto si no existe
-                config = AIConfiguration.objects.create(
-                    name='default',
-                    lightning_endpoint=LIGHTNING_AI_ENDPOINT,
-                    api_key=LIGHTNING_AI_API_KEY,
-                    model_name=MODEL_NAME,
-                    max_tokens_default=DEFAULT_MAX_TOKENS,
-                    temperature_default=DEFAULT_TEMPERATURE,
-                    timeout_seconds=DEFAULT_TIMEOUT
-                )
-            return config
-        except Exception as e:
-            
-            raise
+        return ai_config_registry.active()
     
     def _build_messages(self, prompt: str, image_urls: List[str] = None) -> List[Dict]:
         """
@@ -82,6 +83,60 @@ class Gemma3Service:
             "stream": True  # Cambiado a True para compatibilidad con Lightning AI
         }
     
+    def _new_request_log(self, prompt: str, image_urls: List[str], max_tokens: int,
+                         temperature: float, request_type: str, user) -> AIRequest:
+        # Solo se arma en memoria; request_log_writer lo inserta ya terminado
+        return AIRequest(
+            user=user,
+            request_type=request_type,
+            status='pending',
+            prompt=prompt,
+            image_urls=image_urls or [],
+            model_name=self.config.model_name,
+            max_tokens=max_tokens or self.config.max_tokens_default,
+            temperature=temperature or self.config.temperature_default
+        )
+
+    def _success_result(self, ai_request: AIRequest, response_text: str, tokens_used: int,
+                        processing_time: float) -> Dict[str, Any]:
+        print(f"✅ Respuesta completa recibida: '{response_text}'")
+        ai_request.status = 'completed'
+        ai_request.response_text = response_text
+        ai_request.response_tokens = tokens_used
+        ai_request.processing_time = processing_time
+        return {
+            'success': True,
+            'response': response_text,
+            'tokens_used': tokens_used,
+            'processing_time': processing_time,
+            'request_id': self._request_id(ai_request),
+            'model': self.config.model_name
+        }
+
+    @staticmethod
+    def _request_id(ai_request: AIRequest) -> str:
+        # La fila no tiene id hasta el flush del log, pero public_id se asigna al
+        # construirla: el request_id devuelto es el que queda guardado en la fila
+        return str(ai_request.public_id)
+
+    def _failure_result(self, ai_request: AIRequest, error: Exception, processing_time: float,
+                        request_error: bool) -> Dict[str, Any]:
+        error_msg = f"{'Request' if request_error else 'Unexpected'} error: {str(error)}"
+        ai_request.status = 'failed'
+        ai_request.error_message = error_msg
+        ai_request.processing_time = processing_time
+        result = {
+            'success': False,
+            'error': error_msg,
+            'processing_time': processing_time,
+            'request_id': self._request_id(ai_request)
+        }
+        if request_error:
+            print(f"Request error: {str(error)}")
+            print(f"Endpoint: {self.config.lightning_endpoint}")
+            result['endpoint'] = self.config.lightning_endpoint
+        return result
+
     def generate_response(self, prompt: str, image_urls: List[str] = None,
                         max_tokens: int = None, temperature: float = None,
                         request_type: str = 'chat', user=None) -> Dict[str, Any]:
@@ -101,138 +156,98 @@ class Gemma3Service:
         """
         start_time = time.time()
         
-        # Crear registro de request
-        ai_request = AIRequest.objects.create(
-            user=user,
-            request_type=request_type,
-            status='pending',
-            prompt=prompt,
-            image_urls=image_urls or [],
-            model_name=self.config.model_name,
-            max_tokens=max_tokens or self.config.max_tokens_default,
-            temperature=temperature or self.config.temperature_default
-        )
+        # Registro de request: se guarda una sola vez, ya terminado y fuera de este hilo
+        ai_request = self._new_request_log(prompt, image_urls, max_tokens, temperature, request_type, user)
         
         try:
-            # Actualizar estado a procesando
-            ai_request.status = 'processing'
-            ai_request.save()
-            
             # Construir payload
             payload = self._build_payload(prompt, image_urls, max_tokens, temperature)
             
             # Hacer request al endpoint - usar el endpoint correcto
             endpoint_url = f"{self.config.lightning_endpoint}/v1/chat/completions"
             print(f"Making request to: {endpoint_url}")
-            print(f"Payload: {payload}")
+            print(f"Payload: {len(image_urls or [])} imagen(es), max_tokens={payload['max_tokens']}")
             
+            # El timeout se recorta al deadline del request HTTP que originó la llamada
             response = self.session.post(
                 endpoint_url,
                 json=payload,
-                timeout=self.config.timeout_seconds
+                timeout=bounded_timeout(self.config.timeout_seconds)
             )
             
             response.raise_for_status()
             
-            # Manejar respuesta streaming (como client.py)
+            # Manejar respuesta streaming (como client.py) o JSON normal
             response_text = ""
             tokens_used = 0
-            
-            if response.headers.get('content-type', '').startswith('text/event-stream'):
-                # Respuesta streaming
-                for line in response.iter_lines():
-                    if line:
-                        line = line.decode('utf-8')
-                        if line.startswith('data: '):
-                            data = line[6:]  # Remover 'data: '
-                            if data.strip() == '[DONE]':
-                                break
-                            try:
-                                chunk = json.loads(data)
-                                if 'choices' in chunk and len(chunk['choices']) > 0:
-                                    delta = chunk['choices'][0].get('delta', {})
-                                    if 'content' in delta and delta['content'] is not None:
-                                        response_text += delta['content']
-                                    
-                                    # Extraer tokens del último chunk si está disponible
-                                    if 'usage' in chunk and chunk['usage']:
-                                        usage = chunk['usage']
-                                        tokens_used = usage.get('total_tokens', 0)
-                            except json.JSONDecodeError:
-                                continue
-            else:
-                # Respuesta normal (fallback)
-                response_data = response.json()
-                if 'choices' in response_data and len(response_data['choices']) > 0:
-                    response_text = response_data['choices'][0]['message']['content']
-                    usage = response_data.get('usage', {})
+            for text, usage in iter_chat_deltas(response):
+                bounded_timeout(self.config.timeout_seconds)
+                response_text += text
+                # Extraer tokens del último chunk si está disponible
+                if usage:
                     tokens_used = usage.get('total_tokens', 0)
             
             # Procesar respuesta
             processing_time = time.time() - start_time
             
             if response_text:
-                print(f"✅ Respuesta completa recibida: '{response_text}'")
-                
-                # Actualizar request con respuesta exitosa
-                ai_request.status = 'completed'
-                ai_request.response_text = response_text
-                ai_request.response_tokens = tokens_used
-                ai_request.processing_time = processing_time
-                ai_request.save()
-                
-                return {
-                    'success': True,
-                    'response': response_text,
-                    'tokens_used': tokens_used,
-                    'processing_time': processing_time,
-                    'request_id': ai_request.id,
-                    'model': self.config.model_name
-                }
+                result = self._success_result(ai_request, response_text, tokens_used, processing_time)
+                request_log_writer.record(ai_request)
+                return result
             else:
                 raise Exception("No valid response from model")
                 
         except requests.exceptions.RequestException as e:
-            processing_time = time.time() - start_time
-            error_msg = f"Request error: {str(e)}"
-            
-            ai_request.status = 'failed'
-            ai_request.error_message = error_msg
-            ai_request.processing_time = processing_time
-            ai_request.save()
-            
-            print(f"Request error: {str(e)}")
-            print(f"Endpoint: {self.config.lightning_endpoint}")
-            print(f"API Key: {self.config.api_key}")
-            
-            return {
-                'success': False,
-                'error': error_msg,
-                'processing_time': processing_time,
-                'request_id': ai_request.id,
-                'endpoint': self.config.lightning_endpoint
-            }
+            result = self._failure_result(ai_request, e, time.time() - start_time, request_error=True)
+            request_log_writer.record(ai_request)
+            return result
             
         except Exception as e:
-            processing_time = time.time() - start_time
-            error_msg = f"Unexpected error: {str(e)}"
-            
-            ai_request.status = 'failed'
-            ai_request.error_message = error_msg
-            ai_request.processing_time = processing_time
-            ai_request.save()
-            
-            
-            
-            
+            result = self._failure_result(ai_request, e, time.time() - start_time, request_error=False)
+            request_log_writer.record(ai_request)
+            return result
+
+    async def agenerate_response(self, prompt: str, image_urls: List[str] = None,
+                                 max_tokens: int = None, temperature: float = None,
+                                 request_type: str = 'chat', user=None) -> Dict[str, Any]:
+        """
+        Versión async de generate_response para vistas ASGI: usa httpx y el ORM
+        async, así que la espera al modelo no ocupa un hilo.
+        """
+        start_time = time.time()
+        
+        ai_request = self._new_request_log(prompt, image_urls, max_tokens, temperature, request_type, user)
+        
+        try:
+            payload = self._build_payload(prompt, image_urls, max_tokens, temperature)
+            response_text = ""
+            tokens_used = 0
+            async with get_async_http_client().stream(
+                'POST',
+                f"{self.config.lightning_endpoint}/v1/chat/completions",
+                json=payload,
+                headers={'Authorization': f'Bearer {self.config.api_key}'},
+                timeout=bounded_timeout(self.config.timeout_seconds),
+            ) as response:
+                response.raise_for_status()
+                async for text, usage in aiter_chat_deltas(response):
+                    bounded_timeout(self.config.timeout_seconds)
+                    response_text += text
+                    if usage:
+                        tokens_used = usage.get('total_tokens', 0)
             
-            return {
-                'success': False,
-                'error': error_msg,
-                'processing_time': processing_time,
-                'request_id': ai_request.id
-            }
-    
+            processing_time = time.time() - start_time
+            if not response_text:
+                raise Exception("No valid response from model")
+            result = self._success_result(ai_request, response_text, tokens_used, processing_time)
+            request_log_writer.record(ai_request)
+            return result
+        
+        except Exception as e:
+            request_error = httpx is not None and isinstance(e, httpx.HTTPError)
+            result = self._failure_result(ai_request, e, time.time() - start_time, request_error=request_error)
+            request_log_writer.record(ai_request)
+            return result
  
     def health_check(self) -> Dict[str, Any]:
         """
@@ -243,21 +258,7 @@ class Gemma3Service:
                 f"{self.config.lightning_endpoint}/",
                 timeout=10
             )
-            
-            if response.status_code == 200:
-                return {
-                    'status': 'healthy',
-                    'endpoint': self.config.lightning_endpoint,
-                    'model': self.config.model_name,
-                    'response': response.text
-                }
-            else:
-                return {
-                    'status': 'unhealthy',
-                    'endpoint': self.config.lightning_endpoint,
-                    'error': f"HTTP {response.status_code}"
-                }
-                
+            return self._health_from_status(response.status_code, response.text)
         except Exception as e:
             return {
                 'status': 'unhealthy',
@@ -265,86 +266,330 @@ class Gemma3Service:
                 'error': str(e)
             }
 
+    async def ahealth_check(self) -> Dict[str, Any]:
+        try:
+            response = await get_async_http_client().get(f"{self.config.lightning_endpoint}/", timeout=10)
+            return self._health_from_status(response.status_code, response.text)
+        except Exception as e:
+            return {
+                'status': 'unhealthy',
+                'endpoint': self.config.lightning_endpoint,
+                'error': str(e)
+            }
+
+    def _health_from_status(self, status_code: int, text: str) -> Dict[str, Any]:
+        if status_code == 200:
+            return {
+                'status': 'healthy',
+                'endpoint': self.config.lightning_endpoint,
+                'model': self.config.model_name,
+                'response': text
+            }
+        return {
+            'status': 'unhealthy',
+            'endpoint': self.config.lightning_endpoint,
+            'error': f"HTTP {status_code}"
+        }
+
+
+def parse_analysis_json(response_text: str) -> Dict[str, Any]:
+    """
+    Extrae el objeto JSON de la respuesta del modelo (con o sin bloque
+    ```json). Lanza json.JSONDecodeError si no es válido.
+    """
+    if '```json' in response_text:
+        json_start = response_text.find('```json') + 7
+        json_end = response_text.find('```', json_start)
+        json_text = response_text[json_start:json_end].strip()
+    elif '{' in response_text and '}' in response_text:
+        json_start = response_text.find('{')
+        json_end = response_text.rfind('}') + 1
+        json_text = response_text[json_start:json_end]
+    else:
+        json_text = response_text
+    return json.loads(json_text)
+
+
+class PartialJSONFields:
+    """
+    Extrae campos de texto completos de un objeto JSON plano que llega por
+    fragmentos, para llenar el formulario a medida que el modelo genera
+    (primero el título, luego la descripción, etc.).
+    """
+    FIELD_RE = re.compile(r'"(\w+)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+    def __init__(self):
+        self.buffer = ''
+        self.emitted = set()
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        """Agrega texto y devuelve los campos (nombre, valor) completados."""
+        self.buffer += text
+        completed = []
+        for match in self.FIELD_RE.finditer(self.buffer):
+            name = match.group(1)
+            if name in self.emitted:
+                continue
+            try:
+                value = json.loads(f'"{match.group(2)}"')
+            except json.JSONDecodeError:
+                continue
+            self.emitted.add(name)
+            completed.append((name, value))
+        return completed
+
 
 class ProductAIService:
     """
     Servicio específico para funcionalidades de IA relacionadas con productos
     """
     
-    def __init__(self, ai_client: Optional[AIGenerationClient] = None):
+    def __init__(self, ai_client: Optional[AIGenerationClient] = None,
+                 result_cache: Optional[AnalysisResultCache] = None):
         # Inversión de dependencias: dependemos del puerto (AIGenerationClient)
         # y por defecto inyectamos el adaptador concreto Gemma3Service.
         self.ai_client: AIGenerationClient = ai_client or Gemma3Service()
+        if result_cache is None and getattr(settings, 'AI_RESULT_CACHE_ENABLED', True):
+            result_cache = AnalysisResultCache()
+        self.result_cache = result_cache
+
+    def _model_name(self) -> str:
+        config = getattr(self.ai_client, 'config', None)
+        return getattr(config, 'model_name', None) or getattr(self.ai_client, 'model_name', '') or ''
     
     # Funciones individuales eliminadas - solo se usa analyze_product_complete()
     
-    def analyze_product_complete(self, image_url: str, user=None) -> Dict[str, Any]:
+    def analyze_product_complete(self, image_url: str, user=None,
+                                 perceptual_hash: Optional[ImageFingerprint] = None,
+                                 admit: Optional[Callable[[], Any]] = None) -> Dict[str, Any]:
         """
         Análisis completo de producto desde una imagen para auto-llenar formulario
         Genera título, descripción, categoría sugerida y tags automáticamente
+
+        Si se pasa perceptual_hash (huella de la imagen) y existe un análisis
+        previo a una distancia de Hamming <= AI_PHASH_MAX_DISTANCE y con el
+        mismo color medio (AI_PHASH_MAX_COLOR_DISTANCE), se reutiliza.
+
+        admit() se llama solo antes de ir al modelo (no en los aciertos de
+        caché) y devuelve un cupo con release(success), p.ej.
+        admission_controller.acquire.
         """
-        prompt = """Analiza esta imagen de producto y genera información completa para un e-commerce. 
-        Responde SOLO en formato JSON con la siguiente estructura exacta:
-        {
-            "title": "Título atractivo del producto (máximo 60 caracteres)",
-            "description": "Descripción detallada y convincente del producto (máximo 200 palabras)",
-            "suggested_category": "Categoría más apropiada para este producto (debe ser una de: Ropa, Electrónicos, Hogar, Deportes, Libros, Juguetes, Belleza, Automotriz, Jardín, Oficina)",
-            "tags": "tag1, tag2, tag3, tag4, tag5",
-            "price_suggestion": "Precio estimado en USD basado en el producto"
-        }
+        previous, lookup = self._lookup_previous(image_url, perceptual_hash, user)
+        if previous is not None:
+            return previous
         
-        El título debe ser atractivo y optimizado para SEO.
-        La descripción debe destacar características clave y beneficios.
-        La categoría DEBE ser una de estas opciones exactas: Ropa, Electrónicos, Hogar, Deportes, Libros, Juguetes, Belleza, Automotriz, Jardín, Oficina.
-        Los tags deben ser palabras clave útiles para búsqueda.
-        El precio debe ser realista basado en el tipo de producto."""
+        permit = admit() if admit is not None else None
+        try:
+            result = self.ai_client.generate_response(
+                prompt=PRODUCT_ANALYSIS_PROMPT,
+                image_urls=[image_url],
+                max_tokens=500,
+                temperature=0.7,
+                request_type='product_analysis',
+                user=user
+            )
+        except BaseException:
+            if permit is not None:
+                permit.release(False)
+            raise
+        if permit is not None:
+            permit.release(bool(result.get('success')))
+        return self._complete_analysis(result, lookup)
+
+    async def aanalyze_product_complete(self, image_url: str, user=None,
+                                        perceptual_hash: Optional[ImageFingerprint] = None) -> Dict[str, Any]:
+        """
+        Versión async de analyze_product_complete. Requiere que el cliente
+        inyectado implemente AsyncAIGenerationClient.
+        """
+        previous, lookup = await sync_to_async(self._lookup_previous)(image_url, perceptual_hash, user)
+        if previous is not None:
+            return previous
         
-        result = self.ai_client.generate_response(
-            prompt=prompt,
+        result = await self.ai_client.agenerate_response(
+            prompt=PRODUCT_ANALYSIS_PROMPT,
             image_urls=[image_url],
             max_tokens=500,
             temperature=0.7,
             request_type='product_analysis',
             user=user
         )
-        
-        if result['success']:
+        return await sync_to_async(self._complete_analysis)(result, lookup)
+
+    def stream_product_analysis(self, image_url: str, user=None,
+                                perceptual_hash: Optional[ImageFingerprint] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Igual que analyze_product_complete pero produce eventos a medida que
+        llegan los tokens: ('token', {text}), ('field', {name, value}) por cada
+        campo JSON completado y al final ('done', resultado) o ('error', {...}).
+
+        Si el cliente no implementa stream_response, o el stream falla antes
+        del primer token, se usa generate_response (con su propio fallback).
+        """
+        previous, lookup = self._lookup_previous(image_url, perceptual_hash, user)
+        if previous is not None:
+            for name, value in previous['data'].items():
+                yield 'field', {'name': name, 'value': value}
+            yield 'done', previous
+            return
+
+        start_time = time.time()
+        fields = PartialJSONFields()
+        parts = []
+        stream = getattr(self.ai_client, 'stream_response', None)
+        if stream is not None:
             try:
-                # Intentar parsear la respuesta como JSON
-                import json
-                response_text = result['response']
-                
-                # Limpiar la respuesta para extraer solo el JSON
-                if '```json' in response_text:
-                    json_start = response_text.find('```json') + 7
-                    json_end = response_text.find('```', json_start)
-                    json_text = response_text[json_start:json_end].strip()
-                elif '{' in response_text and '}' in response_text:
-                    json_start = response_text.find('{')
-                    json_end = response_text.rfind('}') + 1
-                    json_text = response_text[json_start:json_end]
-                else:
-                    json_text = response_text
-                
-                parsed_data = json.loads(json_text)
-                
-                return {
-                    'success': True,
-                    'data': parsed_data,
-                    'request_id': result.get('request_id'),
-                    'processing_time': result.get('processing_time')
-                }
-                
-            except json.JSONDecodeError as e:
-            
-                return {
-                    'success': False,
-                    'error': 'Error procesando respuesta de IA',
-                    'raw_response': result['response']
-                }
+                for text in stream(PRODUCT_ANALYSIS_PROMPT, [image_url], 500, 0.7):
+                    parts.append(text)
+                    yield 'token', {'text': text}
+                    for name, value in fields.feed(text):
+                        yield 'field', {'name': name, 'value': value}
+            except Exception as e:
+                print(f"⚠️ Streaming error: {str(e)}")
+                if parts:
+                    yield 'error', {'success': False, 'error': 'Se interrumpió la respuesta del modelo'}
+                    return
+
+        if parts:
+            # El stream no pasa por Gemma3Service: su fila en el log se escribe aquí
+            response_text = ''.join(parts)
+            processing_time = time.time() - start_time
+            result = {
+                'success': True,
+                'response': response_text,
+                'processing_time': processing_time,
+                'request_id': self._log_analysis(
+                    image_url, user, lookup['model_name'], {}, processing_time, response_text=response_text
+                ),
+                'model': lookup['model_name']
+            }
         else:
+            result = self.ai_client.generate_response(
+                prompt=PRODUCT_ANALYSIS_PROMPT,
+                image_urls=[image_url],
+                max_tokens=500,
+                temperature=0.7,
+                request_type='product_analysis',
+                user=user
+            )
+
+        final = self._complete_analysis(result, lookup)
+        if not final['success']:
+            yield 'error', final
+            return
+        for name, value in final['data'].items():
+            if name not in fields.emitted:
+                yield 'field', {'name': name, 'value': value}
+        yield 'done', final
+
+    def _lookup_previous(self, image_url: str, perceptual_hash: Optional[ImageFingerprint], user=None):
+        """
+        Busca un análisis previo: primero por contenido exacto (caché) y luego
+        por similitud perceptual. Devuelve (resultado o None, contexto).
+        """
+        previous, lookup = self._find_previous(image_url, perceptual_hash, user)
+        if previous is None:
+            return None, lookup
+        # El request_id es el de esta request (su propia fila en el log); el del
+        # análisis original queda en source_request_id
+        request_id = self._log_analysis(image_url, user, lookup['model_name'], previous, 0.0)
+        return {**previous, 'request_id': request_id, 'source_request_id': previous.get('request_id')}, lookup
+
+    def _log_analysis(self, image_url: str, user, model_name: str, analysis: Dict[str, Any],
+                      processing_time: float, response_text: str = '', tokens_used: int = 0) -> str:
+        """
+        Registra en el log un análisis que no pasó por Gemma3Service (acierto
+        de caché o stream) y devuelve su request_id.
+        """
+        ai_request = AIRequest(
+            user=user,
+            request_type='product_analysis',
+            status='completed',
+            prompt=PRODUCT_ANALYSIS_PROMPT,
+            image_urls=[image_url],
+            model_name=model_name or AIRequest._meta.get_field('model_name').default,
+            response_text=response_text,
+            response_tokens=tokens_used or 0,
+            processing_time=processing_time or 0.0,
+            result=analysis.get('data'),
+        )
+        request_log_writer.record(ai_request)
+        return str(ai_request.public_id)
+
+    def _find_previous(self, image_url: str, perceptual_hash: Optional[ImageFingerprint], user=None):
+        """
+        Caché exacta y luego índice perceptual; devuelve (análisis guardado o
+        None, contexto). Los casi-duplicados solo se buscan entre los análisis
+        del mismo usuario autenticado.
+        """
+        user_id = user.pk if user is not None and user.is_authenticated else None
+        lookup = {
+            'model_name': self._model_name(),
+            'digest': image_digest(image_url),
+            'cache_key': None,
+            'perceptual_hash': perceptual_hash,
+            'user_id': user_id,
+            'use_phash': (perceptual_hash is not None and user_id is not None
+                          and getattr(settings, 'AI_PHASH_ENABLED', True)),
+        }
+        if self.result_cache is not None:
+            lookup['cache_key'] = self.result_cache.make_key(
+                lookup['digest'], PRODUCT_ANALYSIS_PROMPT_VERSION, lookup['model_name']
+            )
+            cached = self.result_cache.get(lookup['cache_key'])
+            if cached is not None:
+                return {**cached, 'cache_hit': True}, lookup
+
+        if lookup['use_phash']:
+            match = near_duplicate_index.find(
+                perceptual_hash, lookup['model_name'], PRODUCT_ANALYSIS_PROMPT_VERSION,
+                max_distance=getattr(settings, 'AI_PHASH_MAX_DISTANCE', 6),
+                max_color_distance=getattr(settings, 'AI_PHASH_MAX_COLOR_DISTANCE', 24),
+                user_id=user_id,
+            )
+            if match is not None:
+                distance, stored = match
+                if lookup['cache_key'] is not None:
+                    self.result_cache.set(lookup['cache_key'], stored.analysis)
+                return {**stored.analysis, 'cache_hit': True, 'near_duplicate_distance': distance}, lookup
+        return None, lookup
+
+    def _complete_analysis(self, result: Dict[str, Any], lookup: Dict[str, Any]) -> Dict[str, Any]:
+        """Parsea la respuesta del modelo y guarda el análisis para reutilizarlo."""
+        if not result['success']:
             return result
+        try:
+            parsed_data = parse_analysis_json(result['response'])
+        except json.JSONDecodeError:
+            return {
+                'success': False,
+                'error': 'Error procesando respuesta de IA',
+                'raw_response': result['response']
+            }
+        
+        analysis = {
+            'success': True,
+            'data': parsed_data,
+            'request_id': result.get('request_id'),
+            'processing_time': result.get('processing_time')
+        }
+        # No cachear respuestas de un fallback (p.ej. el mock) bajo la llave del modelo real;
+        # detrás del balanceador la llave cubre a todos los modelos de las réplicas
+        served_by = result.get('model')
+        served_models = getattr(self.ai_client, 'model_names', None) or {lookup['model_name']}
+        if not served_by or served_by in served_models:
+            if lookup['cache_key'] is not None:
+                self.result_cache.set(lookup['cache_key'], analysis)
+            if lookup['use_phash']:
+                near_duplicate_index.add(
+                    lookup['perceptual_hash'], lookup['digest'], lookup['model_name'],
+                    PRODUCT_ANALYSIS_PROMPT_VERSION, analysis, lookup['user_id']
+                )
+        return {**analysis, 'cache_hit': False}
 
     def health_check(self) -> Dict[str, Any]:
         """Exponer health-check del cliente inyectado."""
-        return self.ai_client.health_check()
\ No newline at end of file
+        return self.ai_client.health_check()
+
+    async def ahealth_check(self) -> Dict[str, Any]:
+        return await self.ai_client.ahealth_check()
@@ -0,0 +1,18 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .config_registry import ai_config_registry
+from .health import provider_health
+from .models import AIConfiguration
+
+
+@receiver(post_save, sender=AIConfiguration)
+@receiver(post_delete, sender=AIConfiguration)
+def invalidate_ai_configuration(sender, **kwargs):
+    """
+    Descarta la configuración cacheada al editarla (admin incluido); el
+    siguiente servicio que se instancie la vuelve a cargar y el endpoint
+    nuevo se sondea de inmediato
+    """
+    ai_config_registry.invalidate()
+    provider_health.refresh('gemma')
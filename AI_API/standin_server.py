@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Servidor local que imita el endpoint OpenAI-compatible de LitServe/Gemma.
+
+Responde /v1/chat/completions con un stream SSE de tokens fijos (con retardo
+configurable) y / con {"status": "ok"}. Sirve para benchmarks y pruebas sin
+GPU ni acceso a Lightning AI.
+
+Uso:
+    python -m AI_API.standin_server --port 8001 --first-token-delay 0.2
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+DEFAULT_RESPONSE = json.dumps({
+    "title": "Camisa Casual de Algodón",
+    "description": "Camisa de algodón 100% natural, perfecta para uso diario.",
+    "suggested_category": "Ropa",
+    "tags": "camisa, algodón, casual",
+    "price_suggestion": "25.99"
+}, ensure_ascii=False)
+
+
+def _make_handler(first_token_delay: float, token_delay: float, response_text: str,
+                  max_concurrency: int = 0):
+    tokens = [response_text[i:i + 8] for i in range(0, len(response_text), 8)]
+    # Simula la capacidad de una réplica: más requests simultáneas hacen cola
+    slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def handle(self):
+            try:
+                super().handle()
+            except ConnectionResetError:
+                # El cliente cerró una conexión keep-alive (p.ej. al apagar el benchmark)
+                pass
+
+        def do_GET(self):
+            body = b'{"status": "ok"}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            self.rfile.read(length)
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+
+            if slots is None:
+                self._stream()
+            else:
+                with slots:
+                    self._stream()
+
+        def _stream(self):
+            time.sleep(first_token_delay)
+            for index, token in enumerate(tokens):
+                if index and token_delay:
+                    time.sleep(token_delay)
+                chunk = {"choices": [{"index": 0, "delta": {"content": token}}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            usage = {"choices": [{"index": 0, "delta": {}}],
+                     "usage": {"total_tokens": len(tokens)}}
+            self._write_chunk(f"data: {json.dumps(usage)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, text: str):
+            data = text.encode('utf-8')
+            self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+
+    return StandInHandler
+
+
+def start_standin_server(port: int = 0, first_token_delay: float = 0.0, token_delay: float = 0.0,
+                         response_text: str = DEFAULT_RESPONSE,
+                         max_concurrency: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Arranca el servidor en un hilo daemon y devuelve (server, url_base).
+    max_concurrency > 0 limita las generaciones simultáneas, como una GPU.
+    """
+    handler = _make_handler(first_token_delay, token_delay, response_text, max_concurrency)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in local del endpoint de Gemma")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--first-token-delay", type=float, default=0.0)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=int, default=0)
+    args = parser.parse_args()
+
+    server, url = start_standin_server(args.port, args.first_token_delay, args.token_delay,
+                                       max_concurrency=args.max_concurrency)
+    print(f"✓ Stand-in server running at {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,328 @@
+"""
+Cliente en proceso para el endpoint OpenAI-compatible de Gemma (LitServe).
+
+Reemplaza al ClientPyAdapter: en lugar de escribir la imagen a disco y lanzar
+un intérprete nuevo con client.py por cada análisis, mantiene un pool de
+conexiones keep-alive compartido por todo el proceso, envía la data URL tal
+cual y consume los tokens del stream SSE directamente.
+"""
+import asyncio
+import json
+import threading
+import time
+import uuid
+import weakref
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import requests
+from django.conf import settings
+from django.db import DatabaseError
+from requests.adapters import HTTPAdapter
+
+from .resilience import bounded_timeout
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - dependencia opcional para la variante async
+    httpx = None
+
+MODEL_NAME = 'google/gemma-3-4b-it'
+
+_sessions: Dict[Tuple[str, int], requests.Session] = {}
+_sessions_lock = threading.Lock()
+# Un cliente por event loop; se libera junto con el loop
+_async_clients: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+
+
+def get_pooled_session(api_key: str, pool_size: Optional[int] = None) -> requests.Session:
+    """
+    Sesión HTTP compartida por proceso (una por API key y tamaño de pool).
+    Las conexiones TCP/TLS se reutilizan entre requests.
+    """
+    pool_size = pool_size or getattr(settings, 'AI_HTTP_POOL_SIZE', 20)
+    key = (api_key, pool_size)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({
+                'Content-Type': 'application/json',
+                'Authorization': f'Bearer {api_key}',
+                'User-Agent': 'Django-AI-Client/1.0',
+                'Connection': 'keep-alive',
+            })
+            _sessions[key] = session
+    return session
+
+
+def get_async_http_client():
+    """
+    httpx.AsyncClient compartido por event loop. Un solo cliente mantiene
+    cientos de requests en vuelo sin ocupar un hilo por cada una.
+    """
+    if httpx is None:
+        raise RuntimeError("httpx no está instalado: la variante async del cliente no está disponible")
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        max_connections = getattr(settings, 'AI_ASYNC_MAX_CONNECTIONS', 200)
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers={'User-Agent': 'Django-AI-Client/1.0'},
+        )
+        _async_clients[loop] = client
+    return client
+
+
+_DONE = object()
+
+
+def _parse_sse_line(line: str):
+    """Devuelve (texto, usage), _DONE o None si la línea no aporta contenido."""
+    if not line.startswith('data: '):
+        return None
+    data = line[6:]
+    if data.strip() == '[DONE]':
+        return _DONE
+    try:
+        chunk = json.loads(data)
+    except json.JSONDecodeError:
+        return None
+    if not chunk.get('choices'):
+        return None
+    delta = chunk['choices'][0].get('delta', {})
+    return delta.get('content') or '', chunk.get('usage') or None
+
+
+def _parse_json_completion(data: Dict[str, Any]):
+    if data.get('choices'):
+        return data['choices'][0]['message']['content'] or '', data.get('usage')
+    return None
+
+
+def iter_chat_deltas(response: requests.Response) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+    """
+    Recorre una respuesta de /v1/chat/completions y produce (texto, usage).
+    Soporta text/event-stream y la respuesta JSON normal como fallback.
+    """
+    if not response.headers.get('content-type', '').startswith('text/event-stream'):
+        parsed = _parse_json_completion(response.json())
+        if parsed:
+            yield parsed
+        return
+
+    for line in response.iter_lines():
+        if not line:
+            continue
+        parsed = _parse_sse_line(line.decode('utf-8'))
+        if parsed is _DONE:
+            break
+        if parsed:
+            yield parsed
+
+
+async def aiter_chat_deltas(response) -> AsyncIterator[Tuple[str, Optional[Dict[str, Any]]]]:
+    """Versión async de iter_chat_deltas para respuestas de httpx."""
+    if not response.headers.get('content-type', '').startswith('text/event-stream'):
+        await response.aread()
+        parsed = _parse_json_completion(response.json())
+        if parsed:
+            yield parsed
+        return
+
+    async for line in response.aiter_lines():
+        if not line:
+            continue
+        parsed = _parse_sse_line(line)
+        if parsed is _DONE:
+            break
+        if parsed:
+            yield parsed
+
+
+def _active_config():
+    from .config_registry import ai_config_registry
+
+    try:
+        return ai_config_registry.active()
+    except DatabaseError:
+        return None
+
+
+class InProcessChatClient:
+    """
+    Implementa el puerto AIGenerationClient hablando directamente con el
+    endpoint, sin subprocess ni archivos temporales.
+    """
+
+    def __init__(self, endpoint: Optional[str] = None, api_key: Optional[str] = None,
+                 model_name: Optional[str] = None, timeout: Optional[float] = None,
+                 fallback_to_mock: bool = True, config=None):
+        # Sin endpoint explícito se usa la AIConfiguration activa (editable en el
+        # admin, revalidada por el registro); settings solo si no hay base de datos
+        if config is None and endpoint is None:
+            config = _active_config()
+        self.endpoint = (endpoint or (config and config.lightning_endpoint) or settings.LIGHTNING_AI_ENDPOINT).rstrip('/')
+        self.api_key = api_key or (config and config.api_key) or settings.LIGHTNING_AI_API_KEY
+        self.model_name = model_name or (config and config.model_name) or MODEL_NAME
+        self.timeout = timeout or (config and config.timeout_seconds) or getattr(settings, 'AI_HTTP_TIMEOUT', 60)
+        # Con False los errores se devuelven como success=False (lo usa ResilientAIClient)
+        self.fallback_to_mock = fallback_to_mock
+        self.session = get_pooled_session(self.api_key)
+
+    def _build_payload(self, prompt: str, image_urls: Optional[List[str]],
+                       max_tokens: Optional[int], temperature: Optional[float]) -> Dict[str, Any]:
+        content = [{"type": "text", "text": prompt}]
+        for image_url in image_urls or []:
+            content.append({"type": "image_url", "image_url": {"url": image_url}})
+        return {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": content}],
+            "max_tokens": max_tokens or 256,
+            "temperature": temperature or 0.7,
+            "stream": True,
+        }
+
+    def _iter_deltas(self, payload: Dict[str, Any]) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        with self.session.post(
+            f"{self.endpoint}/v1/chat/completions",
+            json=payload,
+            stream=True,
+            timeout=bounded_timeout(self.timeout),
+        ) as response:
+            response.raise_for_status()
+            for delta in iter_chat_deltas(response):
+                bounded_timeout(self.timeout)
+                yield delta
+
+    def stream_response(self, prompt: str, image_urls: Optional[List[str]] = None,
+                        max_tokens: Optional[int] = None,
+                        temperature: Optional[float] = None) -> Iterator[str]:
+        """Produce los fragmentos de texto a medida que llegan del modelo."""
+        payload = self._build_payload(prompt, image_urls, max_tokens, temperature)
+        for text, _ in self._iter_deltas(payload):
+            if text:
+                yield text
+
+    def generate_response(self, prompt: str, image_urls: List[str] = None,
+                          max_tokens: int = None, temperature: float = None,
+                          request_type: str = 'chat', user=None) -> Dict[str, Any]:
+        """
+        Genera una respuesta completa. Si el endpoint falla, usa el mock
+        service como fallback (mismo comportamiento que ClientPyAdapter).
+        """
+        start_time = time.time()
+        payload = self._build_payload(prompt, image_urls, max_tokens, temperature)
+        try:
+            parts = []
+            tokens_used = 0
+            for text, usage in self._iter_deltas(payload):
+                parts.append(text)
+                if usage:
+                    tokens_used = usage.get('total_tokens', 0)
+            response_text = ''.join(parts).strip()
+            if not response_text:
+                raise ValueError("No valid response from model")
+
+            return self._success_result(response_text, tokens_used, start_time)
+        except Exception as e:
+            print(f"⚠️ In-process client error: {str(e)}")
+            if not self.fallback_to_mock:
+                return self._error_result(e, start_time)
+            print("🔄 Using mock service as fallback...")
+            from .mock_service import MockAIService
+            return MockAIService().generate_response(prompt, image_urls, max_tokens, temperature, request_type, user)
+
+    async def _aiter_deltas(self, payload: Dict[str, Any]) -> AsyncIterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        client = get_async_http_client()
+        async with client.stream(
+            'POST',
+            f"{self.endpoint}/v1/chat/completions",
+            json=payload,
+            headers={'Authorization': f'Bearer {self.api_key}'},
+            timeout=bounded_timeout(self.timeout),
+        ) as response:
+            response.raise_for_status()
+            async for delta in aiter_chat_deltas(response):
+                bounded_timeout(self.timeout)
+                yield delta
+
+    async def astream_response(self, prompt: str, image_urls: Optional[List[str]] = None,
+                               max_tokens: Optional[int] = None,
+                               temperature: Optional[float] = None) -> AsyncIterator[str]:
+        payload = self._build_payload(prompt, image_urls, max_tokens, temperature)
+        async for text, _ in self._aiter_deltas(payload):
+            if text:
+                yield text
+
+    async def agenerate_response(self, prompt: str, image_urls: List[str] = None,
+                                 max_tokens: int = None, temperature: float = None,
+                                 request_type: str = 'chat', user=None) -> Dict[str, Any]:
+        """Versión async de generate_response; no ocupa un hilo mientras espera al modelo."""
+        start_time = time.time()
+        payload = self._build_payload(prompt, image_urls, max_tokens, temperature)
+        try:
+            parts = []
+            tokens_used = 0
+            async for text, usage in self._aiter_deltas(payload):
+                parts.append(text)
+                if usage:
+                    tokens_used = usage.get('total_tokens', 0)
+            response_text = ''.join(parts).strip()
+            if not response_text:
+                raise ValueError("No valid response from model")
+
+            return self._success_result(response_text, tokens_used, start_time)
+        except Exception as e:
+            print(f"⚠️ In-process async client error: {str(e)}")
+            if not self.fallback_to_mock:
+                return self._error_result(e, start_time)
+            print("🔄 Using mock service as fallback...")
+            from .mock_service import MockAIService
+            return await MockAIService().agenerate_response(
+                prompt, image_urls, max_tokens, temperature, request_type, user
+            )
+
+    def _success_result(self, response_text: str, tokens_used: int, start_time: float) -> Dict[str, Any]:
+        # Sin 'usage' del servidor tokens_used queda en 0: no se estima con palabras
+        return {
+            'success': True,
+            'response': response_text,
+            'tokens_used': tokens_used,
+            'processing_time': time.time() - start_time,
+            'request_id': str(uuid.uuid4()),
+            'model': self.model_name
+        }
+
+    def _error_result(self, error: Exception, start_time: float) -> Dict[str, Any]:
+        return {
+            'success': False,
+            'error': f"Request error: {str(error)}",
+            'processing_time': time.time() - start_time,
+            'request_id': None,
+            'endpoint': self.endpoint,
+        }
+
+    async def ahealth_check(self) -> Dict[str, Any]:
+        try:
+            response = await get_async_http_client().get(f"{self.endpoint}/", timeout=10)
+            if response.status_code == 200:
+                return {'status': 'healthy', 'endpoint': self.endpoint, 'model': self.model_name}
+            return {'status': 'unhealthy', 'endpoint': self.endpoint, 'error': f"HTTP {response.status_code}"}
+        except Exception as e:
+            return {'status': 'unhealthy', 'endpoint': self.endpoint, 'error': str(e)}
+
+    def health_check(self) -> Dict[str, Any]:
+        try:
+            response = self.session.get(f"{self.endpoint}/", timeout=10)
+            if response.status_code == 200:
+                return {'status': 'healthy', 'endpoint': self.endpoint, 'model': self.model_name}
+            return {'status': 'unhealthy', 'endpoint': self.endpoint, 'error': f"HTTP {response.status_code}"}
+        except Exception as e:
+            return {'status': 'unhealthy', 'endpoint': self.endpoint, 'error': str(e)}
@@ -0,0 +1,908 @@
+import asyncio
+import base64
+import io
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from datetime import timedelta
+from importlib import import_module
+from unittest import mock
+
+import requests
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import DatabaseError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from .admission import AdmissionController, AdmissionRejected
+from .blob_store import blob_name, blob_storage, externalize_image_urls, resolve_image_url
+from .batch_analysis import iter_batch_analysis
+from .config_registry import ai_config_registry
+from .factory import create_ai_client
+from .image_prep import normalize_image
+from .load_balancer import LoadBalancedAIClient, endpoint_snapshots
+from .jobs import JobWorkerPool, callback_session, claim_next_job, notify_callback, reclaim_stuck_jobs, run_job
+from .mock_service import MockAIService
+from .models import AIConfiguration, AIRequest
+from .request_log import request_log_writer
+from .resilience import ResilientAIClient, remaining_time
+from .perceptual_hash import NearDuplicateIndex, color_distance, fingerprint
+from .services import Gemma3Service, ProductAIService
+from .streaming_client import InProcessChatClient
+
+
+def setUpModule():
+    """Media y blobs de los tests en un directorio temporal, nunca en los del proyecto."""
+    directory = tempfile.mkdtemp()
+    unittest.addModuleCleanup(shutil.rmtree, directory, ignore_errors=True)
+    storage_settings = override_settings(
+        MEDIA_ROOT=os.path.join(directory, 'media'),
+        STORAGES={**settings.STORAGES, 'ai_blobs': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': os.path.join(directory, 'ai_blobs')},
+        }},
+    )
+    storage_settings.enable()
+    unittest.addModuleCleanup(storage_settings.disable)
+
+
+def solid(color, size=(320, 240)):
+    return Image.new('RGB', size, color)
+
+
+def pattern(tint, size=(320, 240)):
+    """Imagen con textura (franjas y un círculo) teñida con `tint` (r, g, b en 0-1)."""
+    gray = Image.new('L', size, 40)
+    draw = ImageDraw.Draw(gray)
+    for x in range(0, size[0], 40):
+        draw.rectangle([x, 0, x + 19, size[1]], fill=200)
+    draw.ellipse([100, 60, 220, 180], fill=120)
+    return Image.merge('RGB', [gray.point(lambda value, factor=factor: int(value * factor)) for factor in tint])
+
+
+def jpeg_bytes(image, quality=90):
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+def pause_request_log(test):
+    """Sin el hilo flusher: el test vacía el buffer del log en su propia transacción."""
+    patcher = mock.patch.object(request_log_writer, '_start')
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    request_log_writer.flush()
+    test.addCleanup(request_log_writer.flush)
+
+
+class CountingMockClient(MockAIService):
+    """MockAIService que cuenta las llamadas al modelo."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def generate_response(self, *args, **kwargs):
+        self.calls += 1
+        return super().generate_response(*args, **kwargs)
+
+
+class FingerprintTests(TestCase):
+    def test_solid_images_have_no_fingerprint(self):
+        for color in ('red', 'green', 'blue', 'white'):
+            self.assertIsNone(fingerprint(solid(color)), color)
+
+    def test_color_is_part_of_the_fingerprint(self):
+        red, blue = fingerprint(pattern((1, 0, 0))), fingerprint(pattern((0, 0, 1)))
+        self.assertEqual(red.dhash, blue.dhash)
+        self.assertGreater(color_distance(red.color, blue.color), 24)
+
+    def test_recompressed_copy_keeps_its_fingerprint(self):
+        original = fingerprint(pattern((1, 0.5, 0.2)))
+        _, copy = normalize_image(jpeg_bytes(pattern((1, 0.5, 0.2)).resize((640, 480)), quality=60), 10 ** 8)
+        self.assertLessEqual((original.dhash ^ copy.dhash).bit_count(), 6)
+        self.assertLessEqual(color_distance(original.color, copy.color), 24)
+
+
+@override_settings(AI_RESULT_CACHE_ENABLED=False, AI_PHASH_SYNC_INTERVAL=0, AI_PHASH_WARM_IN_BACKGROUND=False)
+class NearDuplicateReuseTests(TestCase):
+    def setUp(self):
+        pause_request_log(self)
+        self.index = NearDuplicateIndex()
+        patcher = mock.patch('AI_API.services.near_duplicate_index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client_ = CountingMockClient()
+        self.service = ProductAIService(ai_client=self.client_)
+        self.user = User.objects.create_user('vendedora', password='x')
+
+    def _analyze(self, image, quality=90, user=None):
+        image_url, perceptual_hash = normalize_image(jpeg_bytes(image, quality), 10 ** 8)
+        return self.service.analyze_product_complete(image_url, user=user or self.user,
+                                                     perceptual_hash=perceptual_hash)
+
+    def test_near_duplicate_reuses_the_analysis(self):
+        self._analyze(pattern((1, 0.5, 0.2)))
+        result = self._analyze(pattern((1, 0.5, 0.2)).resize((400, 300)), quality=70)
+        self.assertTrue(result['cache_hit'])
+        self.assertEqual(self.client_.calls, 1)
+
+    def test_other_color_is_analyzed_again(self):
+        self._analyze(pattern((1, 0, 0)))
+        result = self._analyze(pattern((0, 0, 1)))
+        self.assertFalse(result['cache_hit'])
+        self.assertEqual(self.client_.calls, 2)
+
+    def test_solid_colors_are_not_matched(self):
+        for color in ('red', 'green', 'blue'):
+            self.assertFalse(self._analyze(solid(color))['cache_hit'], color)
+        self.assertEqual(self.client_.calls, 3)
+
+    def test_other_users_analyses_are_not_reused(self):
+        self._analyze(pattern((1, 0.5, 0.2)))
+        other = User.objects.create_user('otra', password='x')
+        self.assertFalse(self._analyze(pattern((1, 0.5, 0.2)).resize((400, 300)), user=other)['cache_hit'])
+        image_url, perceptual_hash = normalize_image(jpeg_bytes(pattern((1, 0.5, 0.2))), 10 ** 8)
+        anonymous = self.service.analyze_product_complete(image_url, perceptual_hash=perceptual_hash)
+        self.assertFalse(anonymous['cache_hit'])
+        self.assertEqual(self.client_.calls, 3)
+
+    @override_settings(AI_PHASH_SYNC_BATCH=2)
+    def test_sync_is_incremental_and_bounded(self):
+        for tint in [(1, 0, 0), (0, 1, 0), (0, 0, 1), (1, 1, 0), (0, 1, 1)]:
+            self._analyze(pattern(tint))
+        index = NearDuplicateIndex()
+        index.refresh()
+        self.assertEqual(sum(len(table) for table in index._indexes.values()), 2)
+        with mock.patch.object(index, '_lock', wraps=index._lock) as lock:
+            index.warm()
+        self.assertEqual(sum(len(table) for table in index._indexes.values()), 5)
+        # El lock de búsqueda solo se toma para agregar cada bloque ya leído
+        self.assertEqual(lock.__enter__.call_count, 2)
+
+
+@override_settings(AI_RESULT_CACHE_ENABLED=False, AI_PHASH_ENABLED=False)
+class ApiEndpointCsrfTests(TestCase):
+    """Los endpoints Django simples aceptan llamadas de API igual que /analyze-product/."""
+
+    endpoints = [
+        ('ai_api:analyze_product_image_upload', 'image'),
+        ('ai_api:analyze_product_image_upload_async', 'image'),
+        ('ai_api:analyze_product_image_stream', 'image'),
+        ('ai_api:analyze_product_image_batch', 'images'),
+    ]
+
+    def setUp(self):
+        patcher = mock.patch('AI_API.views.create_ai_client', side_effect=lambda *a, **k: CountingMockClient())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        pause_request_log(self)
+        self.api = Client(enforce_csrf_checks=True)
+        User.objects.create_user('cliente', password='secreta')
+
+    def _post(self, name, field, **extra):
+        upload = SimpleUploadedFile('producto.jpg', jpeg_bytes(pattern((1, 0.5, 0.2))), content_type='image/jpeg')
+        response = self.api.post(reverse(name), {field: upload}, **extra)
+        if response.streaming:
+            response.content_text = b''.join(response.streaming_content).decode('utf-8')
+        return response
+
+    def test_anonymous_calls_without_csrf_cookie(self):
+        for name, field in self.endpoints:
+            with self.subTest(name):
+                response = self._post(name, field)
+                self.assertEqual(response.status_code, 200)
+                if response.streaming:
+                    self.assertIn('event: done', response.content_text)
+
+    def test_basic_auth_calls_without_csrf(self):
+        credentials = base64.b64encode(b'cliente:secreta').decode('ascii')
+        for name, field in self.endpoints:
+            with self.subTest(name):
+                response = self._post(name, field, HTTP_AUTHORIZATION=f'Basic {credentials}')
+                self.assertEqual(response.status_code, 200)
+
+    def test_session_calls_still_need_the_csrf_token(self):
+        self.api.login(username='cliente', password='secreta')
+        for name, field in self.endpoints:
+            with self.subTest(name):
+                self.assertEqual(self._post(name, field).status_code, 403)
+
+
+def fake_getaddrinfo(address):
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (address, port or 80))]
+    return getaddrinfo
+
+
+@override_settings(AI_RESULT_CACHE_ENABLED=False, AI_PHASH_ENABLED=False, AI_JOB_CALLBACK_ALLOWED_HOSTS=[])
+class AnalysisJobTests(TestCase):
+    """Cola de trabajos de punta a punta con MockAIService como proveedor."""
+
+    def setUp(self):
+        self.api = Client(enforce_csrf_checks=True)
+        self.workers = JobWorkerPool(provider='mock')
+        patcher = mock.patch('AI_API.jobs.callback_session.post')
+        self.callback_post = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _submit(self, **data):
+        upload = SimpleUploadedFile('producto.jpg', jpeg_bytes(pattern((1, 0.5, 0.2))), content_type='image/jpeg')
+        return self.api.post(reverse('ai_api:submit_analysis_job'), {'image': upload, **data})
+
+    def test_submit_work_and_poll(self):
+        response = self._submit()
+        self.assertEqual(response.status_code, 202)
+        body = response.json()
+        uuid.UUID(body['job_id'])
+        self.assertEqual(self.api.get(body['poll_url']).json()['status'], 'pending')
+
+        self.assertEqual(self.workers.run_until_empty(), 1)
+        job = self.api.get(body['poll_url']).json()
+        self.assertEqual(job['status'], 'completed')
+        self.assertIn('title', job['data'])
+        self.assertEqual(job['attempts'], 1)
+
+    def test_jobs_are_polled_by_uuid_only(self):
+        self._submit()
+        job = AIRequest.objects.get()
+        self.assertEqual(self.api.get(f'/api/ai/analysis-jobs/{job.pk}/').status_code, 404)
+        self.assertEqual(self.api.get(reverse('ai_api:analysis_job_status', args=[uuid.uuid4()])).status_code, 404)
+
+    def test_other_users_jobs_are_hidden(self):
+        # Con sesión DRF exige CSRF: aquí se prueba la visibilidad, no el token
+        self.api = Client()
+        self.api.force_login(User.objects.create_user('duena', password='x'))
+        poll_url = self._submit().json()['poll_url']
+        self.assertEqual(self.api.get(poll_url).status_code, 200)
+
+        self.api.force_login(User.objects.create_user('otro', password='x'))
+        self.assertEqual(self.api.get(poll_url).status_code, 404)
+
+    def test_request_log_rows_are_never_run_as_jobs(self):
+        # Filas del log de Gemma3Service: mismo prompt, sin lock
+        AIRequest.objects.create(request_type='product_analysis', status='processing', prompt='log')
+        AIRequest.objects.create(request_type='product_analysis', status='pending', prompt='log')
+
+        self.assertEqual(reclaim_stuck_jobs(), 0)
+        self.assertIsNone(claim_next_job('worker'))
+        self.assertEqual(
+            sorted(AIRequest.objects.values_list('status', flat=True)), ['pending', 'processing']
+        )
+
+    @override_settings(AI_JOB_VISIBILITY_TIMEOUT=60, AI_JOB_MAX_ATTEMPTS=2)
+    def test_stuck_jobs_are_retried_then_failed(self):
+        self._submit()
+        for expected in ('pending', 'failed'):
+            job = claim_next_job('worker-muerto')
+            AIRequest.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(seconds=120))
+            self.assertEqual(reclaim_stuck_jobs(), 1)
+            self.assertEqual(AIRequest.objects.get(pk=job.pk).status, expected)
+
+    def test_result_is_dropped_when_the_lock_moved_to_another_worker(self):
+        self._submit(callback_url='http://93.184.216.34/hook')
+        job = claim_next_job('worker-lento')
+        # El reaper lo devolvió a la cola y otro worker lo reclamó
+        AIRequest.objects.filter(pk=job.pk).update(locked_by='worker-nuevo')
+
+        run_job(job, 'mock')
+        stored = AIRequest.objects.get(pk=job.pk)
+        self.assertEqual((stored.status, stored.locked_by, stored.result), ('processing', 'worker-nuevo', None))
+        self.callback_post.assert_not_called()
+
+    def test_callback_connection_is_checked_against_dns_rebinding(self):
+        listener = socket.create_server(('127.0.0.1', 0))
+        self.addCleanup(listener.close)
+        port = listener.getsockname()[1]
+        job = AIRequest(callback_url=f'http://hooks.ejemplo.com:{port}/hook', status='completed')
+        # La validación ve una dirección pública; la conexión, la interna
+        answers = iter(['93.184.216.34'])
+
+        def rebinding_getaddrinfo(host, port, *args, **kwargs):
+            return fake_getaddrinfo(next(answers, '127.0.0.1'))(host, port)
+
+        self.callback_post.side_effect = lambda *args, **kwargs: requests.Session.post(callback_session, *args, **kwargs)
+        with mock.patch.object(socket, 'getaddrinfo', rebinding_getaddrinfo):
+            notify_callback(job)
+        self.callback_post.assert_called_once()
+        listener.settimeout(5)
+        connection, _ = listener.accept()
+        with connection:
+            connection.settimeout(5)
+            self.assertEqual(connection.recv(1024), b'')
+
+    def test_callback_to_internal_addresses_is_rejected(self):
+        for url in ('http://127.0.0.1/hook', 'http://localhost:8000/hook', 'http://10.0.0.5/hook',
+                    'http://169.254.169.254/latest/meta-data', 'http://[::1]/hook', 'ftp://ejemplo.com/hook'):
+            with self.subTest(url):
+                self.assertEqual(self._submit(callback_url=url).status_code, 400)
+        self.assertFalse(AIRequest.objects.exists())
+
+    def test_callback_host_must_resolve_to_public_addresses(self):
+        with mock.patch('AI_API.jobs.socket.getaddrinfo', fake_getaddrinfo('10.1.2.3')):
+            self.assertEqual(self._submit(callback_url='https://interno.ejemplo.com/hook').status_code, 400)
+        with mock.patch('AI_API.jobs.socket.getaddrinfo', fake_getaddrinfo('93.184.216.34')):
+            self.assertEqual(self._submit(callback_url='https://hooks.ejemplo.com/hook').status_code, 202)
+            self.workers.run_until_empty()
+        self.callback_post.assert_called_once()
+        args, kwargs = self.callback_post.call_args
+        self.assertEqual(args[0], 'https://hooks.ejemplo.com/hook')
+        self.assertFalse(kwargs['allow_redirects'])
+        self.assertEqual(kwargs['json']['status'], 'completed')
+
+    @override_settings(AI_JOB_CALLBACK_ALLOWED_HOSTS=['.ejemplo.com'])
+    def test_callback_allowlist(self):
+        self.assertEqual(self._submit(callback_url='https://otro.com/hook').status_code, 400)
+        self.assertEqual(self._submit(callback_url='https://hooks.ejemplo.com/hook').status_code, 202)
+        self.workers.run_until_empty()
+        self.assertEqual(self.callback_post.call_args[0][0], 'https://hooks.ejemplo.com/hook')
+
+
+class BlobStoreTests(TestCase):
+    def setUp(self):
+        self.data_url, _ = normalize_image(jpeg_bytes(pattern((0.3, 0.6, 1))), 10 ** 8)
+
+    def test_images_go_to_private_storage_once(self):
+        first, second = externalize_image_urls([self.data_url, self.data_url])
+        self.assertEqual(first, second)
+        name = blob_name(first['sha256'], first['content_type'])
+        self.assertTrue(blob_storage().exists(name))
+        self.assertFalse(blob_storage().path(name).startswith(str(settings.MEDIA_ROOT)))
+        self.assertFalse(default_storage.exists(f"ai_images/{name}"))
+        self.assertEqual(resolve_image_url(first), self.data_url)
+
+    def test_admin_serves_images_only_to_staff(self):
+        ai_request = AIRequest.objects.create(prompt='p', image_urls=externalize_image_urls([self.data_url]))
+        url = ai_request.image_file_urls()[0]
+        self.assertFalse(url.startswith(settings.MEDIA_URL))
+
+        User.objects.create_user('cliente', password='x')
+        self.client.login(username='cliente', password='x')
+        self.assertNotEqual(self.client.get(url).status_code, 200)
+
+        self.client.force_login(User.objects.create_superuser('admin', password='x'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(b''.join(response.streaming_content), base64.b64decode(self.data_url.split(',', 1)[1]))
+
+    def test_migration_moves_public_blobs_to_private_storage(self):
+        ref = externalize_image_urls([self.data_url])[0]
+        name = blob_name(ref['sha256'], ref['content_type'])
+        with blob_storage().open(name, 'rb') as blob:
+            content = blob.read()
+        blob_storage().delete(name)
+        default_storage.save(f"ai_images/{name}", ContentFile(content))
+        AIRequest.objects.create(prompt='p', image_urls=[ref])
+
+        migration = import_module('AI_API.migrations.0010_move_image_blobs_to_private_storage')
+        migration.move_to_private_storage(apps, None)
+        self.assertFalse(default_storage.exists(f"ai_images/{name}"))
+        self.assertEqual(resolve_image_url(ref), self.data_url)
+
+
+class RequestLogTests(TestCase):
+    def setUp(self):
+        config = AIConfiguration(name='test', lightning_endpoint='http://gemma.test', api_key='k')
+        self.service = Gemma3Service(config)
+        # Sin el hilo flusher: el test vacía el buffer en su propia transacción
+        patcher = mock.patch.object(request_log_writer, '_start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        request_log_writer.flush()
+
+    def _completion(self, text):
+        response = mock.Mock(headers={'content-type': 'application/json'})
+        response.json.return_value = {'choices': [{'message': {'content': text}}], 'usage': {'total_tokens': 7}}
+        return response
+
+    def test_request_id_matches_the_logged_row(self):
+        with mock.patch.object(self.service.session, 'post', return_value=self._completion('hola')):
+            result = self.service.generate_response('¿qué es?', request_type='chat')
+        self.assertEqual(request_log_writer.flush(), 1)
+        row = AIRequest.objects.get(public_id=result['request_id'])
+        self.assertEqual((row.status, row.response_text, row.response_tokens), ('completed', 'hola', 7))
+
+    def test_failed_call_is_logged_under_its_request_id(self):
+        error = requests.exceptions.ConnectionError('sin conexión')
+        with mock.patch.object(self.service.session, 'post', side_effect=error):
+            result = self.service.generate_response('¿qué es?', request_type='chat')
+        request_log_writer.flush()
+        self.assertEqual(AIRequest.objects.get(public_id=result['request_id']).status, 'failed')
+
+
+@override_settings(AI_LB_STRATEGY='failover', AI_CIRCUIT_BREAKER_ENABLED=True,
+                   LIGHTNING_AI_ENDPOINT='http://desde-settings.test', AI_HTTP_TIMEOUT=60)
+class InProcessClientConfigTests(TestCase):
+    def setUp(self):
+        ai_config_registry.invalidate()
+        self.addCleanup(ai_config_registry.invalidate)
+        self.config = AIConfiguration.objects.create(
+            name='principal', lightning_endpoint='http://gemma-a.test/', api_key='clave-a',
+            model_name='gemma-a', timeout_seconds=12,
+        )
+
+    def assertUsesConfig(self, client, config):
+        self.assertEqual(
+            (client.endpoint, client.api_key, client.model_name, client.timeout),
+            (config.lightning_endpoint.rstrip('/'), config.api_key, config.model_name, config.timeout_seconds),
+        )
+
+    def test_primary_comes_from_the_active_configuration(self):
+        self.assertUsesConfig(create_ai_client(provider='inprocess').primary, self.config)
+
+    def test_admin_edits_apply_to_new_clients(self):
+        self.config.lightning_endpoint = 'http://gemma-b.test'
+        self.config.model_name = 'gemma-b'
+        self.config.timeout_seconds = 30
+        self.config.save()
+        self.assertUsesConfig(create_ai_client(provider='inprocess').primary, self.config)
+
+    def test_failover_secondary_uses_its_own_configuration(self):
+        backup = AIConfiguration.objects.create(
+            name='respaldo', lightning_endpoint='http://gemma-c.test', api_key='clave-c',
+            model_name='gemma-c', timeout_seconds=20,
+        )
+        client = create_ai_client(provider='inprocess')
+        self.assertUsesConfig(client.primary, self.config)
+        self.assertUsesConfig(client.secondary, backup)
+
+    def test_settings_are_only_a_fallback_without_database(self):
+        with mock.patch.object(ai_config_registry, 'active', side_effect=DatabaseError):
+            client = InProcessChatClient()
+        self.assertEqual((client.endpoint, client.timeout), ('http://desde-settings.test', 60))
+
+    def test_response_without_usage_reports_no_tokens_and_unique_ids(self):
+        client = InProcessChatClient(endpoint='http://gemma.test', fallback_to_mock=False)
+        deltas = [('tres palabras ', None), ('de respuesta', None)]
+        with mock.patch.object(client, '_iter_deltas', side_effect=lambda payload: iter(deltas)):
+            first = client.generate_response('hola')
+            second = client.generate_response('hola')
+        self.assertTrue(first['success'])
+        self.assertEqual(first['tokens_used'], 0)
+        self.assertNotEqual(first['request_id'], second['request_id'])
+
+    def test_usage_from_the_server_is_reported(self):
+        client = InProcessChatClient(endpoint='http://gemma.test', fallback_to_mock=False)
+        deltas = [('respuesta', None), ('', {'total_tokens': 42})]
+        with mock.patch.object(client, '_iter_deltas', side_effect=lambda payload: iter(deltas)):
+            self.assertEqual(client.generate_response('hola')['tokens_used'], 42)
+
+
+class RecordingClient:
+    """Cliente falso que anota en qué hilo corrió cada llamada y el deadline que veía."""
+
+    def __init__(self, delay=0.0, success=True):
+        self.endpoint = f'http://ai-{uuid.uuid4()}.test'
+        self.delay = delay
+        self.success = success
+        self.threads = []
+
+    def generate_response(self, **kwargs):
+        self.threads.append(threading.get_ident())
+        time.sleep(self.delay)
+        return {'success': self.success, 'response': self.endpoint, 'processing_time': self.delay,
+                'request_id': None}
+
+
+class AsyncSleepingClient(RecordingClient):
+    async def agenerate_response(self, **kwargs):
+        await asyncio.sleep(self.delay)
+        return {'success': self.success, 'response': self.endpoint, 'processing_time': self.delay,
+                'request_id': None}
+
+
+class DeadlineRecordingClient(MockAIService):
+    """MockAIService que anota el tiempo restante del request en cada llamada."""
+
+    def __init__(self):
+        super().__init__()
+        self.remaining = []
+
+    def generate_response(self, *args, **kwargs):
+        self.remaining.append(remaining_time())
+        return super().generate_response(*args, **kwargs)
+
+    def stream_response(self, *args, **kwargs):
+        self.remaining.append(remaining_time())
+        yield from super().stream_response(*args, **kwargs)
+
+
+@override_settings(AI_HEDGE_ENABLED=True, AI_HEDGE_DEFAULT_DELAY=0.05)
+class ResilientClientTests(TestCase):
+    def test_primary_runs_on_the_calling_thread(self):
+        primary = RecordingClient()
+        result = ResilientAIClient(primary).generate_response('hola')
+        self.assertTrue(result['success'])
+        self.assertEqual(primary.threads, [threading.get_ident()])
+
+    def test_retry_on_the_secondary_runs_on_the_calling_thread(self):
+        primary, secondary = RecordingClient(success=False), RecordingClient()
+        with override_settings(AI_HEDGE_ENABLED=False):
+            result = ResilientAIClient(primary, secondary).generate_response('hola')
+        self.assertEqual(result['response'], secondary.endpoint)
+        self.assertEqual(primary.threads + secondary.threads, [threading.get_ident()] * 2)
+
+    def test_slow_primary_is_hedged(self):
+        primary, secondary = RecordingClient(delay=1.0), RecordingClient()
+        start = time.monotonic()
+        result = ResilientAIClient(primary, secondary).generate_response('hola')
+        self.assertEqual(result['response'], secondary.endpoint)
+        self.assertLess(time.monotonic() - start, 0.9)
+
+    @override_settings(AI_BREAKER_OPEN_SECONDS=0.01, AI_HEDGE_ENABLED=False)
+    def test_cancelled_half_open_probe_is_released(self):
+        client = ResilientAIClient(AsyncSleepingClient(delay=5))
+        breaker = client.breaker
+        for _ in range(breaker.min_calls):
+            breaker.record(False, 0.0)
+        time.sleep(0.02)
+
+        async def cancel_probe():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.agenerate_response('hola'), 0.05)
+
+        asyncio.run(cancel_probe())
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+
+    def test_full_hedge_pool_does_not_queue_calls(self):
+        primary, secondary = RecordingClient(), RecordingClient()
+        with mock.patch('AI_API.resilience._reserve_hedge_thread', return_value=False):
+            result = ResilientAIClient(primary, secondary).generate_response('hola')
+        self.assertEqual(result['response'], primary.endpoint)
+        self.assertEqual(primary.threads, [threading.get_ident()])
+        self.assertEqual(secondary.threads, [])
+
+
+@override_settings(AI_RESULT_CACHE_ENABLED=False, AI_PHASH_ENABLED=False, AI_REQUEST_DEADLINE_SECONDS=60)
+class StreamDeadlineTests(TestCase):
+    """El deadline del request sigue vigente mientras se transmite el SSE."""
+
+    def setUp(self):
+        self.ai_client = DeadlineRecordingClient()
+        patcher = mock.patch('AI_API.views.create_ai_client', return_value=self.ai_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        pause_request_log(self)
+
+    def _stream(self, name, field):
+        upload = SimpleUploadedFile('producto.jpg', jpeg_bytes(pattern((1, 0.5, 0.2))), content_type='image/jpeg')
+        response = self.client.post(reverse(name), {field: upload}, HTTP_X_REQUEST_TIMEOUT='30')
+        body = b''.join(response.streaming_content).decode('utf-8')
+        self.assertIn('event: done', body)
+
+    def test_stream_calls_see_the_deadline(self):
+        self._stream('ai_api:analyze_product_image_stream', 'image')
+        self.assertEqual(len(self.ai_client.remaining), 1)
+        self.assertTrue(0 < self.ai_client.remaining[0] <= 30)
+
+    def test_batch_calls_see_the_deadline(self):
+        self._stream('ai_api:analyze_product_image_batch', 'images')
+        self.assertEqual(len(self.ai_client.remaining), 1)
+        self.assertTrue(0 < self.ai_client.remaining[0] <= 30)
+
+
+class ReplicaClient(RecordingClient):
+    """RecordingClient que además mide cuántas llamadas tuvo a la vez."""
+
+    def __init__(self, delay=0.0, success=True):
+        super().__init__(delay, success)
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def _leave(self):
+        with self._lock:
+            self.active -= 1
+
+    def generate_response(self, **kwargs):
+        self._enter()
+        try:
+            return super().generate_response(**kwargs)
+        finally:
+            self._leave()
+
+    async def agenerate_response(self, **kwargs):
+        self._enter()
+        try:
+            await asyncio.sleep(self.delay)
+            return {'success': self.success, 'response': self.endpoint, 'processing_time': self.delay,
+                    'request_id': None}
+        finally:
+            self._leave()
+
+
+@override_settings(AI_LB_STRATEGY='p2c', AI_LB_QUEUE_TIMEOUT=5, AI_LB_EJECT_AFTER=3, AI_LB_EJECT_SECONDS=30)
+class LoadBalancerTests(TestCase):
+    def _snapshot(self, client):
+        return next(item for item in endpoint_snapshots() if item['endpoint'] == client.endpoint)
+
+    def test_concurrent_calls_spread_without_passing_the_caps(self):
+        replicas = [ReplicaClient(delay=0.05) for _ in range(3)]
+        balancer = LoadBalancedAIClient([(replica, 2) for replica in replicas])
+        threads = [threading.Thread(target=balancer.generate_response, args=('hola',)) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(len(replica.threads) for replica in replicas), 12)
+        for replica in replicas:
+            self.assertTrue(replica.threads)
+            self.assertLessEqual(replica.peak, 2)
+
+    def test_failed_call_retries_elsewhere_and_ejects_the_replica(self):
+        broken, healthy = ReplicaClient(success=False), ReplicaClient()
+        balancer = LoadBalancedAIClient([(broken, 4), (healthy, 4)], strategy='least_outstanding')
+        for _ in range(3):
+            self.assertEqual(balancer.generate_response('hola')['response'], healthy.endpoint)
+        self.assertEqual(len(broken.threads), 3)
+        self.assertTrue(self._snapshot(broken)['ejected'])
+        balancer.generate_response('hola')
+        self.assertEqual(len(broken.threads), 3)
+
+    def test_async_waiter_is_woken_by_a_release_from_another_thread(self):
+        replica = ReplicaClient()
+        balancer = LoadBalancedAIClient([(replica, 1)])
+        _, state = balancer._acquire(set())
+        threading.Timer(0.1, balancer._release, args=(state, True, 0.1)).start()
+
+        async def acquire():
+            start = time.monotonic()
+            with mock.patch('AI_API.load_balancer.asyncio.sleep', side_effect=AssertionError('busy-poll')):
+                choice = await balancer._aacquire(set())
+            return choice, time.monotonic() - start
+
+        (_, acquired), waited = asyncio.run(acquire())
+        self.assertIs(acquired, state)
+        self.assertLess(waited, 1)
+        balancer._release(state, True, 0.1)
+
+    def test_model_identity_covers_every_replica(self):
+        first, second = ReplicaClient(), ReplicaClient()
+        first.model_name, second.model_name = 'gemma-b', 'gemma-a'
+        balancer = LoadBalancedAIClient([(first, 1), (second, 1)])
+        self.assertEqual(balancer.model_name, 'gemma-a+gemma-b')
+        self.assertIsNone(balancer.config)
+
+        second.model_name = 'gemma-b'
+        self.assertEqual(balancer.model_name, 'gemma-b')
+
+    @override_settings(AI_RESULT_CACHE_ENABLED=True, AI_PHASH_ENABLED=False)
+    def test_cache_is_not_shared_with_a_single_model(self):
+        caches['default'].clear()
+        pause_request_log(self)
+        replicas = [CountingMockClient(), CountingMockClient()]
+        for replica, name in zip(replicas, ('gemma-a', 'gemma-b')):
+            replica.model_name = name
+            replica.endpoint = f'http://{name}-{uuid.uuid4()}.test'
+        image_url, _ = normalize_image(jpeg_bytes(pattern((1, 0.5, 0.2))), 10 ** 8)
+
+        balanced = ProductAIService(ai_client=LoadBalancedAIClient([(replica, 2) for replica in replicas]))
+        balanced.analyze_product_complete(image_url)
+        self.assertTrue(balanced.analyze_product_complete(image_url)['cache_hit'])
+
+        single = ProductAIService(ai_client=replicas[0])
+        self.assertFalse(single.analyze_product_complete(image_url)['cache_hit'])
+
+    def test_async_calls_share_the_caps(self):
+        replicas = [ReplicaClient(delay=0.05) for _ in range(2)]
+        balancer = LoadBalancedAIClient([(replica, 1) for replica in replicas])
+
+        async def run():
+            return await asyncio.gather(*(balancer.agenerate_response('hola') for _ in range(6)))
+
+        results = asyncio.run(run())
+        self.assertTrue(all(result['success'] for result in results))
+        self.assertEqual([replica.peak for replica in replicas], [1, 1])
+
+
+@override_settings(AI_ADMISSION_INITIAL_LIMIT=1, AI_ADMISSION_PER_USER_LIMIT=2, AI_ADMISSION_MAX_QUEUE=4,
+                   AI_ADMISSION_QUEUE_TIMEOUT=5)
+class AdmissionControllerTests(TestCase):
+    def setUp(self):
+        self.controller = AdmissionController()
+
+    def test_per_user_limit_counts_queued_requests(self):
+        self.controller.acquire('user:1')
+        with self.assertRaises(AdmissionRejected) as rejected:
+            asyncio.run(self._acquire_twice('user:1'))
+        self.assertEqual(rejected.exception.status, 429)
+
+    async def _acquire_twice(self, key):
+        waiter = asyncio.ensure_future(self.controller.aacquire(key))
+        await asyncio.sleep(0)
+        try:
+            await self.controller.aacquire(key)
+        finally:
+            waiter.cancel()
+
+    def test_async_waiter_is_woken_by_a_release_from_another_thread(self):
+        permit = self.controller.acquire('user:1')
+        threading.Timer(0.1, permit.release).start()
+
+        async def acquire():
+            start = time.monotonic()
+            with mock.patch('AI_API.admission.asyncio.sleep', side_effect=AssertionError('busy-poll')):
+                queued = await self.controller.aacquire('user:2')
+            return queued, time.monotonic() - start
+
+        queued, waited = asyncio.run(acquire())
+        self.assertLess(waited, 1)
+        self.assertEqual(self.controller.snapshot()['waiting'], 0)
+        queued.release()
+
+    @override_settings(AI_ADMISSION_QUEUE_TIMEOUT=0.1)
+    def test_queue_timeout_rejects_with_503(self):
+        self.controller.acquire('user:1')
+        with self.assertRaises(AdmissionRejected) as rejected:
+            asyncio.run(self.controller.aacquire('user:2'))
+        self.assertEqual(rejected.exception.status, 503)
+        self.assertEqual(self.controller.snapshot()['waiting'], 0)
+
+    def test_cancelled_waiter_leaves_the_queue(self):
+        permit = self.controller.acquire('user:1')
+
+        async def cancel_waiter():
+            waiter = asyncio.ensure_future(self.controller.aacquire('user:2'))
+            await asyncio.sleep(0.05)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+
+        asyncio.run(cancel_waiter())
+        self.assertEqual(self.controller.snapshot()['waiting'], 0)
+        self.assertEqual(len(self.controller._async_waiters), 0)
+        permit.release()
+        self.assertEqual(self.controller.snapshot()['in_flight'], 0)
+
+
+class ConcurrencyMockClient(MockAIService):
+    """MockAIService que mide cuántas llamadas al modelo tuvo a la vez."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def generate_response(self, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            return super().generate_response(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@override_settings(AI_RESULT_CACHE_ENABLED=True, AI_PHASH_ENABLED=False, AI_BATCH_CONCURRENCY=8,
+                   AI_ADMISSION_INITIAL_LIMIT=16, AI_ADMISSION_PER_USER_LIMIT=2)
+class BatchAdmissionTests(TestCase):
+    def setUp(self):
+        pause_request_log(self)
+        for alias in caches:
+            caches[alias].clear()
+        self.controller = AdmissionController()
+        for target in ('AI_API.batch_analysis.admission_controller', 'AI_API.admission.admission_controller'):
+            patcher = mock.patch(target, self.controller)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.acquire = mock.patch.object(self.controller, 'acquire', wraps=self.controller.acquire)
+        self.acquired = self.acquire.start()
+        self.addCleanup(self.acquire.stop)
+        self.ai_client = ConcurrencyMockClient()
+        self.service = ProductAIService(ai_client=self.ai_client)
+
+    def _uploads(self):
+        tints = [(1, 0.5, 0.2), (0.2, 1, 0.5), (0.5, 0.2, 1), (1, 1, 0.2), (0.2, 0.2, 0.2)]
+        return [SimpleUploadedFile(f'{i}.jpg', jpeg_bytes(pattern(tint)), content_type='image/jpeg')
+                for i, tint in enumerate(tints)]
+
+    def _run(self):
+        events = list(iter_batch_analysis(self._uploads(), self.service, admission=True))
+        self.assertEqual(events[-1][0], 'done')
+        return events[-1][1]
+
+    def test_each_model_call_takes_a_global_permit(self):
+        summary = self._run()
+        self.assertEqual(summary['succeeded'], 5)
+        self.assertEqual(self.acquired.call_args_list, [mock.call(None)] * 5)
+        self.assertGreater(self.ai_client.peak, 2)
+        self.assertEqual(self.controller.snapshot()['in_flight'], 0)
+
+    def test_batch_runs_while_the_user_has_another_request_in_flight(self):
+        User.objects.create_user('cliente', password='secreta')
+        other_request = self.controller.acquire(f"user:{User.objects.get().pk}")
+        credentials = base64.b64encode(b'cliente:secreta').decode('ascii')
+        with mock.patch('AI_API.views.create_ai_client', return_value=self.ai_client):
+            response = self.client.post(reverse('ai_api:analyze_product_image_batch'), {'images': self._uploads()},
+                                        HTTP_AUTHORIZATION=f'Basic {credentials}')
+            body = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body.count('event: result'), 5)
+        self.assertNotIn('"success": false', body)
+
+        other_request.release()
+        self.assertEqual(self.controller._per_key, {})
+        self.assertEqual(self.controller.snapshot()['in_flight'], 0)
+
+    def test_cache_hits_need_no_permit(self):
+        self._run()
+        self.acquired.reset_mock()
+        summary = self._run()
+        self.assertEqual(summary['succeeded'], 5)
+        self.assertEqual(self.acquired.call_count, 0)
+        self.assertEqual(self.ai_client.calls, 5)
+
+    def test_saturated_controller_fails_only_the_model_calls(self):
+        with mock.patch.object(self.controller, '_enter', side_effect=AdmissionRejected(503, 'saturado', 3)):
+            summary = self._run()
+        self.assertEqual(summary['failed'], 5)
+        self.assertEqual(self.ai_client.calls, 0)
+
+
+@override_settings(AI_RESULT_CACHE_ENABLED=True, AI_PHASH_ENABLED=False)
+class AnalysisCacheTests(TestCase):
+    def setUp(self):
+        for alias in caches:
+            caches[alias].clear()
+        pause_request_log(self)
+        self.service = ProductAIService(ai_client=CountingMockClient())
+
+    def test_cache_hit_gets_its_own_logged_request_id(self):
+        image_url, _ = normalize_image(jpeg_bytes(pattern((1, 0.5, 0.2))), 10 ** 8)
+        first = self.service.analyze_product_complete(image_url)
+        second = self.service.analyze_product_complete(image_url)
+        self.assertTrue(second['cache_hit'])
+        self.assertNotEqual(second['request_id'], first['request_id'])
+        self.assertEqual(second['source_request_id'], first['request_id'])
+
+        request_log_writer.flush()
+        logged = AIRequest.objects.get(public_id=second['request_id'])
+        self.assertEqual((logged.status, logged.result), ('completed', second['data']))
+
+    def test_streamed_analysis_is_logged(self):
+        image_url, _ = normalize_image(jpeg_bytes(pattern((0.2, 1, 0.5))), 10 ** 8)
+        user = User.objects.create_user('streamer', password='x')
+        events = list(self.service.stream_product_analysis(image_url, user=user))
+        event, done = events[-1]
+        self.assertEqual(event, 'done')
+        self.assertEqual(self.service.ai_client.calls, 0)
+
+        request_log_writer.flush()
+        logged = AIRequest.objects.get(public_id=done['request_id'])
+        self.assertEqual((logged.status, logged.user), ('completed', user))
+        self.assertEqual(logged.response_text, ''.join(data['text'] for name, data in events if name == 'token'))
+
+    def test_stats_are_staff_only(self):
+        url = reverse('ai_api:analysis_cache_stats')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        User.objects.create_user('cliente', password='x')
+        self.client.login(username='cliente', password='x')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        User.objects.create_user('staff', password='x', is_staff=True)
+        self.client.login(username='staff', password='x')
+        self.assertEqual(self.client.get(url).status_code, 200)
@@ -8,4 +8,10 @@ urlpatterns = [
     # Endpoints principales
     path('health/', views.health_check, name='health_check'),
     path('analyze-product/', views.analyze_product_image_upload, name='analyze_product_image_upload'),
+    path('analyze-product/async/', views.analyze_product_image_upload_async, name='analyze_product_image_upload_async'),
+    path('analyze-product/stream/', views.analyze_product_image_stream, name='analyze_product_image_stream'),
+    path('analyze-product/batch/', views.analyze_product_image_batch, name='analyze_product_image_batch'),
+    path('analysis-jobs/', views.submit_analysis_job, name='submit_analysis_job'),
+    path('analysis-jobs/<uuid:job_id>/', views.analysis_job_status, name='analysis_job_status'),
+    path('cache/stats/', views.analysis_cache_stats, name='analysis_cache_stats'),
 ]
@@ -1,14 +1,77 @@
-from rest_framework import status
+import functools
+import json
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework import exceptions, status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
 from .services import ProductAIService
 from .factory import create_ai_client
+from .result_cache import AnalysisResultCache
+from .image_prep import ImageTooLarge, prepare_upload_image
+from .jobs import JOB_REQUEST_TYPE, InvalidCallbackURL, enqueue_analysis, job_payload, validate_callback_url
+from .models import AIRequest
+from .resilience import breaker_snapshots, stream_with_deadline
+from .load_balancer import endpoint_snapshots
+from .admission import admission_controlled, admission_controller
+from .batch_analysis import iter_batch_analysis
+
 
+def _authenticate(request):
+    """
+    Autentica como lo haría @api_view (DEFAULT_AUTHENTICATION_CLASSES): sin
+    credenciales la request es anónima; con la cookie de sesión
+    SessionAuthentication exige el token CSRF. Devuelve la respuesta de error
+    o None.
+    """
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except exceptions.APIException as e:
+        return JsonResponse({'detail': e.detail}, status=e.status_code)
+    request.user = user
 
+    async def auser():
+        return user
+    request.auser = auser
+    return None
+
+
+def api_authenticated(view):
+    """
+    Para las vistas Django simples (async o SSE) que no pueden ir bajo
+    @api_view: csrf_exempt más la autenticación de DRF, igual que
+    /analyze-product/ con AllowAny. Va encima de @admission_controlled para
+    que el límite por usuario vea al usuario autenticado.
+    """
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            denied = await sync_to_async(_authenticate)(request)
+            if denied is not None:
+                return denied
+            return await view(request, *args, **kwargs)
+        return csrf_exempt(async_wrapper)
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        denied = _authenticate(request)
+        if denied is not None:
+            return denied
+        return view(request, *args, **kwargs)
+    return csrf_exempt(wrapper)
 
 
 @swagger_auto_schema(
@@ -25,6 +88,9 @@ def health_check(request):
         ai_client = create_ai_client()
         ai_service = ProductAIService(ai_client=ai_client)
         health_status = ai_service.health_check()
+        health_status['circuits'] = breaker_snapshots()
+        health_status['load_balancer'] = endpoint_snapshots()
+        health_status['admission'] = admission_controller.snapshot()
         
         if health_status['status'] == 'healthy':
             return Response(health_status, status=status.HTTP_200_OK)
@@ -39,6 +105,19 @@ def health_check(request):
         )
 
 
+@swagger_auto_schema(
+    method='get',
+    operation_description="Contadores de aciertos/fallos de la caché de análisis de productos",
+)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def analysis_cache_stats(request):
+    """
+    Expone los contadores de la caché de resultados de análisis (solo staff)
+    """
+    return Response(AnalysisResultCache().stats(), status=status.HTTP_200_OK)
+
+
 @swagger_auto_schema(
     method='post',
     operation_description="Analiza una imagen de producto subida directamente y genera información completa",
@@ -52,6 +131,7 @@ def health_check(request):
 )
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@admission_controlled
 def analyze_product_image_upload(request):
     """
     Analiza una imagen de producto subida directamente y genera información completa para auto-llenar formulario
@@ -65,57 +145,228 @@ def analyze_product_image_upload(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Convertir imagen a base64 para enviar directamente
-        import base64
-        from PIL import Image
-        import io
-        
-        # Leer y redimensionar la imagen para reducir el tamaño
-        image_content = image_file.read()
-        
-        # Abrir imagen con PIL
-        image = Image.open(io.BytesIO(image_content))
-        
-        # Redimensionar si es muy grande (máximo 800x600)
-        if image.width > 800 or image.height > 600:
-            image.thumbnail((800, 600), Image.Resampling.LANCZOS)
+        image_url, perceptual_hash = prepare_upload_image(image_file)
         
-        # Convertir a JPEG para reducir tamaño
-        output = io.BytesIO()
-        image.convert('RGB').save(output, format='JPEG', quality=85)
-        image_content = output.getvalue()
-        
-        # Convertir a base64
-        image_base64 = base64.b64encode(image_content).decode('utf-8')
+        # Realizar análisis completo - cliente en proceso con pool de conexiones
+        ai_client = create_ai_client(provider='inprocess')
+        ai_service = ProductAIService(ai_client=ai_client)
+        result = ai_service.analyze_product_complete(
+            image_url, user=request.user, perceptual_hash=perceptual_hash
+        )
         
-        # Crear URL de datos (data URL)
-        image_url = f"data:image/jpeg;base64,{image_base64}"
+        body, status_code = _analysis_response(result)
+        return Response(body, status=status_code)
         
+    except ImageTooLarge as e:
+        return Response({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    except Exception as e:
         
+        return Response(
+            {'error': 'Error interno del servidor'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@swagger_auto_schema(
+    method='post',
+    operation_description="Encola el análisis de una imagen de producto y devuelve el id del trabajo (202)",
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            'image': openapi.Schema(type=openapi.TYPE_FILE, description='Archivo de imagen del producto'),
+            'callback_url': openapi.Schema(type=openapi.TYPE_STRING, description='URL que recibe el resultado por POST (opcional)'),
+        },
+        required=['image']
+    ),
+)
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def submit_analysis_job(request):
+    """
+    Encola el análisis de una imagen; los workers de run_ai_workers lo procesan.
+    El resultado se consulta en poll_url o se recibe en callback_url.
+    """
+    image_file = request.FILES.get('image')
+    if not image_file:
+        return Response(
+            {'error': 'No se proporcionó imagen'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    callback_url = request.data.get('callback_url', '')
+    if callback_url:
+        try:
+            validate_callback_url(callback_url)
+        except InvalidCallbackURL as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        image_url, perceptual_hash = prepare_upload_image(image_file)
+    except ImageTooLarge as e:
+        return Response({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    except Exception:
+        return Response({'error': 'Imagen inválida'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    job = enqueue_analysis(
+        image_url,
+        user=request.user if request.user.is_authenticated else None,
+        perceptual_hash=perceptual_hash,
+        callback_url=callback_url,
+    )
+    poll_url = request.build_absolute_uri(reverse('ai_api:analysis_job_status', args=[job.public_id]))
+    return Response(
+        {'job_id': str(job.public_id), 'status': job.status, 'poll_url': poll_url},
+        status=status.HTTP_202_ACCEPTED,
+        headers={'Location': poll_url},
+    )
+
+
+@swagger_auto_schema(
+    method='get',
+    operation_description="Estado y resultado de un trabajo de análisis encolado",
+)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def analysis_job_status(request, job_id):
+    """
+    Devuelve el estado del trabajo; data trae el análisis cuando status es completed.
+    Se consulta por el UUID devuelto al encolar, no por el id secuencial.
+    """
+    job = get_object_or_404(AIRequest, public_id=job_id, request_type=JOB_REQUEST_TYPE)
+    # Los trabajos de un usuario solo los ve ese usuario
+    if job.user_id and job.user_id != request.user.pk:
+        return Response({'error': 'Trabajo no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(job_payload(job), status=status.HTTP_200_OK)
+
+
+@require_POST
+@api_authenticated
+@admission_controlled
+async def analyze_product_image_upload_async(request):
+    """
+    Variante ASGI de analyze_product_image_upload: la espera al modelo se hace
+    con await, así que un proceso sostiene cientos de análisis en vuelo sin
+    ocupar un hilo por cada uno. Requiere servir con productplatform.asgi.
+    """
+    try:
+        image_file = request.FILES.get('image')
+        if not image_file:
+            return JsonResponse({'error': 'No se proporcionó imagen'}, status=status.HTTP_400_BAD_REQUEST)
         
+        # Decodificar la imagen es trabajo de CPU: fuera del event loop
+        image_url, perceptual_hash = await sync_to_async(
+            prepare_upload_image, thread_sensitive=False
+        )(image_file)
         
-        # Realizar análisis completo - usar el adaptador que funciona
-        ai_client = create_ai_client(provider='clientpy')
+        user = request.user
+        ai_client = await sync_to_async(create_ai_client)(provider='inprocess')
         ai_service = ProductAIService(ai_client=ai_client)
-        result = ai_service.analyze_product_complete(image_url, user=request.user)
-        
-        if result['success']:
-            return Response({
-                'success': True,
-                'data': result['data'],
-                'request_id': result.get('request_id'),
-                'processing_time': result.get('processing_time')
-            })
-        else:
-            return Response({
-                'success': False,
-                'error': result.get('error', 'Error en el análisis de IA'),
-                'raw_response': result.get('raw_response')
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        result = await ai_service.aanalyze_product_complete(
+            image_url, user=user if user.is_authenticated else None, perceptual_hash=perceptual_hash
+        )
         
+        body, status_code = _analysis_response(result)
+        return JsonResponse(body, status=status_code)
+    
+    except ImageTooLarge as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
     except Exception as e:
         
-        return Response(
-            {'error': 'Error interno del servidor'}, 
+        return JsonResponse(
+            {'error': 'Error interno del servidor'},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+
+@require_POST
+@api_authenticated
+@admission_controlled
+def analyze_product_image_stream(request):
+    """
+    Analiza una imagen y transmite el resultado por Server-Sent Events: cada
+    token del modelo (event: token), cada campo del JSON en cuanto se completa
+    (event: field) y el resultado final (event: done / event: error).
+    """
+    image_file = request.FILES.get('image')
+    if not image_file:
+        return JsonResponse({'error': 'No se proporcionó imagen'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        image_url, perceptual_hash = prepare_upload_image(image_file)
+    except ImageTooLarge as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    except Exception:
+        return JsonResponse({'error': 'Imagen inválida'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    user = request.user if request.user.is_authenticated else None
+    ai_service = ProductAIService(ai_client=create_ai_client(provider='inprocess'))
+    
+    def event_stream():
+        try:
+            for event, data in ai_service.stream_product_analysis(
+                image_url, user=user, perceptual_hash=perceptual_hash
+            ):
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        except Exception:
+            yield f"event: error\ndata: {json.dumps({'success': False, 'error': 'Error interno del servidor'})}\n\n"
+    
+    response = StreamingHttpResponse(stream_with_deadline(event_stream()), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # evitar que nginx acumule el stream
+    return response
+
+
+@require_POST
+@api_authenticated
+@admission_controlled(global_slot=False)
+def analyze_product_image_batch(request):
+    """
+    Analiza varias imágenes (campo 'images' repetido) y transmite por SSE un
+    event: result por imagen en cuanto termina y un event: done con el resumen.
+    Las imágenes idénticas se analizan una sola vez. El lote ocupa un cupo del
+    usuario y cada llamada al modelo un cupo global (ver iter_batch_analysis).
+    """
+    image_files = request.FILES.getlist('images')
+    if not image_files:
+        return JsonResponse({'error': 'No se proporcionaron imágenes'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    max_images = getattr(settings, 'AI_BATCH_MAX_IMAGES', 100)
+    if len(image_files) > max_images:
+        return JsonResponse(
+            {'error': f'Máximo {max_images} imágenes por lote'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    user = request.user if request.user.is_authenticated else None
+    provider = getattr(settings, 'AI_BATCH_PROVIDER', 'inprocess')
+    ai_service = ProductAIService(ai_client=create_ai_client(provider=provider))
+    
+    def event_stream():
+        try:
+            for event, data in iter_batch_analysis(image_files, ai_service, user=user,
+                                                   admission=True):
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        except Exception:
+            yield f"event: error\ndata: {json.dumps({'success': False, 'error': 'Error interno del servidor'})}\n\n"
+    
+    response = StreamingHttpResponse(stream_with_deadline(event_stream()), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _analysis_response(result):
+    """Devuelve (cuerpo, status HTTP) para el resultado de un análisis."""
+    if result['success']:
+        return {
+            'success': True,
+            'data': result['data'],
+            'request_id': result.get('request_id'),
+            'processing_time': result.get('processing_time'),
+            'cache_hit': result.get('cache_hit', False)
+        }, status.HTTP_200_OK
+    return {
+        'success': False,
+        'error': result.get('error', 'Error en el análisis de IA'),
+        'raw_response': result.get('raw_response')
+    }, status.HTTP_500_INTERNAL_SERVER_ERROR
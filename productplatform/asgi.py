@@ -5,6 +5,11 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Las vistas async de AI_API (p.ej. /api/ai/analyze-product/async/) solo evitan
+ocupar un hilo por request cuando se sirven por aquí, por ejemplo:
+
+    uvicorn productplatform.asgi:application --workers 2
 """
 
 import os
@@ -19,6 +19,17 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Imágenes enviadas al modelo (AI_API.blob_store): fuera de MEDIA_ROOT y sin URL pública
+AI_BLOB_ROOT = os.getenv('AI_BLOB_ROOT', os.path.join(BASE_DIR, 'private', 'ai_images'))
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'ai_blobs': {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': AI_BLOB_ROOT}},
+}
+
+# Anchos (px) de las miniaturas WebP/JPEG de Product.image (products.renditions)
+PRODUCT_RENDITION_WIDTHS = [int(width) for width in os.getenv('PRODUCT_RENDITION_WIDTHS', '160,320,640,1024').split(',')]
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
 
@@ -54,6 +65,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'AI_API.middleware.RequestDeadlineMiddleware',
 ]
 
 ROOT_URLCONF = 'productplatform.urls'
@@ -136,6 +148,134 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LIGHTNING_AI_ENDPOINT = os.getenv('LIGHTNING_AI_ENDPOINT', 'https://8001-01k4ap2fswtrsc3fyamsj261fp.cloudspaces.litng.ai')
 LIGHTNING_AI_API_KEY = os.getenv('LIGHTNING_AI_API_KEY', 'gemma3-litserve')
 
+# Segundos entre revalidaciones de la AIConfiguration cacheada (los cambios locales aplican al instante)
+AI_CONFIG_REFRESH_SECONDS = int(os.getenv('AI_CONFIG_REFRESH_SECONDS', '30'))
+
+# Segundos entre sondeos de salud en segundo plano del proveedor (create_ai_client no hace I/O)
+AI_HEALTH_CHECK_INTERVAL = int(os.getenv('AI_HEALTH_CHECK_INTERVAL', '15'))
+
+# Circuit breaker por endpoint y hedging hacia una segunda AIConfiguration activa (AI_API.resilience)
+AI_CIRCUIT_BREAKER_ENABLED = os.getenv('AI_CIRCUIT_BREAKER_ENABLED', 'true').lower() == 'true'
+AI_BREAKER_WINDOW = int(os.getenv('AI_BREAKER_WINDOW', '20'))
+AI_BREAKER_MIN_CALLS = int(os.getenv('AI_BREAKER_MIN_CALLS', '5'))
+AI_BREAKER_FAILURE_RATE = float(os.getenv('AI_BREAKER_FAILURE_RATE', '0.5'))
+AI_BREAKER_SLOW_CALL_SECONDS = float(os.getenv('AI_BREAKER_SLOW_CALL_SECONDS', '30'))
+AI_BREAKER_OPEN_SECONDS = float(os.getenv('AI_BREAKER_OPEN_SECONDS', '30'))
+AI_HEDGE_ENABLED = os.getenv('AI_HEDGE_ENABLED', 'true').lower() == 'true'
+AI_HEDGE_DEFAULT_DELAY = float(os.getenv('AI_HEDGE_DEFAULT_DELAY', '10'))
+AI_HEDGE_MIN_DELAY = float(os.getenv('AI_HEDGE_MIN_DELAY', '0.5'))
+# Tiempo máximo que un request HTTP espera al modelo (el header X-Request-Timeout puede acortarlo)
+AI_REQUEST_DEADLINE_SECONDS = float(os.getenv('AI_REQUEST_DEADLINE_SECONDS', '120'))
+
+# Balanceo entre varias AIConfiguration activas (AI_API.load_balancer): 'p2c',
+# 'least_outstanding' o 'failover' (solo principal + hedging a la segunda)
+AI_LB_STRATEGY = os.getenv('AI_LB_STRATEGY', 'p2c')
+AI_LB_EJECT_AFTER = int(os.getenv('AI_LB_EJECT_AFTER', '3'))
+AI_LB_EJECT_SECONDS = float(os.getenv('AI_LB_EJECT_SECONDS', '30'))
+AI_LB_RETRIES = int(os.getenv('AI_LB_RETRIES', '1'))
+AI_LB_QUEUE_TIMEOUT = float(os.getenv('AI_LB_QUEUE_TIMEOUT', '30'))
+
+# Control de admisión de las vistas de análisis (AI_API.admission): límite
+# adaptativo AIMD por proceso, límite por usuario y cola acotada (429/503 + Retry-After)
+AI_ADMISSION_ENABLED = os.getenv('AI_ADMISSION_ENABLED', 'true').lower() == 'true'
+AI_ADMISSION_INITIAL_LIMIT = int(os.getenv('AI_ADMISSION_INITIAL_LIMIT', '4'))
+AI_ADMISSION_MIN_LIMIT = int(os.getenv('AI_ADMISSION_MIN_LIMIT', '1'))
+AI_ADMISSION_MAX_LIMIT = int(os.getenv('AI_ADMISSION_MAX_LIMIT', '32'))
+AI_ADMISSION_PER_USER_LIMIT = int(os.getenv('AI_ADMISSION_PER_USER_LIMIT', '2'))
+AI_ADMISSION_MAX_QUEUE = int(os.getenv('AI_ADMISSION_MAX_QUEUE', '16'))
+AI_ADMISSION_QUEUE_TIMEOUT = float(os.getenv('AI_ADMISSION_QUEUE_TIMEOUT', '5'))
+# 0 = objetivo derivado de la menor latencia observada x AI_ADMISSION_LATENCY_TOLERANCE
+AI_ADMISSION_TARGET_LATENCY = float(os.getenv('AI_ADMISSION_TARGET_LATENCY', '0'))
+AI_ADMISSION_LATENCY_TOLERANCE = float(os.getenv('AI_ADMISSION_LATENCY_TOLERANCE', '2.0'))
+AI_ADMISSION_BACKOFF = float(os.getenv('AI_ADMISSION_BACKOFF', '0.8'))
+
+# Análisis por lotes (/api/ai/analyze-product/batch/)
+AI_BATCH_PROVIDER = os.getenv('AI_BATCH_PROVIDER', 'inprocess')
+AI_BATCH_MAX_IMAGES = int(os.getenv('AI_BATCH_MAX_IMAGES', '100'))
+AI_BATCH_CONCURRENCY = int(os.getenv('AI_BATCH_CONCURRENCY', '8'))
+
+# Normalización de imágenes subidas (AI_API.image_prep): límites validados antes
+# de decodificar y pool de procesos acotado (0 workers = en el hilo del request)
+AI_UPLOAD_MAX_BYTES = int(os.getenv('AI_UPLOAD_MAX_BYTES', str(20 * 1024 * 1024)))
+AI_UPLOAD_MAX_PIXELS = int(os.getenv('AI_UPLOAD_MAX_PIXELS', '50000000'))
+AI_IMAGE_WORKERS = int(os.getenv('AI_IMAGE_WORKERS', '2'))
+AI_IMAGE_MAX_PENDING = int(os.getenv('AI_IMAGE_MAX_PENDING', '16'))
+
+# Pool de conexiones HTTP del cliente en proceso hacia el endpoint de Gemma
+AI_HTTP_POOL_SIZE = int(os.getenv('AI_HTTP_POOL_SIZE', '20'))
+AI_HTTP_TIMEOUT = int(os.getenv('AI_HTTP_TIMEOUT', '60'))
+# Conexiones simultáneas del cliente httpx compartido por las vistas async
+AI_ASYNC_MAX_CONNECTIONS = int(os.getenv('AI_ASYNC_MAX_CONNECTIONS', '200'))
+
+# Caché de resultados de análisis de productos (direccionada por contenido)
+AI_RESULT_CACHE_ENABLED = os.getenv('AI_RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+AI_RESULT_CACHE_TTL = int(os.getenv('AI_RESULT_CACHE_TTL', '3600'))
+
+# Reutilización de análisis para imágenes casi idénticas (distancia de Hamming sobre dHash de 64 bits)
+AI_PHASH_ENABLED = os.getenv('AI_PHASH_ENABLED', 'true').lower() == 'true'
+AI_PHASH_MAX_DISTANCE = int(os.getenv('AI_PHASH_MAX_DISTANCE', '6'))
+# Diferencia máxima por canal (0-255) del color medio: otro color es otro producto
+AI_PHASH_MAX_COLOR_DISTANCE = int(os.getenv('AI_PHASH_MAX_COLOR_DISTANCE', '24'))
+# Sincronización del índice en memoria: filas nuevas por bloque y cada cuántos segundos;
+# la carga inicial corre en un hilo de fondo
+AI_PHASH_SYNC_BATCH = int(os.getenv('AI_PHASH_SYNC_BATCH', '5000'))
+AI_PHASH_SYNC_INTERVAL = float(os.getenv('AI_PHASH_SYNC_INTERVAL', '1.0'))
+AI_PHASH_WARM_IN_BACKGROUND = os.getenv('AI_PHASH_WARM_IN_BACKGROUND', 'true').lower() == 'true'
+
+# Log de requests al modelo: inserciones en lote desde un hilo de fondo
+AI_REQUEST_LOG_BATCH_SIZE = int(os.getenv('AI_REQUEST_LOG_BATCH_SIZE', '50'))
+AI_REQUEST_LOG_FLUSH_INTERVAL = float(os.getenv('AI_REQUEST_LOG_FLUSH_INTERVAL', '2.0'))
+AI_REQUEST_LOG_MAX_BUFFER = int(os.getenv('AI_REQUEST_LOG_MAX_BUFFER', '5000'))
+
+# Cola persistente de análisis (comando run_ai_workers)
+AI_JOB_PROVIDER = os.getenv('AI_JOB_PROVIDER', 'inprocess')
+AI_JOB_CONCURRENCY = int(os.getenv('AI_JOB_CONCURRENCY', '4'))
+AI_JOB_POLL_INTERVAL = float(os.getenv('AI_JOB_POLL_INTERVAL', '1.0'))
+# Segundos sin terminar tras los cuales un trabajo en processing vuelve a la cola
+AI_JOB_VISIBILITY_TIMEOUT = int(os.getenv('AI_JOB_VISIBILITY_TIMEOUT', '600'))
+AI_JOB_MAX_ATTEMPTS = int(os.getenv('AI_JOB_MAX_ATTEMPTS', '3'))
+# Hosts a los que se permite notificar (formato de ALLOWED_HOSTS, separados por coma);
+# vacío = cualquier host que resuelva solo a direcciones públicas
+AI_JOB_CALLBACK_ALLOWED_HOSTS = [host.strip() for host in os.getenv('AI_JOB_CALLBACK_ALLOWED_HOSTS', '').split(',') if host.strip()]
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # LocMemCache desaloja en orden LRU al superar MAX_ENTRIES
+    'ai_results': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ai-results',
+        'TIMEOUT': AI_RESULT_CACHE_TTL,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('AI_RESULT_CACHE_MAX_ENTRIES', '1000')),
+        },
+    },
+    # Fragmentos de plantilla por producto (products.fragment_cache); con varios
+    # workers usar un backend compartido para que la invalidación llegue a todos.
+    # Cada producto ocupa una entrada de versión más una por fragmento.
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'product-fragments',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('PRODUCT_FRAGMENT_CACHE_MAX_ENTRIES', '50000')),
+        },
+    },
+}
+
+# Caché de fragmentos de las tarjetas del catálogo y el detalle de producto
+PRODUCT_FRAGMENT_CACHE_ENABLED = os.getenv('PRODUCT_FRAGMENT_CACHE_ENABLED', 'true').lower() == 'true'
+PRODUCT_FRAGMENT_CACHE_TTL = int(os.getenv('PRODUCT_FRAGMENT_CACHE_TTL', '600'))
+
+# Facetas del catálogo (products.facets): límites de los rangos de precio,
+# etiquetas mostradas y TTL de los conteos cacheados por firma de filtros
+CATALOG_PRICE_BUCKETS = [int(edge) for edge in os.getenv('CATALOG_PRICE_BUCKETS', '0,25,50,100,250,500,1000').split(',')]
+CATALOG_FACET_TAG_LIMIT = int(os.getenv('CATALOG_FACET_TAG_LIMIT', '20'))
+CATALOG_FACET_CACHE_TTL = int(os.getenv('CATALOG_FACET_CACHE_TTL', '300'))
+
 # Public domain configuration for AI image URLs
 PUBLIC_DOMAIN = os.getenv('PUBLIC_DOMAIN', 'localhost:8000')  
 PUBLIC_PROTOCOL = os.getenv('PUBLIC_PROTOCOL', 'http')  
+
+# Búsqueda de productos: 'auto' usa FTS5 (SQLite) o tsvector (Postgres); 'icontains' desactiva el índice
+PRODUCT_SEARCH_BACKEND = os.getenv('PRODUCT_SEARCH_BACKEND', 'auto')
@@ -0,0 +1,177 @@
+"""
+Tabla materializada de conteos para las facetas del catálogo.
+
+Contar productos por categoría, precio, etiqueta y calificación con GROUP BY
+recorre todo el catálogo (segundos con 1M de productos). CatalogFacetCount
+guarda cuántos productos publicados hay en cada celda (categoría, rango de
+precio, banda de calificación) y CatalogTagFacetCount lo mismo por etiqueta.
+Son unos pocos miles de filas, así que products.facets responde cualquier
+combinación de esos filtros sumando celdas.
+
+Las señales de Product, Review y Product.tags (products.signals) mueven el
+producto de celda con UPDATE F() en la misma transacción del cambio. El
+comando rebuild_catalog_facets recalcula todo (p.ej. tras un bulk_create, un
+queryset.update o un cambio de CATALOG_PRICE_BUCKETS).
+"""
+from bisect import bisect_right
+from collections import Counter
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from django.db.models.functions import Cast, Floor
+
+# (category_id, price_bucket, rating_band)
+Cell = Tuple[int, int, int]
+CELL_FIELDS = ('status', 'category_id', 'price', 'average_rating')
+MAX_RATING_BAND = 5
+
+
+def price_buckets() -> List[Decimal]:
+    """Límites de los rangos de precio: [a, b) para cada par consecutivo y el último abierto."""
+    edges = sorted(Decimal(str(edge)) for edge in getattr(settings, 'CATALOG_PRICE_BUCKETS', (0, 25, 50, 100, 250, 500, 1000)))
+    if not edges or edges[0] > 0:
+        edges.insert(0, Decimal('0'))
+    return edges
+
+
+def price_bucket(price, edges: Optional[List[Decimal]] = None) -> int:
+    edges = edges or price_buckets()
+    return max(0, bisect_right(edges, Decimal(price)) - 1)
+
+
+def rating_band(average_rating) -> int:
+    """Parte entera del promedio: la banda N cumple average_rating >= N."""
+    return min(MAX_RATING_BAND, max(0, int(Decimal(average_rating))))
+
+
+def cell_of(status, category_id, price, average_rating) -> Optional[Cell]:
+    if status != 'published':
+        return None
+    return category_id, price_bucket(price), rating_band(average_rating)
+
+
+def product_cells(product_ids: Iterable[int]) -> Dict[int, Optional[Cell]]:
+    """Celda actual de cada producto (None si no está publicado) en una sola consulta."""
+    from .models import Product
+
+    rows = Product.objects.filter(pk__in=list(product_ids)).values_list('pk', *CELL_FIELDS)
+    return {pk: cell_of(*values) for pk, *values in rows}
+
+
+def product_tags(product_ids: Iterable[int]) -> Dict[int, List[int]]:
+    from .models import Product
+
+    tags: Dict[int, List[int]] = {}
+    through = Product.tags.through.objects.filter(product_id__in=list(product_ids))
+    for product_id, tag_id in through.values_list('product_id', 'tag_id'):
+        tags.setdefault(product_id, []).append(tag_id)
+    return tags
+
+
+def _bump(model, key: Dict[str, int], delta: int):
+    rows = model.objects.filter(**key)
+    if rows.update(product_count=F('product_count') + delta) or delta < 0:
+        # Celda actualizada, o resta sobre una que ya borró el CASCADE de su categoría o etiqueta
+        return
+    # Primera vez que se usa la celda; ignore_conflicts cubre la carrera con otro alta
+    model.objects.bulk_create([model(**key)], ignore_conflicts=True)
+    rows.update(product_count=F('product_count') + delta)
+
+
+def apply_changes(cells: Counter, tag_cells: Counter):
+    """Aplica deltas {celda: n} y {(tag_id, celda): n} a las tablas de conteos."""
+    from .models import CatalogFacetCount, CatalogTagFacetCount
+
+    for (category_id, bucket, band), delta in cells.items():
+        if delta:
+            _bump(CatalogFacetCount, {'category_id': category_id, 'price_bucket': bucket, 'rating_band': band}, delta)
+    for (tag_id, (category_id, bucket, band)), delta in tag_cells.items():
+        if delta:
+            _bump(CatalogTagFacetCount, {
+                'tag_id': tag_id, 'category_id': category_id, 'price_bucket': bucket, 'rating_band': band,
+            }, delta)
+
+
+def move_products(before: Dict[int, Optional[Cell]], after: Dict[int, Optional[Cell]],
+                  tags: Optional[Dict[int, List[int]]] = None):
+    """
+    Mueve los productos de su celda anterior a la nueva. `tags` son las
+    etiquetas de cada producto; si no se pasan se leen solo para los que cambiaron.
+    """
+    changed = [pk for pk in set(before) | set(after) if before.get(pk) != after.get(pk)]
+    if not changed:
+        return
+    if tags is None:
+        tags = product_tags(changed)
+    cells, tag_cells = Counter(), Counter()
+    for pk in changed:
+        for cell, delta in ((before.get(pk), -1), (after.get(pk), 1)):
+            if cell is None:
+                continue
+            cells[cell] += delta
+            for tag_id in tags.get(pk, ()):
+                tag_cells[(tag_id, cell)] += delta
+    apply_changes(cells, tag_cells)
+
+
+def tag_products(product_ids: Iterable[int], tag_ids: Iterable[int], delta: int):
+    """Suma (o resta) los productos en las celdas por etiqueta al agregar o quitar etiquetas."""
+    tag_ids = list(tag_ids)
+    tag_cells = Counter()
+    for cell in product_cells(product_ids).values():
+        if cell is not None:
+            for tag_id in tag_ids:
+                tag_cells[(tag_id, cell)] += delta
+    apply_changes(Counter(), tag_cells)
+
+
+def bucket_expression(field: str = 'price'):
+    """price_bucket() en SQL."""
+    edges = price_buckets()
+    return Case(
+        *[When(**{f'{field}__lt': edge}, then=Value(index)) for index, edge in enumerate(edges[1:])],
+        default=Value(len(edges) - 1),
+        output_field=IntegerField(),
+    )
+
+
+def band_expression(field: str = 'average_rating'):
+    """rating_band() en SQL."""
+    return Cast(Floor(field), IntegerField())
+
+
+def rebuild(product_model, facet_model, tag_facet_model) -> int:
+    """
+    Recalcula ambas tablas desde los productos con dos consultas agrupadas.
+    Recibe los modelos para poder usarse desde migraciones. Devuelve las celdas creadas.
+    """
+    published = product_model.objects.filter(status='published').order_by()
+    rows = (
+        published
+        .annotate(bucket=bucket_expression(), band=band_expression())
+        .values('category_id', 'bucket', 'band')
+        .annotate(count=Count('id'))
+    )
+    through = product_model.tags.through.objects.filter(product__status='published').order_by()
+    tag_rows = (
+        through
+        .annotate(bucket=bucket_expression('product__price'), band=band_expression('product__average_rating'))
+        .values('tag_id', 'product__category_id', 'bucket', 'band')
+        .annotate(count=Count('id'))
+    )
+
+    facet_model.objects.all().delete()
+    tag_facet_model.objects.all().delete()
+    cells = facet_model.objects.bulk_create([
+        facet_model(category_id=row['category_id'], price_bucket=row['bucket'],
+                    rating_band=row['band'], product_count=row['count'])
+        for row in rows
+    ], batch_size=1000)
+    tag_cells = tag_facet_model.objects.bulk_create([
+        tag_facet_model(tag_id=row['tag_id'], category_id=row['product__category_id'], price_bucket=row['bucket'],
+                        rating_band=row['band'], product_count=row['count'])
+        for row in tag_rows
+    ], batch_size=1000)
+    return len(cells) + len(tag_cells)
@@ -0,0 +1,267 @@
+"""
+Conteos de facetas del catálogo: productos por categoría, rango de precio,
+etiqueta y calificación mínima para la búsqueda y los filtros actuales.
+
+Cada faceta se cuenta con una sola consulta agrupada sobre los productos
+publicados que cumplen todos los filtros activos excepto el de la propia
+faceta, así que siempre se ven las alternativas de la faceta elegida. Sin
+búsqueda de texto y con precios alineados a CATALOG_PRICE_BUCKETS la consulta
+suma celdas de la tabla materializada (products.facet_counts) en lugar de
+recorrer los productos.
+
+El resultado se guarda en la caché por firma de filtros. Las señales de
+Product, Review y Tag incrementan una generación global (products.signals)
+que invalida todas las firmas a la vez.
+"""
+import hashlib
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+
+from .facet_counts import band_expression, bucket_expression, price_buckets
+
+KEY_PREFIX = 'facets'
+GENERATION_KEY = f'{KEY_PREFIX}:generation'
+RATING_BANDS = (4, 3, 2, 1)
+CENT = Decimal('0.01')
+
+
+def _positive_int(value) -> Optional[int]:
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def _decimal(value) -> Optional[Decimal]:
+    if value in (None, ''):
+        return None
+    try:
+        return Decimal(value).quantize(CENT)
+    except InvalidOperation:
+        return None
+
+
+def parse_filters(params) -> Dict[str, Any]:
+    """Filtros del catálogo normalizados desde request.GET (los inválidos se ignoran)."""
+    return {
+        'search': (params.get('searchProduct') or '').strip(),
+        'category': _positive_int(params.get('category')),
+        'price_min': _decimal(params.get('price_min')),
+        'price_max': _decimal(params.get('price_max')),
+        'tag': _positive_int(params.get('tag')),
+        'min_rating': _positive_int(params.get('min_rating')),
+    }
+
+
+def filter_signature(filters: Dict[str, Any]) -> str:
+    canonical = json.dumps(filters, sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode('utf-8'), usedforsecurity=False).hexdigest()
+
+
+def filtered_products(filters: Dict[str, Any], exclude: Optional[str] = None):
+    """
+    Productos publicados con los filtros aplicados, salvo el de la faceta
+    `exclude`. Sin orden: solo sirve para contar.
+    """
+    from .models import Product
+
+    qs = Product.objects.published()
+    if exclude != 'category':
+        qs = qs.by_category_id(filters['category'])
+    if exclude != 'price':
+        qs = qs.price_between(filters['price_min'], filters['price_max'])
+    if exclude != 'tag':
+        qs = qs.with_tag(filters['tag'])
+    if exclude != 'rating':
+        qs = qs.min_rating(filters['min_rating'])
+    if filters['search']:
+        # El ranking del backend queda fuera del GROUP BY: values() solo selecciona lo pedido
+        qs = qs.search_title(filters['search'])
+    return qs.order_by()
+
+
+def _bucket_range(price_min, price_max) -> Optional[Tuple[int, int]]:
+    """
+    Rangos de precio [desde, hasta) equivalentes a price_between(), o None si
+    los límites no coinciden con los de CATALOG_PRICE_BUCKETS.
+    """
+    edges = price_buckets()
+    low = edges.index(price_min) if price_min in edges else (0 if not price_min else None)
+    if price_max is None:
+        high = len(edges)
+    else:
+        # price_between() incluye el máximo: el tope del rango es el centavo anterior
+        upper = price_max + CENT
+        high = edges.index(upper) if upper in edges else None
+    if low is None or high is None:
+        return None
+    return low, high
+
+
+def _price_options(counts: Dict[int, int]) -> List[Dict[str, Any]]:
+    edges = price_buckets()
+    return [
+        {
+            'min': str(low),
+            'max': str(edges[index + 1] - CENT) if index + 1 < len(edges) else '',
+            'count': counts.get(index, 0),
+        }
+        for index, low in enumerate(edges)
+    ]
+
+
+def _rating_options(band_counts: Dict[int, int]) -> List[Dict[str, Any]]:
+    # La banda N tiene average_rating en [N, N+1): "N o más" acumula desde N
+    return [
+        {'min_rating': band, 'count': sum(count for b, count in band_counts.items() if b >= band)}
+        for band in RATING_BANDS
+    ]
+
+
+# --- Desde la tabla materializada (products.facet_counts) ---
+
+def _cells(filters, exclude: str, by_tag: bool = False):
+    from .models import CatalogFacetCount, CatalogTagFacetCount
+
+    tag = filters['tag'] if exclude != 'tag' else None
+    if by_tag or tag:
+        qs = CatalogTagFacetCount.objects.all()
+        if tag:
+            qs = qs.filter(tag_id=tag)
+    else:
+        qs = CatalogFacetCount.objects.all()
+    if exclude != 'category' and filters['category']:
+        qs = qs.filter(category_id=filters['category'])
+    if exclude != 'price':
+        low, high = _bucket_range(filters['price_min'], filters['price_max'])
+        qs = qs.filter(price_bucket__gte=low, price_bucket__lt=high)
+    if exclude != 'rating' and filters['min_rating']:
+        qs = qs.filter(rating_band__gte=filters['min_rating'])
+    return qs.order_by()
+
+
+def _sum_by(qs, *fields):
+    return qs.values(*fields).annotate(count=Sum('product_count')).filter(count__gt=0)
+
+
+def _materialized_facets(filters) -> Dict[str, List[Dict[str, Any]]]:
+    limit = getattr(settings, 'CATALOG_FACET_TAG_LIMIT', 20)
+    categories = _sum_by(_cells(filters, 'category'), 'category_id', 'category__name').order_by('category__name')
+    prices = _sum_by(_cells(filters, 'price'), 'price_bucket')
+    tags = _sum_by(_cells(filters, 'tag', by_tag=True), 'tag_id', 'tag__name').order_by('-count', 'tag__name')[:limit]
+    ratings = _sum_by(_cells(filters, 'rating'), 'rating_band')
+    return {
+        'category': [{'id': row['category_id'], 'name': row['category__name'], 'count': row['count']}
+                     for row in categories],
+        'price': _price_options({row['price_bucket']: row['count'] for row in prices}),
+        'tag': [{'id': row['tag_id'], 'name': row['tag__name'], 'count': row['count']} for row in tags],
+        'rating': _rating_options({row['rating_band']: row['count'] for row in ratings}),
+    }
+
+
+# --- Con consultas agrupadas sobre los productos (búsqueda o precios libres) ---
+
+def _grouped_facets(filters) -> Dict[str, List[Dict[str, Any]]]:
+    limit = getattr(settings, 'CATALOG_FACET_TAG_LIMIT', 20)
+    categories = (
+        filtered_products(filters, exclude='category')
+        .values('category_id', 'category__name')
+        .annotate(count=Count('id'))
+        .order_by('category__name')
+    )
+    prices = (
+        filtered_products(filters, exclude='price')
+        .values(bucket=bucket_expression())
+        .annotate(count=Count('id'))
+    )
+    tags = (
+        filtered_products(filters, exclude='tag')
+        .filter(tags__isnull=False)
+        .values('tags', 'tags__name')
+        .annotate(count=Count('id'))
+        .order_by('-count', 'tags__name')[:limit]
+    )
+    ratings = (
+        filtered_products(filters, exclude='rating')
+        .values(band=band_expression())
+        .annotate(count=Count('id'))
+    )
+    return {
+        'category': [{'id': row['category_id'], 'name': row['category__name'], 'count': row['count']}
+                     for row in categories],
+        'price': _price_options({row['bucket']: row['count'] for row in prices}),
+        'tag': [{'id': row['tags'], 'name': row['tags__name'], 'count': row['count']} for row in tags],
+        'rating': _rating_options({row['band']: row['count'] for row in ratings}),
+    }
+
+
+def compute_facets(filters: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """Una consulta por faceta: sobre la tabla materializada si los filtros lo permiten."""
+    if not filters['search'] and _bucket_range(filters['price_min'], filters['price_max']) is not None:
+        return _materialized_facets(filters)
+    return _grouped_facets(filters)
+
+
+def _generation() -> int:
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time_ns() // 1000, None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def invalidate_facets():
+    """Descarta los conteos cacheados de todas las firmas de filtros."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, time.time_ns() // 1000, None)
+
+
+def catalog_facets(filters: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """Conteos de facetas para los filtros, desde la caché si están vigentes."""
+    key = f'{KEY_PREFIX}:{_generation()}:{filter_signature(filters)}'
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(filters)
+        cache.set(key, facets, getattr(settings, 'CATALOG_FACET_CACHE_TTL', 300))
+    return facets
+
+
+def facet_links(facets: Dict[str, List[Dict[str, Any]]], params) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Agrega a cada opción la query string que la activa (o la desactiva si ya
+    está elegida) conservando el resto de los filtros y sin el cursor.
+    """
+    def with_params(changes):
+        query = params.copy()
+        query.pop('cursor', None)
+        for name, value in changes.items():
+            query.pop(name, None)
+            if value not in (None, ''):
+                query[name] = str(value)
+        return query.urlencode()
+
+    # Faceta -> {parámetro de la URL: campo de la opción}
+    option_params = {
+        'category': {'category': 'id'},
+        'price': {'price_min': 'min', 'price_max': 'max'},
+        'tag': {'tag': 'id'},
+        'rating': {'min_rating': 'min_rating'},
+    }
+    linked = {}
+    for facet, mapping in option_params.items():
+        linked[facet] = []
+        for option in facets[facet]:
+            values = {param: str(option[field]) for param, field in mapping.items()}
+            selected = all((params.get(param) or '') == value for param, value in values.items())
+            changes = dict.fromkeys(values) if selected else values
+            linked[facet].append(dict(option, selected=selected, query=with_params(changes)))
+    return linked
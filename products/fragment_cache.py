@@ -0,0 +1,99 @@
+"""
+Caché de fragmentos de plantilla por producto, con versión.
+
+Las tarjetas del catálogo y el cuerpo del detalle se volvían a renderizar en
+cada request aunque los productos cambian poco. La llave de cada fragmento
+incluye Product.updated_at y un contador de versión por producto guardado en
+la caché. Las señales de Product, Review y Tag incrementan el contador
+(products.signals), así que los cambios que no tocan updated_at (reseñas con
+UPDATE F(), etiquetas, miniaturas) también invalidan. Lo mismo al renombrar
+un usuario (vendedor o autor de reseñas) o una categoría. Los fragmentos viejos
+nunca se borran: dejan de leerse y expiran por TTL o LRU.
+
+Usa el framework de caché de Django (alias 'fragments'). Con LocMemCache cada
+proceso tiene su propia caché; con varios workers conviene un backend
+compartido (Redis/Memcached) para que la invalidación llegue a todos.
+"""
+import hashlib
+import time
+from typing import Dict, Iterable
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+CACHE_ALIAS = 'fragments'
+KEY_PREFIX = 'fragment'
+VERSION_PREFIX = f'{KEY_PREFIX}:version'
+
+
+def get_cache():
+    try:
+        return caches[CACHE_ALIAS]
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def is_enabled() -> bool:
+    return getattr(settings, 'PRODUCT_FRAGMENT_CACHE_ENABLED', True)
+
+
+def fragment_timeout() -> int:
+    return getattr(settings, 'PRODUCT_FRAGMENT_CACHE_TTL', 600)
+
+
+def _version_key(product_id) -> str:
+    return f'{VERSION_PREFIX}:{product_id}'
+
+
+def _initial_version() -> int:
+    # Si el contador se desaloja, el nuevo valor es mayor que cualquiera
+    # anterior y no puede volver a apuntar a un fragmento viejo
+    return time.time_ns() // 1000
+
+
+def get_versions(product_ids: Iterable[int]) -> Dict[int, int]:
+    """Versión actual de cada producto, con una sola lectura para todos."""
+    cache = get_cache()
+    keys = {_version_key(pk): pk for pk in product_ids}
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        initial = _initial_version()
+        for key in missing:
+            cache.add(key, initial, None)
+        found.update(cache.get_many(missing))
+    return {keys[key]: version for key, version in found.items()}
+
+
+def prime_versions(products):
+    """Lee en bloque las versiones de una página de productos y las deja en cada objeto."""
+    products = list(products)
+    if not is_enabled() or not products:
+        return
+    versions = get_versions(product.pk for product in products)
+    for product in products:
+        product._fragment_version = versions.get(product.pk)
+
+
+def bump_versions(product_ids: Iterable[int]):
+    """Invalida todos los fragmentos de los productos."""
+    cache = get_cache()
+    for pk in set(product_ids):
+        key = _version_key(pk)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_version(), None)
+
+
+def fragment_key(name: str, product, vary: Iterable = ()) -> str:
+    version = getattr(product, '_fragment_version', None)
+    if version is None:
+        version = get_versions([product.pk])[product.pk]
+        product._fragment_version = version
+    updated = int(product.updated_at.timestamp() * 1_000_000) if product.updated_at else 0
+    vary_hash = hashlib.md5(
+        ':'.join(str(value) for value in vary).encode('utf-8'), usedforsecurity=False
+    ).hexdigest()
+    return f'{KEY_PREFIX}:{name}:{product.pk}:{updated}:{version}:{vary_hash}'
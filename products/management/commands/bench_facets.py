@@ -0,0 +1,128 @@
+"""
+Benchmark de los conteos de facetas del catálogo: tabla materializada,
+consultas agrupadas sobre los productos y lectura desde la caché por firma
+de filtros.
+
+Siembra productos sintéticos dentro de una transacción que se revierte al
+final, así que puede ejecutarse sobre la base de datos de desarrollo.
+"""
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from products.facet_counts import rebuild
+from products.facets import (
+    _grouped_facets, _materialized_facets, catalog_facets, invalidate_facets, parse_filters,
+)
+from products.models import CatalogFacetCount, CatalogTagFacetCount, Category, Product, Tag
+
+# Combinaciones de filtros típicas del catálogo (request.GET)
+SCENARIOS = [
+    {},
+    {'category': 'first'},
+    {'price_min': '25', 'price_max': '49.99'},
+    {'min_rating': '4'},
+    {'tag': 'first'},
+    {'category': 'first', 'min_rating': '3', 'price_min': '100', 'price_max': '249.99'},
+]
+
+
+class Command(BaseCommand):
+    help = 'Compara las facetas desde la tabla materializada, con GROUP BY sobre los productos y desde la caché'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000000, help='Productos sintéticos a sembrar')
+        parser.add_argument('--tags', type=int, default=50, help='Etiquetas distintas')
+        parser.add_argument('--repeat', type=int, default=5, help='Repeticiones por escenario')
+        parser.add_argument('--grouped-repeat', type=int, default=1,
+                            help='Repeticiones de las consultas agrupadas (lentas con muchos productos)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            category_id, tag_id = self._seed(options['products'], options['tags'])
+            for scenario in SCENARIOS:
+                params = {
+                    name: str({'category': category_id, 'tag': tag_id}[name]) if value == 'first' else value
+                    for name, value in scenario.items()
+                }
+                filters = parse_filters(params)
+
+                table, queries = self._measure(_materialized_facets, filters, options['repeat'])
+                grouped, _ = self._measure(_grouped_facets, filters, options['grouped_repeat'])
+                if _materialized_facets(filters) != _grouped_facets(filters):
+                    self.stderr.write(f'⚠️ La tabla materializada no coincide con GROUP BY para {params}')
+
+                invalidate_facets()
+                catalog_facets(filters)
+                cached, _ = self._measure(catalog_facets, filters, options['repeat'] * 20)
+
+                label = '&'.join(f'{k}={v}' for k, v in params.items()) or '(sin filtros)'
+                self.stdout.write(
+                    f'{label:>58}: tabla p50={statistics.median(table):.2f}ms ({queries} consultas) | '
+                    f'GROUP BY p50={statistics.median(grouped):.1f}ms | caché p50={statistics.median(cached):.3f}ms'
+                )
+
+            cache.clear()
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _measure(function, filters, repeat):
+        # El registro de consultas tiene tope: lleno por la siembra, la captura queda vacía
+        connection.queries_log.clear()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                function(filters)
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings, len(queries)
+
+    def _seed(self, count, tag_count):
+        rng = random.Random(42)
+        seller, _ = User.objects.get_or_create(username='bench_seller')
+        categories = list(Category.objects.all()) or [Category.objects.create(name='Bench')]
+        tags = [Tag.objects.get_or_create(name=f'bench-{i}')[0] for i in range(tag_count)]
+        through = Product.tags.through
+        start = time.perf_counter()
+
+        batch_size = 5000
+        for offset in range(0, count, batch_size):
+            size = min(batch_size, count - offset)
+            created = Product.objects.bulk_create([
+                Product(
+                    title=f'Producto {offset + i}',
+                    description='',
+                    price=Decimal(rng.randint(100, 150000)) / 100,
+                    category=rng.choice(categories),
+                    image='',
+                    seller=seller,
+                    status='published' if rng.random() < 0.9 else 'draft',
+                    average_rating=Decimal(rng.randint(0, 500)) / 100,
+                )
+                for i in range(size)
+            ])
+            # bulk_create no dispara señales: las etiquetas van directo a la tabla intermedia
+            through.objects.bulk_create([
+                through(product_id=product.pk, tag_id=tag.pk)
+                for product in created
+                for tag in rng.sample(tags, rng.randint(0, 3))
+            ], batch_size=batch_size)
+
+        if connection.vendor in ('sqlite', 'postgresql'):
+            # Estadísticas frescas para que el planificador elija los índices
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        self.stdout.write(f'Sembrados {count} productos en {time.perf_counter() - start:.1f}s')
+
+        # bulk_create no dispara señales: la tabla materializada se arma en bloque
+        start = time.perf_counter()
+        cells = rebuild(Product, CatalogFacetCount, CatalogTagFacetCount)
+        self.stdout.write(f'Tabla de facetas: {cells} celdas en {time.perf_counter() - start:.1f}s')
+        return categories[0].pk, tags[0].pk
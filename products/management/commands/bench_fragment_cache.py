@@ -0,0 +1,121 @@
+"""
+Benchmark de la caché de fragmentos: tiempo de render del catálogo y del
+detalle de producto sin caché, con la caché vacía y con la caché llena.
+
+Siembra productos sintéticos dentro de una transacción que se revierte al
+final, así que puede ejecutarse sobre la base de datos de desarrollo.
+"""
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.test import RequestFactory, override_settings
+
+from products.fragment_cache import get_cache, prime_versions
+from products.models import Category, Product, Review
+from products.ratings import reconcile_queryset
+from products.views import CATALOG_PAGE_SIZE, ProductDetailView
+
+WORDS = ['lámpara', 'mesa', 'silla', 'bicicleta', 'libro', 'camisa', 'reloj', 'mochila', 'taza', 'zapato']
+# Manifiesto de miniaturas ficticio: el template tag arma el <picture> sin tocar el storage
+RENDITIONS = {
+    'source': 'products/images/bench.jpg', 'width': 1024, 'height': 768,
+    'webp': {str(w): f'renditions/be/bench-{w}.webp' for w in (160, 320, 640, 1024)},
+    'jpeg': {str(w): f'renditions/be/bench-{w}.jpg' for w in (160, 320, 640, 1024)},
+}
+
+
+class Command(BaseCommand):
+    help = 'Mide el ahorro de render de la caché de fragmentos en el catálogo y el detalle'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000, help='Productos sintéticos a sembrar')
+        parser.add_argument('--details', type=int, default=500, help='Páginas de detalle a renderizar')
+        parser.add_argument('--reviews', type=int, default=20, help='Reseñas por producto del detalle')
+
+    def handle(self, *args, **options):
+        self.factory = RequestFactory()
+        with transaction.atomic():
+            detail_ids = self._seed(options['products'], options['details'], options['reviews'])
+            pages = self._catalog_pages()
+
+            results = {}
+            for label, enabled in (('sin caché', False), ('caché vacía', True), ('caché llena', True)):
+                with override_settings(PRODUCT_FRAGMENT_CACHE_ENABLED=enabled):
+                    if label == 'caché vacía':
+                        get_cache().clear()
+                    catalog = [self._time(self._render_catalog, page) for page in pages]
+                    detail = [self._time(self._render_detail, pk) for pk in detail_ids]
+                results[label] = (catalog, detail)
+                self.stdout.write(
+                    f'{label:>12}: catálogo p50={statistics.median(catalog):.2f}ms '
+                    f'({len(pages)} páginas) | detalle p50={statistics.median(detail):.2f}ms '
+                    f'({len(detail_ids)} productos)'
+                )
+
+            base_catalog, base_detail = (sum(values) for values in results['sin caché'])
+            warm_catalog, warm_detail = (sum(values) for values in results['caché llena'])
+            self.stdout.write(self.style.SUCCESS(
+                f'✅ Caché llena: catálogo x{base_catalog / warm_catalog:.1f} más rápido, '
+                f'detalle x{base_detail / warm_detail:.1f} más rápido'
+            ))
+
+            get_cache().clear()
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _time(render, arg) -> float:
+        start = time.perf_counter()
+        render(arg)
+        return (time.perf_counter() - start) * 1000
+
+    def _catalog_pages(self):
+        # Las páginas se consultan una vez: se mide el render, no la base de datos
+        products = list(Product.objects.published().for_listing().newest_first())
+        return [products[i:i + CATALOG_PAGE_SIZE] for i in range(0, len(products), CATALOG_PAGE_SIZE)]
+
+    def _render_catalog(self, page):
+        request = self.factory.get('/')
+        request.user = AnonymousUser()
+        prime_versions(page)
+        render_to_string('home.html', {'products': page, 'categories': []}, request=request)
+
+    def _render_detail(self, pk):
+        request = self.factory.get(f'/product/{pk}/')
+        request.user = AnonymousUser()
+        ProductDetailView.as_view()(request, pk=pk).render()
+
+    def _seed(self, count, details, reviews_per_product):
+        rng = random.Random(42)
+        seller, _ = User.objects.get_or_create(username='bench_seller')
+        category = Category.objects.first() or Category.objects.create(name='Bench')
+        Product.objects.bulk_create([
+            Product(
+                title=' '.join(rng.sample(WORDS, 3)),
+                description=' '.join(rng.choices(WORDS, k=80)),
+                price=rng.randint(1, 1000),
+                category=category,
+                image=RENDITIONS['source'],
+                image_renditions=RENDITIONS,
+                seller=seller,
+                status='published',
+            )
+            for _ in range(count)
+        ], batch_size=1000)
+
+        detail_ids = list(Product.objects.order_by('-id').values_list('id', flat=True)[:details])
+        reviewers = [
+            User.objects.get_or_create(username=f'bench_reviewer_{i}')[0] for i in range(reviews_per_product)
+        ]
+        Review.objects.bulk_create([
+            Review(product_id=pk, user=user, rating=rng.randint(1, 5), comment=' '.join(rng.choices(WORDS, k=12)))
+            for pk in detail_ids for user in reviewers
+        ], batch_size=1000)
+        # bulk_create no dispara señales: agregados de calificación en bloque
+        reconcile_queryset(Product.objects.filter(id__in=detail_ids), Review)
+        self.stdout.write(f'Sembrados {count} productos y {len(detail_ids) * len(reviewers)} reseñas')
+        return detail_ids
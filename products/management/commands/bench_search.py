@@ -0,0 +1,73 @@
+"""
+Benchmark de búsqueda: índice de texto completo vs. title__icontains.
+
+Siembra productos sintéticos dentro de una transacción que se revierte al
+final, así que puede ejecutarse sobre la base de datos de desarrollo.
+"""
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products.models import Category, Product
+from products.search import IcontainsSearchBackend, get_search_backend
+
+SYLLABLES = ['ca', 'mi', 'sa', 'za', 'pa', 'to', 'lam', 'ma', 'de', 'ra', 'bo', 'li', 'no', 've', 'mu', 'te', 'clo', 'jar']
+
+
+def _vocabulary(size):
+    # Vocabulario sintético grande para que cada término tenga una selectividad realista
+    rng = random.Random(42)
+    return list({''.join(rng.choices(SYLLABLES, k=4)) for _ in range(size)})
+
+
+class Command(BaseCommand):
+    help = 'Compara la latencia del índice de búsqueda contra title__icontains'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000, help='Productos sintéticos a sembrar')
+        parser.add_argument('--queries', type=int, default=200, help='Búsquedas por backend')
+        parser.add_argument('--vocabulary', type=int, default=5000, help='Palabras distintas en el corpus')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            words = _vocabulary(options['vocabulary'])
+            self._seed(options['products'], words)
+            terms = [random.choice(words) for _ in range(options['queries'])]
+
+            for backend in (IcontainsSearchBackend(), get_search_backend()):
+                timings = []
+                for term in terms:
+                    start = time.perf_counter()
+                    list(backend.search(Product.objects.published(), term)[:24])
+                    timings.append((time.perf_counter() - start) * 1000)
+                timings.sort()
+                self.stdout.write(
+                    f'{backend.name:>18}: p50={statistics.median(timings):.2f}ms '
+                    f'p95={timings[int(len(timings) * 0.95) - 1]:.2f}ms'
+                )
+
+            transaction.set_rollback(True)
+
+    def _seed(self, count, words):
+        seller, _ = User.objects.get_or_create(username='bench_seller')
+        category = Category.objects.first() or Category.objects.create(name='Bench')
+        products = [
+            Product(
+                title=' '.join(random.sample(words, 3)),
+                description=' '.join(random.choices(words, k=60)),
+                price=random.randint(1, 1000),
+                category=category,
+                image='products/images/bench.jpg',
+                seller=seller,
+                status='published',
+            )
+            for _ in range(count)
+        ]
+        # bulk_create no dispara post_save: el índice se llena en bloque
+        Product.objects.bulk_create(products, batch_size=1000)
+        get_search_backend().rebuild()
+        self.stdout.write(f'Sembrados {count} productos')
@@ -0,0 +1,93 @@
+"""
+Comando para generar en bloque las miniaturas de Product.image
+"""
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from products.fragment_cache import bump_versions
+from products.models import Product
+from products.renditions import is_current, render_renditions, rendition_widths, store_renditions
+
+# Miniatura que usa la tarjeta del catálogo, para estimar el peso de la página
+CATALOG_RENDITION = ('webp', '320')
+
+
+class Command(BaseCommand):
+    help = 'Genera las miniaturas WebP/JPEG de las imágenes de productos que no las tienen'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                            help='Procesos que redimensionan en paralelo')
+        parser.add_argument('--force', action='store_true', help='Regenerar aunque el manifiesto esté vigente')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').only('id', 'image', 'image_renditions').order_by('id')
+        pending = [product for product in products.iterator(chunk_size=500)
+                   if options['force'] or not is_current(product)]
+        if not pending:
+            self.stdout.write(self.style.SUCCESS('✅ Todas las miniaturas están al día'))
+            return
+
+        widths = rendition_widths()
+        start = time.perf_counter()
+        done = failed = original_bytes = catalog_bytes = 0
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max(1, options['workers']), mp_context=context) as pool:
+            in_flight = {}
+            queue = iter(pending)
+            while True:
+                # Ventana acotada: no leer todas las imágenes a memoria de una vez
+                while len(in_flight) < options['workers'] * 2:
+                    product = next(queue, None)
+                    if product is None:
+                        break
+                    try:
+                        with product.image.open('rb') as source:
+                            content = source.read()
+                    except OSError as e:
+                        failed += 1
+                        self.stderr.write(f'⚠️ Producto {product.pk}: {e}')
+                        continue
+                    in_flight[pool.submit(render_renditions, content, widths)] = (product, len(content))
+                if not in_flight:
+                    break
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                updated = []
+                for future in finished:
+                    product, size = in_flight.pop(future)
+                    try:
+                        manifest = store_renditions(product.image.name, future.result())
+                    except Exception as e:
+                        failed += 1
+                        self.stderr.write(f'⚠️ Producto {product.pk}: {e}')
+                        continue
+                    Product.objects.filter(pk=product.pk).update(image_renditions=manifest)
+                    updated.append(product.pk)
+                    original_bytes += size
+                    catalog_bytes += self._catalog_size(manifest)
+                    done += 1
+                # update() no dispara las señales: el <img> de respaldo puede estar en la caché de fragmentos
+                bump_versions(updated)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Miniaturas generadas para {done} productos en {elapsed:.2f}s ({failed} con error)'
+        ))
+        if catalog_bytes:
+            self.stdout.write(
+                f'Peso de imágenes del catálogo: {original_bytes / 1024:.0f} KB originales -> '
+                f'{catalog_bytes / 1024:.0f} KB en miniaturas {CATALOG_RENDITION[1]}w '
+                f'(x{original_bytes / catalog_bytes:.1f} menos)'
+            )
+
+    @staticmethod
+    def _catalog_size(manifest) -> int:
+        image_format, width = CATALOG_RENDITION
+        paths = manifest.get(image_format, {})
+        path = paths.get(width) or paths[max(paths, key=int)]
+        return default_storage.size(path)
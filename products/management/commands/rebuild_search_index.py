@@ -0,0 +1,40 @@
+"""
+Comando para reconstruir en bloque el índice de búsqueda de productos
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de texto completo de productos (título, descripción y etiquetas)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Cantidad de productos insertados por lote',
+        )
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        if backend.name == 'icontains':
+            self.stdout.write(
+                self.style.WARNING('El backend activo es icontains: no hay índice que reconstruir')
+            )
+            return
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            total = backend.rebuild(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✅ Índice {backend.name} reconstruido: {total} productos en {elapsed:.2f}s'
+            )
+        )
@@ -0,0 +1,71 @@
+from django.db import migrations, OperationalError
+
+
+SQLITE_CREATE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS products_product_fts
+USING fts5(title, description, tags, tokenize='unicode61 remove_diacritics 2')
+"""
+
+SQLITE_POPULATE = """
+INSERT INTO products_product_fts(rowid, title, description, tags)
+SELECT p.id, p.title, p.description,
+       COALESCE((SELECT group_concat(t.name, ' ')
+                 FROM products_product_tags pt
+                 JOIN products_tag t ON t.id = pt.tag_id
+                 WHERE pt.product_id = p.id), '')
+FROM products_product p
+"""
+
+POSTGRES_CREATE = """
+CREATE TABLE IF NOT EXISTS products_product_search (
+    product_id bigint PRIMARY KEY REFERENCES products_product(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+    document tsvector NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_product_search_document_gin
+    ON products_product_search USING GIN (document);
+"""
+
+POSTGRES_POPULATE = """
+INSERT INTO products_product_search(product_id, document)
+SELECT p.id,
+       setweight(to_tsvector('spanish', p.title), 'A') ||
+       setweight(to_tsvector('spanish', COALESCE(string_agg(t.name, ' '), '')), 'B') ||
+       setweight(to_tsvector('spanish', p.description), 'C')
+FROM products_product p
+LEFT JOIN products_product_tags pt ON pt.product_id = p.id
+LEFT JOIN products_tag t ON t.id = pt.tag_id
+GROUP BY p.id
+"""
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(SQLITE_CREATE)
+        except OperationalError:
+            # SQLite compilado sin FTS5: la búsqueda cae al backend icontains
+            return
+        schema_editor.execute(SQLITE_POPULATE)
+    elif vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_CREATE)
+        schema_editor.execute(POSTGRES_POPULATE)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS products_product_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP TABLE IF EXISTS products_product_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_status_created_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_facet_counts(apps, schema_editor):
+    from products.facet_counts import rebuild
+
+    rebuild(
+        apps.get_model('products', 'Product'),
+        apps.get_model('products', 'CatalogFacetCount'),
+        apps.get_model('products', 'CatalogTagFacetCount'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_review_product_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_bucket', models.PositiveSmallIntegerField()),
+                ('rating_band', models.PositiveSmallIntegerField()),
+                ('product_count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.category')),
+            ],
+            options={
+                'verbose_name': 'Conteo de facetas',
+                'verbose_name_plural': 'Conteos de facetas',
+                'unique_together': {('category', 'price_bucket', 'rating_band')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CatalogTagFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_bucket', models.PositiveSmallIntegerField()),
+                ('rating_band', models.PositiveSmallIntegerField()),
+                ('product_count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.category')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.tag')),
+            ],
+            options={
+                'verbose_name': 'Conteo de facetas por etiqueta',
+                'verbose_name_plural': 'Conteos de facetas por etiqueta',
+                'unique_together': {('tag', 'category', 'price_bucket', 'rating_band')},
+            },
+        ),
+        migrations.RunPython(backfill_facet_counts, migrations.RunPython.noop),
+    ]
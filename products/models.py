@@ -3,6 +3,8 @@ from django.contrib.auth.models import User
 from django.core.validators import MinLengthValidator
 from django.utils.text import slugify
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models import Q
+from django.db.models.functions import Substr
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -31,6 +33,10 @@ class Tag(models.Model):
     class Meta:
         ordering = ['name']
 
+# Caracteres de la descripción que se cargan para las tarjetas del catálogo
+LISTING_PREVIEW_CHARS = 240
+
+
 class ProductQuerySet(models.QuerySet):
     def published(self):
         return self.filter(status='published')
@@ -39,9 +45,14 @@ class ProductQuerySet(models.QuerySet):
         return self.filter(seller=user)
 
     def search_title(self, term: str):
+        """
+        Búsqueda de texto completo (título, descripción y etiquetas) ordenada
+        por relevancia; ver products.search para los backends disponibles.
+        """
         if not term:
             return self
-        return self.filter(title__icontains=term)
+        from .search import get_search_backend
+        return get_search_backend().search(self, term)
 
     def by_category_id(self, category_id):
         if not category_id:
@@ -56,6 +67,42 @@ class ProductQuerySet(models.QuerySet):
             qs = qs.filter(price__lte=max_price)
         return qs
 
+    def with_tag(self, tag_id):
+        if not tag_id:
+            return self
+        return self.filter(tags__id=tag_id)
+
+    def min_rating(self, rating):
+        if not rating:
+            return self
+        return self.filter(average_rating__gte=rating)
+
+    def for_listing(self):
+        """
+        Queryset liviano para las tarjetas del catálogo: trae la categoría en el
+        mismo JOIN y difiere las columnas anchas (la descripción completa se
+        reemplaza por un extracto calculado en la base de datos).
+        """
+        return (
+            self.select_related('category')
+            .only(
+                'id', 'title', 'price', 'image', 'image_renditions', 'status', 'created_at',
+                'updated_at', 'seller_id', 'category_id', 'category__name',
+            )
+            .annotate(description_preview=Substr('description', 1, LISTING_PREVIEW_CHARS))
+        )
+
+    def newest_first(self):
+        return self.order_by('-created_at', '-id')
+
+    def before_key(self, created_at, pk):
+        """Productos estrictamente más antiguos que la llave (created_at, id)."""
+        return self.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    def after_key(self, created_at, pk):
+        """Productos estrictamente más recientes que la llave (created_at, id)."""
+        return self.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+
 
 class Product(models.Model):
     STATUS_CHOICES = [
@@ -70,22 +117,88 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Precio")
     category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name="Categoría")
     image = models.ImageField(upload_to='products/images/', verbose_name="Imagen del producto")
+    # Manifiesto de miniaturas (products.renditions): {source, width, height, webp: {ancho: ruta}, jpeg: {...}}
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     seller = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Vendedor")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Borrador', verbose_name="Estado")
     tags = models.ManyToManyField(Tag, blank=True, verbose_name="Etiquetas")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de creación")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Fecha de actualización")
     average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0, verbose_name="Calificación promedio")
-    
+    # Agregados de reseñas mantenidos con F() (products.ratings); reconcile_ratings los recalcula
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # Solo los escriben los UPDATE de products.ratings
+    RATING_FIELDS = frozenset({
+        'average_rating', 'rating_sum', 'rating_count',
+        'rating_1_count', 'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count',
+    })
+
     def __str__(self):
         return self.title
+
+    def save(self, *args, **kwargs):
+        # Una instancia cargada antes de una reseña nueva no debe pisar los agregados al guardarse
+        if not self._state.adding and not args and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.RATING_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def rating_histogram(self):
+        """
+        Distribución de estrellas (de 5 a 1) a partir de los contadores
+        precalculados, sin consultar las reseñas.
+        """
+        return [
+            {
+                'stars': stars,
+                'count': getattr(self, f'rating_{stars}_count'),
+                'percent': round(100 * getattr(self, f'rating_{stars}_count') / self.rating_count)
+                if self.rating_count else 0,
+            }
+            for stars in (5, 4, 3, 2, 1)
+        ]
     
     class Meta:
         verbose_name = "Producto"
         verbose_name_plural = "Productos"
+        indexes = [
+            # Llave de paginación por cursor del catálogo público
+            models.Index(fields=['status', '-created_at', '-id'], name='product_status_created_idx'),
+            # Catálogo filtrado por categoría: ya ordenado por la llave, sin ordenar en memoria
+            models.Index(fields=['category', '-created_at', '-id'], name='product_pub_category_idx',
+                         condition=Q(status='published')),
+            # Rangos de precio del catálogo y conteos de facetas con precios libres
+            models.Index(fields=['price'], name='product_pub_price_idx', condition=Q(status='published')),
+        ]
+
+
+class ReviewQuerySet(models.QuerySet):
+    def newest_first(self):
+        return self.order_by('-created_at', '-id')
+
+    def before_key(self, created_at, pk):
+        """Reseñas estrictamente más antiguas que la llave (created_at, id)."""
+        return self.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    def after_key(self, created_at, pk):
+        """Reseñas estrictamente más recientes que la llave (created_at, id)."""
+        return self.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
 
 
 class Review(models.Model):
+    objects = ReviewQuerySet.as_manager()
+
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     rating = models.PositiveSmallIntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
@@ -95,6 +208,10 @@ class Review(models.Model):
     class Meta:
         unique_together = ("product", "user")
         ordering = ["-created_at"]
+        indexes = [
+            # Llave de paginación por cursor de las reseñas de un producto
+            models.Index(fields=['product', '-created_at', '-id'], name='review_product_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.title} ({self.rating}/5) by {self.user.username}"
@@ -119,3 +236,34 @@ class Wishlist(models.Model):
 
     def __str__(self):
         return f"{self.user.username} → {self.product.title}"
+
+
+class CatalogFacetCount(models.Model):
+    """
+    Productos publicados por celda (categoría, rango de precio, banda de
+    calificación). Se mantiene con F() desde las señales (products.facet_counts).
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    price_bucket = models.PositiveSmallIntegerField()
+    rating_band = models.PositiveSmallIntegerField()
+    # Sin restricción de signo: una deriva no debe romper el guardado del producto
+    product_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('category', 'price_bucket', 'rating_band')
+        verbose_name = "Conteo de facetas"
+        verbose_name_plural = "Conteos de facetas"
+
+
+class CatalogTagFacetCount(models.Model):
+    """Como CatalogFacetCount, pero por etiqueta (un producto cuenta en cada una de sus etiquetas)."""
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    price_bucket = models.PositiveSmallIntegerField()
+    rating_band = models.PositiveSmallIntegerField()
+    product_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('tag', 'category', 'price_bucket', 'rating_band')
+        verbose_name = "Conteo de facetas por etiqueta"
+        verbose_name_plural = "Conteos de facetas por etiqueta"
@@ -0,0 +1,151 @@
+"""
+Paginación por cursor (keyset) para el catálogo de productos y las reseñas.
+
+En lugar de OFFSET, cada página se pide a partir de la llave (created_at, id)
+del último elemento visto, así que el costo de una página no depende de cuántos
+productos hay antes de ella.
+
+Los resultados de una búsqueda se ordenan por relevancia, que el backend
+calcula al vuelo y no se puede usar como llave; RankedPaginator los pagina por
+posición con cursores opacos del mismo formato.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional
+
+
+class KeysetPage:
+    """Una página de resultados con los cursores para navegar."""
+
+    def __init__(self, object_list: List, next_cursor: Optional[str], prev_cursor: Optional[str]):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_key(created_at: datetime, pk: int, direction: str) -> str:
+    payload = json.dumps({'t': created_at.isoformat(), 'id': pk, 'd': direction})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def encode_cursor(obj, direction: str) -> str:
+    return encode_key(obj.created_at, obj.pk, direction)
+
+
+def decode_cursor(cursor: Optional[str]):
+    """
+    Devuelve (created_at, id, direction) o None si el cursor no es válido.
+    Un cursor manipulado simplemente lleva a la primera página.
+    """
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        direction = data.get('d', 'n')
+        if direction not in ('n', 'p'):
+            return None
+        return datetime.fromisoformat(data['t']), int(data['id']), direction
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class KeysetPaginator:
+    """
+    Pagina un ProductQuerySet o ReviewQuerySet ordenado del más reciente al
+    más antiguo.
+
+    El queryset debe exponer newest_first(), before_key() y after_key().
+    """
+
+    def __init__(self, queryset, per_page: int = 24):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def page(self, cursor: Optional[str] = None) -> KeysetPage:
+        key = decode_cursor(cursor)
+
+        if key is None:
+            rows = list(self.queryset.newest_first()[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            next_cursor = encode_cursor(rows[-1], 'n') if has_more else None
+            return KeysetPage(rows, next_cursor, None)
+
+        created_at, pk, direction = key
+        if direction == 'n':
+            rows = list(
+                self.queryset.before_key(created_at, pk).newest_first()[:self.per_page + 1]
+            )
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            next_cursor = encode_cursor(rows[-1], 'n') if has_more else None
+            if rows:
+                prev_cursor = encode_cursor(rows[0], 'p')
+            else:
+                # Cursor viejo (se borraron los productos siguientes): la página
+                # anterior es la que termina en la llave misma. (created_at, id - 1)
+                # es la llave inmediata siguiente, así que after_key() la incluye.
+                prev_cursor = encode_key(created_at, pk - 1, 'p')
+            return KeysetPage(rows, next_cursor, prev_cursor)
+
+        # Página anterior: se recorre en orden ascendente y luego se invierte
+        rows = list(
+            self.queryset.after_key(created_at, pk).order_by('created_at', 'id')[:self.per_page + 1]
+        )
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        rows.reverse()
+        # Sin filas, lo mismo en sentido contrario: (created_at, id + 1) incluye la llave
+        next_cursor = encode_cursor(rows[-1], 'n') if rows else encode_key(created_at, pk + 1, 'n')
+        prev_cursor = encode_cursor(rows[0], 'p') if has_more else None
+        return KeysetPage(rows, next_cursor, prev_cursor)
+
+
+def encode_offset(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({'o': offset}).encode('utf-8')).decode('ascii')
+
+
+def decode_offset(cursor: Optional[str]) -> int:
+    """Posición del cursor de RankedPaginator, o 0 si no es válido."""
+    if not cursor:
+        return 0
+    try:
+        offset = int(json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))['o'])
+    except (ValueError, KeyError, TypeError):
+        return 0
+    return max(offset, 0)
+
+
+class RankedPaginator:
+    """
+    Pagina por posición un queryset que ya trae su orden (p.ej. search_title(),
+    ordenado por search_rank). Si no lo trae se usa newest_first().
+    """
+
+    def __init__(self, queryset, per_page: int = 24):
+        self.queryset = queryset if queryset.ordered else queryset.newest_first()
+        self.per_page = per_page
+
+    def page(self, cursor: Optional[str] = None) -> KeysetPage:
+        offset = decode_offset(cursor)
+        rows = list(self.queryset[offset:offset + self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        next_cursor = encode_offset(offset + self.per_page) if has_more else None
+        prev_cursor = encode_offset(max(offset - self.per_page, 0)) if offset else None
+        return KeysetPage(rows, next_cursor, prev_cursor)
@@ -0,0 +1,153 @@
+"""
+Regresión de planes de consulta: EXPLAIN QUERY PLAN (SQLite) o EXPLAIN
+(Postgres) sobre cada método público de ProductQuerySet y las lecturas de
+Review y Wishlist. Una consulta tiene problemas si recorre una tabla completa
+o si una página del catálogo tiene que ordenarse en memoria en lugar de salir
+del índice.
+
+Lo usan QueryPlanTests (products.tests) con un catálogo chico y el comando
+check_query_plans con uno grande.
+"""
+import random
+import re
+from decimal import Decimal
+from typing import List
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+
+from .models import Category, Product, Review, Tag, Wishlist
+from .search import get_search_backend
+
+SUPPORTED_VENDORS = ('sqlite', 'postgresql')
+
+WORDS = ['lámpara', 'mesa', 'silla', 'bicicleta', 'libro', 'camisa', 'reloj', 'mochila', 'taza', 'zapato']
+# Tablas chicas por diseño: recorrerlas completas es lo esperado
+SMALL_TABLES = {'products_category', 'products_tag', 'auth_user'}
+# Ordenan por relevancia, sobre el JOIN de etiquetas o tras un rango de precio (ningún
+# índice entrega ese rango ordenado por fecha): el orden en memoria es inevitable
+SORT_ALLOWED = {'price_between()', 'with_tag()', 'search_title()'}
+
+
+def full_scans(plan):
+    """Tablas que el plan recorre completas (sin búsqueda por índice)."""
+    scans = []
+    for line in plan:
+        if connection.vendor == 'sqlite':
+            # 'SCAN tabla' o 'SCAN tabla USING [COVERING] INDEX x' (índice recorrido entero)
+            match = re.match(r'SCAN (\w+)(?: AS \w+)?', line)
+            if match and 'VIRTUAL TABLE' not in line:
+                scans.append(match.group(1))
+        else:
+            match = re.search(r'Seq Scan on (\w+)', line)
+            if match:
+                scans.append(match.group(1))
+    return [table for table in scans if table not in SMALL_TABLES]
+
+
+def sorts_in_memory(plan):
+    """True si el plan ordena el resultado aparte en lugar de leerlo ya ordenado del índice."""
+    if connection.vendor == 'sqlite':
+        return any('USE TEMP B-TREE FOR ORDER BY' in line for line in plan)
+    return any(re.search(r'^\W*Sort\b', line) for line in plan)
+
+
+def explain(queryset):
+    sql, params = queryset.query.sql_with_params()
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        rows = cursor.fetchall()
+    return [row[-1] for row in rows]
+
+
+def plan_problems(name: str, plan: List[str]) -> List[str]:
+    """Problemas del plan de la consulta `name` (lista vacía si usa sus índices)."""
+    problems = [f'recorre {table}' for table in full_scans(plan)]
+    if name not in SORT_ALLOWED and sorts_in_memory(plan):
+        problems.append('ordena en memoria')
+    return problems
+
+
+def access_paths(fixture):
+    """(nombre, queryset) de cada camino de acceso que debe usar un índice."""
+    product, category, tag, seller, user = (
+        fixture['product'], fixture['category'], fixture['tag'], fixture['seller'], fixture['user'],
+    )
+    published = Product.objects.published()
+    return [
+        ('catálogo: published().newest_first()', published.for_listing().newest_first()[:24]),
+        ('catálogo: before_key()', published.before_key(product.created_at, product.pk).newest_first()[:24]),
+        ('catálogo: after_key()', published.after_key(product.created_at, product.pk).order_by('created_at', 'id')[:24]),
+        ('by_category_id()', published.by_category_id(category.pk).newest_first()[:24]),
+        ('by_category_id() + before_key()',
+         published.by_category_id(category.pk).before_key(product.created_at, product.pk).newest_first()[:24]),
+        ('price_between()', published.price_between(Decimal('25'), Decimal('49.99')).newest_first()[:24]),
+        ('min_rating()', published.min_rating(4).newest_first()[:24]),
+        ('with_tag()', published.with_tag(tag.pk).newest_first()[:24]),
+        ('search_title()', published.search_title(WORDS[0])[:24]),
+        ('for_seller()', Product.objects.for_seller(seller)),
+        ('detalle: pk', Product.objects.select_related('seller', 'category').filter(pk=product.pk)),
+        ('reseñas: primera página', Review.objects.filter(product=product).newest_first()[:11]),
+        ('reseñas: before_key()',
+         Review.objects.filter(product=product).before_key(timezone.now(), 1).newest_first()[:11]),
+        ('wishlist: (user, product)', Wishlist.objects.filter(user=user, product=product)),
+        ('wishlist: del usuario', Wishlist.objects.filter(user=user).select_related('product')),
+    ]
+
+
+def seed_catalog(count: int):
+    """
+    Siembra `count` productos sintéticos con etiquetas, reseñas y wishlists y
+    devuelve los objetos que usan las consultas de access_paths().
+    Llamar dentro de una transacción que luego se revierta.
+    """
+    rng = random.Random(42)
+    seller, _ = User.objects.get_or_create(username='plan_seller')
+    users = [User.objects.get_or_create(username=f'plan_user_{i}')[0] for i in range(20)]
+    categories = list(Category.objects.all()) or [Category.objects.create(name='Plan')]
+    tags = [Tag.objects.get_or_create(name=f'plan-{i}')[0] for i in range(30)]
+
+    batch_size = 5000
+    for offset in range(0, count, batch_size):
+        created = Product.objects.bulk_create([
+            Product(
+                title=' '.join(rng.sample(WORDS, 3)),
+                description=' '.join(rng.choices(WORDS, k=20)),
+                price=Decimal(rng.randint(100, 150000)) / 100,
+                category=rng.choice(categories),
+                image='',
+                seller=seller if rng.random() < 0.01 else rng.choice(users),
+                status='published' if rng.random() < 0.9 else 'draft',
+                average_rating=Decimal(rng.randint(0, 500)) / 100,
+            )
+            for _ in range(min(batch_size, count - offset))
+        ])
+        through = Product.tags.through
+        through.objects.bulk_create([
+            through(product_id=product.pk, tag_id=tag.pk)
+            for product in created for tag in rng.sample(tags, rng.randint(0, 3))
+        ])
+        Review.objects.bulk_create([
+            Review(product=product, user=user, rating=rng.randint(1, 5))
+            for product in created[::10] for user in rng.sample(users, 5)
+        ])
+        Wishlist.objects.bulk_create([
+            Wishlist(user=rng.choice(users), product=product) for product in created[::7]
+        ], ignore_conflicts=True)
+
+    get_search_backend().rebuild()
+
+    # Estadísticas frescas: el planificador elige índices según la selectividad
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+    product = Product.objects.published().order_by('id')[count // 2]
+    return {
+        'product': product,
+        'category': categories[0],
+        'tag': tags[0],
+        'seller': seller,
+        'user': users[0],
+    }
@@ -0,0 +1,102 @@
+"""
+Agregados de calificación de productos mantenidos de forma incremental.
+
+Antes cada escritura de un Review volvía a leer el producto y calculaba
+AVG(rating) sobre todas sus reseñas. Product guarda rating_sum,
+rating_count y el histograma rating_1_count..rating_5_count. Cada alta,
+cambio o baja de reseña los ajusta con un solo UPDATE con expresiones F(),
+atómico aunque lleguen reseñas concurrentes. average_rating se recalcula en
+el mismo UPDATE. El comando reconcile_ratings recalcula todo desde las
+reseñas (p.ej. tras un bulk_create o queryset.update, que no disparan señales).
+"""
+from typing import Dict, Optional
+
+from django.db.models import (
+    Case, Count, DecimalField, F, FloatField, IntegerField, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Cast, Coalesce, Round
+
+STARS = (1, 2, 3, 4, 5)
+
+
+def histogram_field(stars: int) -> str:
+    return f'rating_{stars}_count'
+
+
+def _average_expression(sum_delta: int, count_delta: int):
+    """average_rating a partir de los valores anteriores de la fila más los deltas."""
+    new_count = F('rating_count') + count_delta
+    return Case(
+        When(Q(rating_count__lte=-count_delta), then=Value(0)),
+        default=Round(
+            Cast(F('rating_sum') + sum_delta, FloatField()) / new_count,
+            2,
+        ),
+        output_field=DecimalField(max_digits=3, decimal_places=2),
+    )
+
+
+def apply_rating_change(product_id: int, added: Optional[int] = None, removed: Optional[int] = None):
+    """
+    Ajusta los agregados del producto: `added` es la calificación nueva (alta
+    o valor nuevo de una edición) y `removed` la anterior (baja o valor viejo).
+    """
+    if added == removed:
+        return
+    from .models import Product
+
+    sum_delta = (added or 0) - (removed or 0)
+    count_delta = (added is not None) - (removed is not None)
+    updates = {
+        'rating_sum': F('rating_sum') + sum_delta,
+        'rating_count': F('rating_count') + count_delta,
+        'average_rating': _average_expression(sum_delta, count_delta),
+    }
+    if added is not None:
+        updates[histogram_field(added)] = F(histogram_field(added)) + 1
+    if removed is not None:
+        updates[histogram_field(removed)] = F(histogram_field(removed)) - 1
+    Product.objects.filter(pk=product_id).update(**updates)
+
+
+def expected_aggregates(review_model) -> Dict[str, object]:
+    """Subconsultas correlacionadas con los valores correctos para cada producto."""
+    reviews = review_model.objects.filter(product_id=OuterRef('pk')).order_by().values('product_id')
+
+    def aggregate(expression):
+        return Coalesce(Subquery(reviews.annotate(value=expression).values('value')[:1]), 0,
+                        output_field=IntegerField())
+
+    expected = {
+        'rating_sum': aggregate(Sum('rating')),
+        'rating_count': aggregate(Count('id')),
+    }
+    for stars in STARS:
+        expected[histogram_field(stars)] = aggregate(Count('id', filter=Q(rating=stars)))
+    return expected
+
+
+def reconcile_queryset(products, review_model) -> int:
+    """
+    Reescribe los agregados de los productos del queryset con un UPDATE por
+    subconsultas (sin leer las reseñas a Python). Devuelve las filas actualizadas.
+    """
+    expected = expected_aggregates(review_model)
+    updated = products.update(**expected)
+    products.filter(rating_count=0).update(average_rating=0)
+    products.filter(rating_count__gt=0).update(
+        average_rating=Round(
+            Cast(F('rating_sum'), FloatField()) / F('rating_count'), 2
+        )
+    )
+    return updated
+
+
+def drifted(products, review_model):
+    """Productos cuyos agregados no coinciden con sus reseñas."""
+    expected = expected_aggregates(review_model)
+    annotated = products.annotate(**{f'expected_{name}': value for name, value in expected.items()})
+    mismatch = Q()
+    for name in expected:
+        mismatch |= ~Q(**{name: F(f'expected_{name}')})
+    return annotated.filter(mismatch)
@@ -0,0 +1,143 @@
+"""
+Miniaturas (renditions) de Product.image para el catálogo.
+
+Las plantillas mostraban la imagen original y la achicaban con CSS, así que
+cada página del catálogo descargaba las fotos completas. Por cada producto se
+generan versiones de PRODUCT_RENDITION_WIDTHS px de ancho en WebP y JPEG. El
+nombre de cada archivo es el SHA-256 de su contenido
+(renditions/ab/<hash>.webp), por lo que se pueden servir con caché inmutable.
+
+El manifiesto (Product.image_renditions) guarda los nombres por formato y
+ancho, así que el template tag {% product_image %} arma el srcset sin tocar
+el storage. Las miniaturas se generan al subir la imagen (products.signals),
+en segundo plano la primera vez que se muestra un producto sin manifiesto, o
+en bloque con el comando generate_renditions.
+"""
+import hashlib
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from PIL import Image, ImageOps
+
+from .fragment_cache import bump_versions
+
+RENDITION_PREFIX = 'renditions'
+# Formato -> (formato de Pillow, extensión, opciones de guardado)
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def rendition_widths() -> Tuple[int, ...]:
+    return tuple(getattr(settings, 'PRODUCT_RENDITION_WIDTHS', (160, 320, 640, 1024)))
+
+
+def render_renditions(source: bytes, widths: Tuple[int, ...]) -> Dict[str, Any]:
+    """
+    Genera las miniaturas de una imagen (sin Django, se puede correr en otro
+    proceso). Devuelve {'width', 'height', 'files': {formato: {ancho: bytes}}}.
+    Los anchos mayores que el original se omiten; el original siempre tiene al
+    menos su propio ancho como versión más grande.
+    """
+    with Image.open(io.BytesIO(source)) as image:
+        if image.format == 'JPEG':
+            image.draft('RGB', (max(widths), max(widths)))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+        width, height = image.size
+
+        targets = sorted({w for w in widths if w < width} | {min(width, max(widths))})
+        files: Dict[str, Dict[int, bytes]] = {name: {} for name in FORMATS}
+        for target in targets:
+            resized = image if target == width else image.resize(
+                (target, max(1, round(height * target / width))), Image.Resampling.LANCZOS
+            )
+            for name, (pil_format, _, options) in FORMATS.items():
+                output = io.BytesIO()
+                resized.save(output, format=pil_format, **options)
+                files[name][target] = output.getvalue()
+
+    return {'width': width, 'height': height, 'files': files}
+
+
+def store_renditions(image_name: str, rendered: Dict[str, Any]) -> Dict[str, Any]:
+    """Guarda los archivos con nombre por contenido y devuelve el manifiesto."""
+    manifest = {'source': image_name, 'width': rendered['width'], 'height': rendered['height']}
+    for name, by_width in rendered['files'].items():
+        extension = FORMATS[name][1]
+        manifest[name] = {}
+        for width, content in by_width.items():
+            digest = hashlib.sha256(content).hexdigest()
+            path = f"{RENDITION_PREFIX}/{digest[:2]}/{digest}.{extension}"
+            if not default_storage.exists(path):
+                default_storage.save(path, ContentFile(content))
+            manifest[name][str(width)] = path
+    return manifest
+
+
+def is_current(product) -> bool:
+    """El manifiesto corresponde a la imagen actual del producto."""
+    manifest = product.image_renditions or {}
+    return bool(product.image) and manifest.get('source') == product.image.name
+
+
+def generate_for_product(product, force: bool = False) -> Optional[Dict[str, Any]]:
+    """Genera y guarda las miniaturas de un producto; None si no tiene imagen."""
+    from .models import Product
+
+    if not product.image:
+        return None
+    if not force and is_current(product):
+        return product.image_renditions
+    with product.image.open('rb') as source:
+        rendered = render_renditions(source.read(), rendition_widths())
+    manifest = store_renditions(product.image.name, rendered)
+    # update() para no disparar las señales (reindexado) ni tocar updated_at
+    Product.objects.filter(pk=product.pk).update(image_renditions=manifest)
+    product.image_renditions = manifest
+    # El <img> de respaldo puede estar en la caché de fragmentos
+    bump_versions([product.pk])
+    return manifest
+
+
+class LazyRenditionQueue:
+    """
+    Genera en segundo plano las miniaturas de los productos que se muestran
+    sin manifiesto vigente. Un solo hilo y sin duplicados en cola.
+    """
+
+    def __init__(self):
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='renditions')
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, product_id: int):
+        with self._lock:
+            if product_id in self._pending:
+                return
+            self._pending.add(product_id)
+        self._pool.submit(self._generate, product_id)
+
+    def _generate(self, product_id: int):
+        from .models import Product
+
+        try:
+            product = Product.objects.filter(pk=product_id).only('id', 'image', 'image_renditions').first()
+            if product is not None:
+                generate_for_product(product)
+        except Exception as e:
+            print(f"⚠️ No se pudieron generar las miniaturas del producto {product_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(product_id)
+            close_old_connections()
+
+
+lazy_renditions = LazyRenditionQueue()
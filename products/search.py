@@ -0,0 +1,206 @@
+"""
+Backends de búsqueda de texto completo para productos.
+
+El índice invertido vive en una tabla auxiliar (FTS5 en SQLite, tsvector + GIN
+en Postgres) con una fila por producto que contiene título, descripción y
+nombres de etiquetas. Las señales en products.signals lo mantienen sincronizado
+y el comando rebuild_search_index lo reconstruye en bloque.
+
+settings.PRODUCT_SEARCH_BACKEND puede ser: 'auto' (default) o 'icontains'.
+"""
+import re
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+SQLITE_TABLE = 'products_product_fts'
+POSTGRES_TABLE = 'products_product_search'
+POSTGRES_CONFIG = 'spanish'
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _document_rows(product_ids: Optional[Iterable[int]] = None):
+    """Genera (id, title, description, tags) listos para indexar."""
+    from .models import Product
+
+    qs = Product.objects.only('id', 'title', 'description').prefetch_related('tags').order_by('id')
+    if product_ids is not None:
+        qs = qs.filter(id__in=list(product_ids))
+    for product in qs.iterator(chunk_size=500):
+        tags = ' '.join(tag.name for tag in product.tags.all())
+        yield product.id, product.title, product.description, tags
+
+
+class IcontainsSearchBackend:
+    """Búsqueda original con LIKE '%term%' sobre el título. No mantiene índice."""
+
+    name = 'icontains'
+
+    def search(self, queryset, term: str):
+        return queryset.filter(title__icontains=term)
+
+    def index_products(self, product_ids: Iterable[int]):
+        pass
+
+    def remove_products(self, product_ids: Iterable[int]):
+        pass
+
+    def rebuild(self, batch_size: int = 500) -> int:
+        return 0
+
+
+class SQLiteFTSSearchBackend:
+    """Índice FTS5 con ranking bm25 (pesos: título > etiquetas > descripción)."""
+
+    name = 'sqlite-fts5'
+
+    @staticmethod
+    def build_query(term: str) -> str:
+        # Cada palabra se cita (evita la sintaxis de FTS5) y se busca como prefijo
+        words = _WORD_RE.findall(term)
+        return ' '.join(f'"{word}"*' for word in words)
+
+    def search(self, queryset, term: str):
+        match = self.build_query(term)
+        if not match:
+            return queryset.none()
+        # El MATCH filtra por rowid desde el índice; el ranking es una
+        # subconsulta por rowid (búsqueda puntual) solo sobre las filas encontradas.
+        # bm25 devuelve valores negativos: más bajo es más relevante
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s', [match])
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT -bm25({SQLITE_TABLE}, 10.0, 1.0, 5.0) FROM {SQLITE_TABLE} '
+                f'WHERE {SQLITE_TABLE} MATCH %s AND {SQLITE_TABLE}.rowid = products_product.id',
+                [match],
+            )
+        ).order_by('-search_rank', '-id')
+
+    def index_products(self, product_ids: Iterable[int]):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        rows = list(_document_rows(product_ids))
+        with connection.cursor() as cursor:
+            self._delete(cursor, product_ids)
+            cursor.executemany(
+                f'INSERT INTO {SQLITE_TABLE}(rowid, title, description, tags) VALUES (%s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove_products(self, product_ids: Iterable[int]):
+        product_ids = list(product_ids)
+        if product_ids:
+            with connection.cursor() as cursor:
+                self._delete(cursor, product_ids)
+
+    def rebuild(self, batch_size: int = 500) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE}')
+            return _insert_in_batches(
+                cursor,
+                f'INSERT INTO {SQLITE_TABLE}(rowid, title, description, tags) VALUES (%s, %s, %s, %s)',
+                _document_rows(),
+                batch_size,
+            )
+
+    @staticmethod
+    def _delete(cursor, product_ids: List[int]):
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        cursor.execute(f'DELETE FROM {SQLITE_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+
+
+class PostgresSearchBackend:
+    """Índice tsvector con GIN; título (A), etiquetas (B) y descripción (C)."""
+
+    name = 'postgres-tsvector'
+
+    DOCUMENT_SQL = (
+        f"setweight(to_tsvector('{POSTGRES_CONFIG}', %s), 'A') || "
+        f"setweight(to_tsvector('{POSTGRES_CONFIG}', %s), 'C') || "
+        f"setweight(to_tsvector('{POSTGRES_CONFIG}', %s), 'B')"
+    )
+
+    def search(self, queryset, term: str):
+        if not term.strip():
+            return queryset.none()
+        tsquery = f"websearch_to_tsquery('{POSTGRES_CONFIG}', %s)"
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT product_id FROM {POSTGRES_TABLE} WHERE document @@ {tsquery}', [term])
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT ts_rank(document, {tsquery}) FROM {POSTGRES_TABLE} '
+                f'WHERE product_id = products_product.id',
+                [term],
+            )
+        ).order_by('-search_rank', '-id')
+
+    def index_products(self, product_ids: Iterable[int]):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        rows = list(_document_rows(product_ids))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {POSTGRES_TABLE}(product_id, document) VALUES (%s, {self.DOCUMENT_SQL}) '
+                f'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document',
+                rows,
+            )
+
+    def remove_products(self, product_ids: Iterable[int]):
+        product_ids = list(product_ids)
+        if product_ids:
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {POSTGRES_TABLE} WHERE product_id = ANY(%s)', [product_ids])
+
+    def rebuild(self, batch_size: int = 500) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {POSTGRES_TABLE}')
+            return _insert_in_batches(
+                cursor,
+                f'INSERT INTO {POSTGRES_TABLE}(product_id, document) VALUES (%s, {self.DOCUMENT_SQL})',
+                _document_rows(),
+                batch_size,
+            )
+
+
+def _insert_in_batches(cursor, sql: str, rows, batch_size: int) -> int:
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            cursor.executemany(sql, batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        cursor.executemany(sql, batch)
+        total += len(batch)
+    return total
+
+
+def get_search_backend():
+    """Selecciona el backend según la base de datos activa y settings."""
+    selected = getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'auto') or 'auto'
+    if selected == 'icontains':
+        return IcontainsSearchBackend()
+    if connection.vendor == 'sqlite' and _sqlite_index_exists():
+        return SQLiteFTSSearchBackend()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return IcontainsSearchBackend()
+
+
+_sqlite_index_ready = False
+
+
+def _sqlite_index_exists() -> bool:
+    # La tabla solo existe si el SQLite del sistema trae FTS5 (ver migración 0009)
+    global _sqlite_index_ready
+    if not _sqlite_index_ready:
+        _sqlite_index_ready = SQLITE_TABLE in connection.introspection.table_names()
+    return _sqlite_index_ready
@@ -1,8 +1,16 @@
-from django.db.models.signals import post_migrate, post_save, post_delete
+from django.db.models.signals import post_init, post_migrate, post_save, post_delete, pre_delete, pre_save, m2m_changed
+from django.db import transaction
+from django.db.models import QuerySet
+from django.contrib.auth.models import User
 from django.dispatch import receiver
 from django.apps import apps
-from django.db.models import Avg
-from .models import Category, Review, Product
+from .models import Category, Review, Product, Tag
+from .search import get_search_backend
+from .renditions import is_current, lazy_renditions
+from .ratings import apply_rating_change
+from .fragment_cache import bump_versions
+from .facets import invalidate_facets
+from . import facet_counts
 
 @receiver(post_migrate)
 def create_default_categories(sender, **kwargs):
@@ -68,21 +76,298 @@ def create_default_categories(sender, **kwargs):
     print(f"✅ {len(default_categories)} categorías creadas automáticamente")
 
 
-def _recompute_product_average(product_id: int):
-    try:
-        product = Product.objects.get(id=product_id)
-        avg = product.reviews.aggregate(v=Avg('rating'))['v'] or 0
-        product.average_rating = round(float(avg), 2)
-        product.save(update_fields=['average_rating'])
-    except Product.DoesNotExist:
-        pass
+# --- Agregados de calificación (products.ratings) ---
+
+@receiver(post_init, sender=Review)
+def remember_original_rating(sender, instance: Review, **kwargs):
+    # Calificación con la que se cargó la reseña; update_or_create la cambia antes de save()
+    instance._original_rating = instance.__dict__.get('rating') if instance.pk else None
 
 
 @receiver(post_save, sender=Review)
-def on_review_saved(sender, instance: Review, created, **kwargs):
-    _recompute_product_average(instance.product_id)
+def on_review_saved(sender, instance: Review, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else instance._original_rating
+    if previous != instance.rating:
+        # El promedio puede cambiar la banda de calificación del producto en las facetas
+        cells = facet_counts.product_cells([instance.product_id])
+        apply_rating_change(instance.product_id, added=instance.rating, removed=previous)
+        facet_counts.move_products(cells, facet_counts.product_cells([instance.product_id]))
+    instance._original_rating = instance.rating
+
+
+@receiver(post_delete, sender=Review)
+def on_review_deleted(sender, instance: Review, origin=None, **kwargs):
+    # En un CASCADE (producto, categoría o usuario borrado) las facetas las
+    # ajustan las señales del objeto borrado
+    own_delete = origin is None or isinstance(origin, Review) or (
+        isinstance(origin, QuerySet) and origin.model is Review
+    )
+    cells = facet_counts.product_cells([instance.product_id]) if own_delete else None
+    apply_rating_change(instance.product_id, removed=instance.rating)
+    if own_delete:
+        facet_counts.move_products(cells, facet_counts.product_cells([instance.product_id]))
+
+
+# --- Sincronización del índice de búsqueda ---
+
+# Campos del documento indexado que vienen del propio producto (las etiquetas
+# se reindexan con m2m_changed)
+SEARCH_FIELDS = ('title', 'description')
+
+
+@receiver(post_init, sender=Product)
+def remember_indexed_fields(sender, instance: Product, **kwargs):
+    instance._search_fields = tuple(instance.__dict__.get(name) for name in SEARCH_FIELDS) if instance.pk else None
+
+
+@receiver(post_save, sender=Product)
+def index_product_on_save(sender, instance: Product, created, raw=False, **kwargs):
+    if raw:
+        return
+    current = tuple(instance.__dict__.get(name) for name in SEARCH_FIELDS)
+    if created or instance._search_fields != current:
+        get_search_backend().index_products([instance.pk])
+    instance._search_fields = current
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product_on_delete(sender, instance: Product, **kwargs):
+    get_search_backend().remove_products([instance.pk])
+
+
+def _tagged_product_ids(instance, action, reverse, pk_set):
+    """Productos afectados por un cambio en Product.tags (desde cualquiera de los dos lados)."""
+    if not reverse:
+        return [instance.pk]
+    if action == 'post_clear':
+        return getattr(instance, '_search_product_ids', [])
+    return list(pk_set or [])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def reindex_on_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    get_search_backend().index_products(_tagged_product_ids(instance, action, reverse, pk_set))
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def remember_products_before_tag_clear(sender, instance, action, reverse, **kwargs):
+    # tag.product_set.clear() no informa qué productos pierden la etiqueta
+    if action == 'pre_clear' and reverse:
+        instance._search_product_ids = list(instance.product_set.values_list('id', flat=True))
 
 
+@receiver(post_save, sender=Tag)
+def reindex_on_tag_saved(sender, instance: Tag, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    get_search_backend().index_products(instance.product_set.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_products_before_tag_delete(sender, instance: Tag, **kwargs):
+    instance._search_product_ids = list(instance.product_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def reindex_on_tag_deleted(sender, instance: Tag, **kwargs):
+    get_search_backend().index_products(getattr(instance, '_search_product_ids', []))
+
+
+# --- Miniaturas de la imagen del producto ---
+
+@receiver(post_save, sender=Product)
+def generate_renditions_on_upload(sender, instance: Product, raw=False, **kwargs):
+    if raw or not instance.image or is_current(instance):
+        return
+    # En segundo plano y después del commit: la respuesta del formulario no espera
+    transaction.on_commit(lambda: lazy_renditions.schedule(instance.pk))
+
+
+# --- Caché de fragmentos de plantilla (products.fragment_cache) ---
+
+def _invalidate_fragments(product_ids):
+    # Después del commit: un render concurrente no debe cachear datos sin confirmar
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: bump_versions(product_ids))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_fragments_on_product_change(sender, instance: Product, raw=False, **kwargs):
+    if not raw:
+        _invalidate_fragments([instance.pk])
+
+
+@receiver(post_save, sender=Review)
 @receiver(post_delete, sender=Review)
-def on_review_deleted(sender, instance: Review, **kwargs):
-    _recompute_product_average(instance.product_id)
+def invalidate_fragments_on_review_change(sender, instance: Review, raw=False, **kwargs):
+    # Cambian el histograma y la primera página de reseñas del detalle
+    if not raw:
+        _invalidate_fragments([instance.product_id])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def invalidate_fragments_on_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _invalidate_fragments(_tagged_product_ids(instance, action, reverse, pk_set))
+
+
+@receiver(post_save, sender=Tag)
+def invalidate_fragments_on_tag_saved(sender, instance: Tag, created, raw=False, **kwargs):
+    if not created and not raw:
+        _invalidate_fragments(instance.product_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def invalidate_fragments_on_tag_deleted(sender, instance: Tag, **kwargs):
+    _invalidate_fragments(getattr(instance, '_search_product_ids', []))
+
+
+# Campos de otros modelos que se muestran dentro de los fragmentos: el nombre
+# del vendedor (detalle) y de los autores de reseñas, y la categoría (tarjeta)
+FRAGMENT_USER_FIELDS = ('username', 'date_joined')
+FRAGMENT_CATEGORY_FIELDS = ('name',)
+
+
+def _displayed_fields(instance, fields):
+    return tuple(instance.__dict__.get(name) for name in fields)
+
+
+def _displayed_fields_changed(instance, fields, created, raw) -> bool:
+    # Los save() de otros campos (p.ej. last_login en cada login) no invalidan
+    current = _displayed_fields(instance, fields)
+    changed = not created and not raw and getattr(instance, '_fragment_fields', None) != current
+    instance._fragment_fields = current
+    return changed
+
+
+@receiver(post_init, sender=User)
+@receiver(post_init, sender=Category)
+def remember_displayed_fields(sender, instance, **kwargs):
+    fields = FRAGMENT_USER_FIELDS if sender is User else FRAGMENT_CATEGORY_FIELDS
+    instance._fragment_fields = _displayed_fields(instance, fields) if instance.pk else None
+
+
+@receiver(post_save, sender=User)
+def invalidate_fragments_on_user_change(sender, instance: User, created, raw=False, **kwargs):
+    if _displayed_fields_changed(instance, FRAGMENT_USER_FIELDS, created, raw):
+        _invalidate_fragments(
+            list(Product.objects.filter(seller=instance).values_list('id', flat=True))
+            + list(Review.objects.filter(user=instance).values_list('product_id', flat=True))
+        )
+
+
+@receiver(post_save, sender=Category)
+def invalidate_fragments_on_category_change(sender, instance: Category, created, raw=False, **kwargs):
+    if _displayed_fields_changed(instance, FRAGMENT_CATEGORY_FIELDS, created, raw):
+        _invalidate_fragments(Product.objects.filter(category=instance).values_list('id', flat=True))
+
+
+# --- Tabla materializada de facetas (products.facet_counts) ---
+
+@receiver(pre_save, sender=Product)
+def remember_facet_cell(sender, instance: Product, raw=False, **kwargs):
+    # Celda con la que está contado hoy (la instancia puede estar desactualizada)
+    instance._facet_cells = {} if raw or instance.pk is None else facet_counts.product_cells([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def move_facet_cell(sender, instance: Product, created, raw=False, **kwargs):
+    if raw:
+        return
+    facet_counts.move_products(
+        instance._facet_cells,
+        facet_counts.product_cells([instance.pk]),
+        tags={} if created else None,
+    )
+
+
+@receiver(pre_delete, sender=Product)
+def remember_facet_cell_before_delete(sender, instance: Product, **kwargs):
+    instance._facet_cells = facet_counts.product_cells([instance.pk])
+    instance._facet_tags = facet_counts.product_tags([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def remove_facet_cell(sender, instance: Product, **kwargs):
+    facet_counts.move_products(instance._facet_cells, {}, tags=instance._facet_tags)
+
+
+@receiver(pre_delete, sender=User)
+def remember_reviewed_cells(sender, instance: User, **kwargs):
+    # Las reseñas del usuario se borran en CASCADE y cambian el promedio de
+    # productos que sobreviven (los suyos se borran con él)
+    product_ids = (
+        Review.objects.filter(user=instance).exclude(product__seller=instance).values_list('product_id', flat=True)
+    )
+    instance._facet_cells = facet_counts.product_cells(product_ids)
+
+
+@receiver(post_delete, sender=User)
+def move_reviewed_cells(sender, instance: User, **kwargs):
+    before = getattr(instance, '_facet_cells', {})
+    if before:
+        facet_counts.move_products(before, facet_counts.product_cells(before))
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def count_tagged_products(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_remove':
+        # pk_set trae lo pedido, no solo lo que estaba relacionado
+        related = instance.product_set if reverse else instance.tags
+        instance._facet_removed = set(related.filter(pk__in=pk_set).values_list('pk', flat=True))
+    elif action == 'pre_clear' and not reverse:
+        instance._facet_cleared_tags = list(instance.tags.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        delta = 1 if action == 'post_add' else -1
+        if action == 'post_add':
+            changed = pk_set or set()
+        elif action == 'post_remove':
+            changed = getattr(instance, '_facet_removed', set())
+        else:
+            changed = getattr(instance, '_search_product_ids' if reverse else '_facet_cleared_tags', [])
+        if not changed:
+            return
+        if reverse:
+            facet_counts.tag_products(changed, [instance.pk], delta)
+        else:
+            facet_counts.tag_products([instance.pk], changed, delta)
+
+
+# --- Conteos de facetas del catálogo (products.facets) ---
+
+def _invalidate_facets_on_commit():
+    transaction.on_commit(invalidate_facets)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_facets_on_product_change(sender, raw=False, **kwargs):
+    if not raw:
+        _invalidate_facets_on_commit()
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_facets_on_review_change(sender, raw=False, **kwargs):
+    # Puede cambiar la banda de calificación del producto
+    if not raw:
+        _invalidate_facets_on_commit()
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def invalidate_facets_on_tags_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _invalidate_facets_on_commit()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_facets_on_tag_change(sender, raw=False, **kwargs):
+    if not raw:
+        _invalidate_facets_on_commit()
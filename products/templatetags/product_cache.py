@@ -0,0 +1,51 @@
+"""
+Template tag para cachear fragmentos por producto (products.fragment_cache)
+"""
+from django import template
+
+from products.fragment_cache import fragment_key, fragment_timeout, get_cache, is_enabled
+
+register = template.Library()
+
+
+class ProductFragmentNode(template.Node):
+    def __init__(self, nodelist, name, product, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.product = product
+        self.vary_on = vary_on
+
+    def render(self, context):
+        if not is_enabled():
+            return self.nodelist.render(context)
+        product = self.product.resolve(context)
+        key = fragment_key(
+            self.name.resolve(context), product, [var.resolve(context) for var in self.vary_on]
+        )
+        cache = get_cache()
+        content = cache.get(key)
+        if content is None:
+            content = self.nodelist.render(context)
+            cache.set(key, content, fragment_timeout())
+        return content
+
+
+@register.tag('product_fragment')
+def do_product_fragment(parser, token):
+    """
+    {% product_fragment "card" product [vary ...] %} ... {% endproduct_fragment %}
+
+    Cachea el contenido hasta que cambie el producto (updated_at o su versión).
+    Lo que dependa del usuario debe quedar fuera del bloque o en `vary`.
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' requiere un nombre y un producto")
+    nodelist = parser.parse(('endproduct_fragment',))
+    parser.delete_first_token()
+    return ProductFragmentNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+        [parser.compile_filter(bit) for bit in bits[3:]],
+    )
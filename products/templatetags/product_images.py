@@ -0,0 +1,57 @@
+"""
+Template tags para mostrar Product.image con miniaturas responsivas
+"""
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+
+from products.renditions import is_current, lazy_renditions
+
+register = template.Library()
+
+
+def _srcset(paths) -> str:
+    return ', '.join(
+        f"{default_storage.url(path)} {width}w"
+        for width, path in sorted(((int(width), path) for width, path in paths.items()))
+    )
+
+
+def _closest(paths, width: int) -> str:
+    """La miniatura más chica con al menos `width` px (o la más grande que haya)."""
+    widths = sorted(int(w) for w in paths)
+    chosen = next((w for w in widths if w >= width), widths[-1])
+    return paths[str(chosen)]
+
+
+@register.simple_tag
+def product_image(product, sizes='100vw', css_class='', style='', width=320, lazy=True, alt=None):
+    """
+    <picture> con srcset WebP y JPEG de las miniaturas del producto. `sizes`
+    describe el ancho que ocupa la imagen en la página y `width` el ancho de
+    la miniatura usada como src de respaldo. Si las miniaturas aún no existen
+    usa la imagen original y pide generarlas en segundo plano.
+    """
+    if not product.image:
+        return ''
+    alt = product.title if alt is None else alt
+    loading = 'lazy' if lazy else 'eager'
+
+    if not is_current(product):
+        lazy_renditions.schedule(product.pk)
+        return format_html(
+            '<img src="{}" class="{}" style="{}" alt="{}" loading="{}" decoding="async">',
+            product.image.url, css_class, style, alt, loading,
+        )
+
+    manifest = product.image_renditions
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" class="{}" style="{}" '
+        'alt="{}" loading="{}" decoding="async">'
+        '</picture>',
+        _srcset(manifest['webp']), sizes,
+        default_storage.url(_closest(manifest['jpeg'], width)), _srcset(manifest['jpeg']), sizes,
+        manifest['width'], manifest['height'], css_class, style, alt, loading,
+    )
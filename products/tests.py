@@ -1,3 +1,589 @@
-from django.test import TestCase
+import re
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.http import QueryDict
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from PIL import Image
+
+from .facet_counts import band_expression, bucket_expression, price_bucket, rating_band
+from .facets import _bucket_range, _grouped_facets, _materialized_facets, _rating_options, facet_links, parse_filters
+from .fragment_cache import get_versions
+from .models import CatalogFacetCount, CatalogTagFacetCount, Category, Product, Review, Tag
+from .pagination import KeysetPaginator, RankedPaginator
+from .query_plans import access_paths, explain, plan_problems, seed_catalog
+from .renditions import is_current, render_renditions, store_renditions
+
+
+def setUpModule():
+    """Las imágenes subidas y las miniaturas de los tests van a un directorio temporal."""
+    directory = tempfile.mkdtemp()
+    unittest.addModuleCleanup(shutil.rmtree, directory, ignore_errors=True)
+    media_settings = override_settings(MEDIA_ROOT=directory)
+    media_settings.enable()
+    unittest.addModuleCleanup(media_settings.disable)
+
+
+def jpeg_upload(name='foto.jpg', size=(800, 400)):
+    output = BytesIO()
+    Image.new('RGB', size, (200, 120, 40)).save(output, format='JPEG')
+    return SimpleUploadedFile(name, output.getvalue(), content_type='image/jpeg')
+
+
+def make_products(count, category, seller, **fields):
+    """Crea `count` productos publicados, uno por minuto hacia atrás desde ahora."""
+    now = timezone.now()
+    products = []
+    for i in range(count):
+        product = Product.objects.create(
+            title=fields.get('title', f'Producto {i}'),
+            description=fields.get('description', 'Descripción de prueba'),
+            price=fields.get('price', Decimal('10.00')),
+            category=category,
+            image='',
+            seller=seller,
+            status=fields.get('status', 'published'),
+        )
+        # created_at es auto_now_add: se ajusta después para que el orden sea determinista
+        Product.objects.filter(pk=product.pk).update(created_at=now - timedelta(minutes=i))
+        products.append(product)
+    return products
+
+
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        for alias in caches:
+            caches[alias].clear()
+        self.seller = User.objects.create_user('vendedor', password='x')
+        self.category = Category.objects.create(name='Hogar')
+
+
+class KeysetPaginatorTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = make_products(7, self.category, self.seller)
+        self.paginator = KeysetPaginator(Product.objects.published(), per_page=3)
+
+    def test_walks_every_product_once_newest_first(self):
+        seen, cursor = [], None
+        while True:
+            page = self.paginator.page(cursor)
+            seen.extend(product.pk for product in page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, [product.pk for product in self.products])
+
+    def test_prev_cursor_returns_to_previous_page(self):
+        first = self.paginator.page()
+        second = self.paginator.page(first.next_cursor)
+        back = self.paginator.page(second.prev_cursor)
+        self.assertEqual([p.pk for p in back], [p.pk for p in first])
+        self.assertFalse(back.has_previous)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        page = self.paginator.page('no-es-un-cursor')
+        self.assertEqual([p.pk for p in page], [p.pk for p in self.products[:3]])
+
+    def test_stale_cursor_keeps_a_way_back(self):
+        first = self.paginator.page()
+        Product.objects.filter(pk__in=[p.pk for p in self.products[3:]]).delete()
+
+        empty = self.paginator.page(first.next_cursor)
+        self.assertEqual(len(empty), 0)
+        self.assertTrue(empty.has_previous)
+        back = self.paginator.page(empty.prev_cursor)
+        self.assertEqual([p.pk for p in back], [p.pk for p in first])
+
+
+class HomeListingTests(CatalogTestCase):
+    def _home_queries(self):
+        for alias in caches:
+            caches[alias].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_the_catalog(self):
+        make_products(3, self.category, self.seller)
+        small = self._home_queries()
+        make_products(20, self.category, self.seller)
+        self.assertEqual(self._home_queries(), small)
+
+    def test_pages_through_the_catalog(self):
+        products = make_products(30, self.category, self.seller)
+        response = self.client.get(reverse('home'))
+        page = response.context['page']
+        self.assertEqual(len(page), 24)
+        self.assertTrue(page.has_next)
+
+        response = self.client.get(reverse('home'), {'cursor': page.next_cursor})
+        self.assertEqual([p.pk for p in response.context['page']], [p.pk for p in products[24:]])
+
+    def test_drafts_are_not_listed(self):
+        make_products(2, self.category, self.seller, status='draft')
+        response = self.client.get(reverse('home'))
+        self.assertEqual(len(response.context['page']), 0)
+
+
+class SearchTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        # El más reciente solo menciona el término en la descripción
+        self.in_description, self.in_title = make_products(2, self.category, self.seller)
+        self.in_description.title = 'Mesa de roble'
+        self.in_description.description = 'Ideal junto a una lámpara'
+        self.in_description.save()
+        self.in_title.title = 'Lámpara de pie'
+        self.in_title.save()
+
+    def _titles(self, term):
+        return [p.title for p in Product.objects.published().search_title(term)]
+
+    def test_ranks_title_matches_first(self):
+        self.assertEqual(self._titles('lámpara'), ['Lámpara de pie', 'Mesa de roble'])
+
+    def test_index_follows_saves_tags_and_deletes(self):
+        tag = Tag.objects.create(name='vintage')
+        self.in_title.tags.add(tag)
+        self.assertEqual(self._titles('vintage'), ['Lámpara de pie'])
+
+        tag.name = 'retro'
+        tag.save()
+        self.assertEqual(self._titles('vintage'), [])
+        self.assertEqual(self._titles('retro'), ['Lámpara de pie'])
+
+        self.in_title.delete()
+        self.assertEqual(self._titles('lámpara'), ['Mesa de roble'])
+
+    def test_home_keeps_relevance_order(self):
+        response = self.client.get(reverse('home'), {'searchProduct': 'lampara'})
+        self.assertEqual([p.pk for p in response.context['page']], [self.in_title.pk, self.in_description.pk])
+
+    def test_ranked_results_paginate_without_repeats(self):
+        make_products(5, self.category, self.seller, title='Lámpara colgante')
+        paginator = RankedPaginator(Product.objects.published().search_title('lámpara'), per_page=4)
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        ids = [p.pk for p in first] + [p.pk for p in second]
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(len(set(ids)), 7)
+        self.assertFalse(second.has_next)
+        self.assertEqual([p.pk for p in paginator.page(second.prev_cursor)], [p.pk for p in first])
+
+    def test_saves_outside_the_document_do_not_reindex(self):
+        with mock.patch('products.signals.get_search_backend') as backend:
+            product = Product.objects.get(pk=self.in_title.pk)
+            product.price = Decimal('99.00')
+            product.save()
+            backend.return_value.index_products.assert_not_called()
+
+            product.title = 'Lámpara de mesa'
+            product.save()
+            backend.return_value.index_products.assert_called_once_with([product.pk])
+
+    def test_ranking_has_no_extra(self):
+        queryset = Product.objects.published().search_title('lámpara')
+        self.assertFalse(queryset.query.extra)
+        self.assertIn('search_rank', queryset.query.annotations)
+
+    @override_settings(PRODUCT_SEARCH_BACKEND='icontains')
+    def test_icontains_backend(self):
+        self.assertEqual(self._titles('roble'), ['Mesa de roble'])
+
+
+class RatingAggregateTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product, = make_products(1, self.category, self.seller)
+        self.reviewers = [User.objects.create_user(f'cliente{i}', password='x') for i in range(3)]
+
+    def assertAggregates(self, ratings):
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.rating_sum, product.rating_count), (sum(ratings), len(ratings)))
+        for stars in range(1, 6):
+            self.assertEqual(getattr(product, f'rating_{stars}_count'), ratings.count(stars), stars)
+        average = round(Decimal(sum(ratings)) / len(ratings), 2) if ratings else Decimal('0.00')
+        self.assertEqual(product.average_rating, average)
+
+    def _review(self, user, rating):
+        return Review.objects.create(product=self.product, user=user, rating=rating)
+
+    def test_create_edit_and_delete(self):
+        first = self._review(self.reviewers[0], 5)
+        self._review(self.reviewers[1], 4)
+        self.assertAggregates([5, 4])
+
+        first.rating = 2
+        first.save()
+        self.assertAggregates([2, 4])
+
+        first.delete()
+        self.assertAggregates([4])
+        Review.objects.all().delete()
+        self.assertAggregates([])
+
+    def test_resubmitting_a_review_moves_one_rating(self):
+        self.client.login(username='cliente0', password='x')
+        url = reverse('submit_review', args=[self.product.pk])
+        self.client.post(url, {'rating': 5, 'comment': 'Muy bueno'})
+        self.client.post(url, {'rating': 3, 'comment': 'Regular'})
+        self.assertEqual(Review.objects.filter(product=self.product).count(), 1)
+        self.assertAggregates([3])
+
+    def test_deleting_a_reviewer_removes_their_rating(self):
+        self._review(self.reviewers[0], 1)
+        self._review(self.reviewers[1], 5)
+        self.reviewers[0].delete()
+        self.assertAggregates([5])
+
+    def test_stale_product_save_keeps_the_aggregates(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self._review(self.reviewers[0], 4)
+        stale.title = 'Título nuevo'
+        stale.save()
+        self.assertEqual(Product.objects.get(pk=self.product.pk).title, 'Título nuevo')
+        self.assertAggregates([4])
+
+    def test_histogram_percentages(self):
+        self.assertEqual([bucket['percent'] for bucket in self.product.rating_histogram], [0, 0, 0, 0, 0])
+        for user, rating in zip(self.reviewers, [5, 4, 4]):
+            self._review(user, rating)
+        histogram = Product.objects.get(pk=self.product.pk).rating_histogram
+        self.assertEqual([bucket['stars'] for bucket in histogram], [5, 4, 3, 2, 1])
+        self.assertEqual([bucket['count'] for bucket in histogram], [1, 2, 0, 0, 0])
+        self.assertEqual([bucket['percent'] for bucket in histogram], [33, 67, 0, 0, 0])
+
+    def test_reconcile_fixes_writes_that_bypass_signals(self):
+        Review.objects.bulk_create([
+            Review(product=self.product, user=user, rating=rating)
+            for user, rating in zip(self.reviewers, [5, 3, 1])
+        ])
+        self.assertAggregates([])
+
+        output = StringIO()
+        call_command('reconcile_ratings', '--dry-run', stdout=output)
+        self.assertIn('1 productos con agregados desactualizados', output.getvalue())
+        self.assertAggregates([])
+
+        call_command('reconcile_ratings', stdout=StringIO())
+        self.assertAggregates([5, 3, 1])
+        output = StringIO()
+        call_command('reconcile_ratings', '--dry-run', stdout=output)
+        self.assertIn('0 productos', output.getvalue())
+
+
+@override_settings(CATALOG_PRICE_BUCKETS=[0, 25, 50, 100])
+class FacetCountTests(CatalogTestCase):
+    """Las tablas de conteos que mantienen las señales coinciden con las consultas agrupadas."""
+
+    def setUp(self):
+        super().setUp()
+        self.other_category = Category.objects.create(name='Jardín')
+        self.tags = [Tag.objects.create(name=name) for name in ('rojo', 'azul')]
+        self.reviewers = [User.objects.create(username=f'cliente{i}') for i in range(2)]
+        self.products = [
+            self._product(price, category)
+            for price, category in [('24.99', self.category), ('25.00', self.category),
+                                    ('49.99', self.other_category), ('100.00', self.other_category)]
+        ]
+        self.products[0].tags.add(*self.tags)
+        self.products[2].tags.add(self.tags[0])
+
+    def _product(self, price, category, status='published', seller=None):
+        return Product.objects.create(title=f'Producto {price}', description='d', price=Decimal(price),
+                                      category=category, image='', seller=seller or self.seller, status=status)
+
+    def assertTablesMatch(self):
+        published = Product.objects.published().order_by()
+        expected = {
+            (row['category_id'], row['bucket'], row['band']): row['count']
+            for row in published.annotate(bucket=bucket_expression(), band=band_expression())
+            .values('category_id', 'bucket', 'band').annotate(count=Count('id'))
+        }
+        stored = {
+            (cell.category_id, cell.price_bucket, cell.rating_band): cell.product_count
+            for cell in CatalogFacetCount.objects.exclude(product_count=0)
+        }
+        self.assertEqual(stored, expected)
+
+        through = Product.tags.through.objects.filter(product__status='published').order_by()
+        expected_tags = {
+            (row['tag_id'], row['product__category_id'], row['bucket'], row['band']): row['count']
+            for row in through.annotate(bucket=bucket_expression('product__price'),
+                                        band=band_expression('product__average_rating'))
+            .values('tag_id', 'product__category_id', 'bucket', 'band').annotate(count=Count('id'))
+        }
+        stored_tags = {
+            (cell.tag_id, cell.category_id, cell.price_bucket, cell.rating_band): cell.product_count
+            for cell in CatalogTagFacetCount.objects.exclude(product_count=0)
+        }
+        self.assertEqual(stored_tags, expected_tags)
+
+    def assertFacetsAgree(self, **params):
+        filters = parse_filters(params)
+        self.assertEqual(_materialized_facets(filters), _grouped_facets(filters), params)
+
+    def test_edits_and_reviews_move_products(self):
+        product = Product.objects.get(pk=self.products[0].pk)
+        product.price = Decimal('60.00')
+        product.category = self.other_category
+        product.save()
+        draft = Product.objects.get(pk=self.products[1].pk)
+        draft.status = 'draft'
+        draft.save()
+        for user, rating in zip(self.reviewers, (4, 3)):
+            Review.objects.create(product=self.products[2], user=user, rating=rating)
+        self.assertTablesMatch()
+
+        Review.objects.filter(product=self.products[2], rating=3).delete()
+        self.assertTablesMatch()
+
+    def test_deletes_and_cascades(self):
+        Product.objects.get(pk=self.products[0].pk).delete()
+        self.assertTablesMatch()
+        another_seller = User.objects.create(username='otro')
+        self._product('10.00', self.category, seller=another_seller).tags.add(self.tags[1])
+        another_seller.delete()
+        self.assertTablesMatch()
+        self.other_category.delete()
+        self.assertTablesMatch()
+
+    def test_tag_changes(self):
+        self.products[1].tags.add(self.tags[1])
+        self.products[0].tags.remove(self.tags[0])
+        self.tags[1].product_set.add(self.products[3])
+        self.assertTablesMatch()
+        self.products[0].tags.clear()
+        self.tags[0].delete()
+        self.assertTablesMatch()
+
+    def test_materialized_facets_match_grouped_queries(self):
+        Review.objects.create(product=self.products[1], user=self.reviewers[0], rating=4)
+        Review.objects.create(product=self.products[2], user=self.reviewers[0], rating=3)
+        Review.objects.create(product=self.products[2], user=self.reviewers[1], rating=4)
+        for params in [{}, {'category': str(self.category.pk)}, {'price_min': '25', 'price_max': '49.99'},
+                       {'price_max': '24.99'}, {'price_min': '100'}, {'tag': str(self.tags[0].pk)},
+                       {'min_rating': '3'}, {'min_rating': '4', 'category': str(self.other_category.pk)}]:
+            self.assertFacetsAgree(**params)
+
+    def test_bucket_range(self):
+        self.assertEqual(_bucket_range(None, None), (0, 4))
+        self.assertEqual(_bucket_range(Decimal('25.00'), Decimal('49.99')), (1, 2))
+        self.assertEqual(_bucket_range(Decimal('0.00'), Decimal('99.99')), (0, 3))
+        self.assertEqual(_bucket_range(Decimal('100.00'), None), (3, 4))
+        # Límites que no caen en un borde: se cuenta con la consulta agrupada
+        self.assertIsNone(_bucket_range(Decimal('30.00'), None))
+        self.assertIsNone(_bucket_range(None, Decimal('50.00')))
+
+    def test_price_edges_and_rating_bands(self):
+        self.assertEqual([price_bucket(Decimal(price)) for price in ('0', '24.99', '25', '99.99', '100', '5000')],
+                         [0, 0, 1, 2, 3, 3])
+        self.assertEqual([rating_band(Decimal(value)) for value in ('0', '2.99', '3', '4.50', '5')],
+                         [0, 2, 3, 4, 5])
+        # "N o más" acumula las bandas >= N
+        self.assertEqual(_rating_options({5: 1, 4: 2, 3: 1, 1: 3}),
+                         [{'min_rating': 4, 'count': 3}, {'min_rating': 3, 'count': 4},
+                          {'min_rating': 2, 'count': 4}, {'min_rating': 1, 'count': 7}])
+
+    def test_facet_links_toggle_options_and_drop_the_cursor(self):
+        params = QueryDict(f'category={self.category.pk}&price_min=25&price_max=49.99&cursor=abc')
+        facets = {
+            'category': [{'id': self.category.pk, 'name': 'Hogar', 'count': 2},
+                         {'id': self.other_category.pk, 'name': 'Jardín', 'count': 1}],
+            'price': [{'min': '25', 'max': '49.99', 'count': 1}, {'min': '100', 'max': '', 'count': 1}],
+            'tag': [],
+            'rating': [{'min_rating': 4, 'count': 1}],
+        }
+        links = facet_links(facets, params)
+
+        selected, other = links['category']
+        self.assertTrue(selected['selected'])
+        self.assertEqual(QueryDict(selected['query']).dict(), {'price_min': '25', 'price_max': '49.99'})
+        self.assertFalse(other['selected'])
+        self.assertEqual(QueryDict(other['query'])['category'], str(self.other_category.pk))
+
+        chosen_price, open_price = links['price']
+        self.assertTrue(chosen_price['selected'])
+        self.assertEqual(QueryDict(chosen_price['query']).dict(), {'category': str(self.category.pk)})
+        self.assertEqual(QueryDict(open_price['query']).dict(), {'category': str(self.category.pk), 'price_min': '100'})
+        self.assertEqual(QueryDict(links['rating'][0]['query'])['min_rating'], '4')
+        self.assertNotIn('cursor', links['rating'][0]['query'])
+
+
+@mock.patch('products.views.REVIEWS_PAGE_SIZE', 3)
+class ReviewPagingTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product, = make_products(1, self.category, self.seller)
+        now = timezone.now()
+        for i in range(8):
+            review = Review.objects.create(product=self.product, rating=i % 5 + 1,
+                                           user=User.objects.create(username=f'cliente{i}'))
+            # De a pares con la misma fecha: el id desempata
+            Review.objects.filter(pk=review.pk).update(created_at=now - timedelta(minutes=i // 2))
+        self.expected = [f'cliente{i}' for i in (1, 0, 3, 2, 5, 4, 7, 6)]
+
+    def _load_more(self, cursor=None):
+        params = {'cursor': cursor} if cursor else {}
+        data = self.client.get(reverse('product_reviews', args=[self.product.pk]), params).json()
+        return re.findall(r'<strong>(\w+)</strong>', data['html']), data['next_cursor']
+
+    def test_load_more_walks_every_review_once(self):
+        seen, pages, cursor = [], 0, None
+        while True:
+            usernames, cursor = self._load_more(cursor)
+            seen.extend(usernames)
+            pages += 1
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(pages, 3)
+
+    def test_detail_page_follows_reviews_cursor(self):
+        _, cursor = self._load_more()
+        response = self.client.get(reverse('product_detail', args=[self.product.pk]), {'reviews_cursor': cursor})
+        content = response.content.decode('utf-8')
+        shown = re.findall(r'<strong>(\w+)</strong>', content)
+        self.assertEqual([name for name in shown if name in self.expected], self.expected[3:6])
+        self.assertIn('data-cursor="', content)
+
+    def test_unknown_product_is_404(self):
+        self.assertEqual(self.client.get(reverse('product_reviews', args=[self.product.pk + 1])).status_code, 404)
+
+
+class FragmentInvalidationTests(CatalogTestCase):
+    """Los fragmentos cacheados muestran datos del vendedor, de los autores y de la categoría."""
+
+    def setUp(self):
+        super().setUp()
+        self.product, = make_products(1, self.category, self.seller)
+        self.reviewer = User.objects.create_user('autora', password='x')
+        Review.objects.create(product=self.product, user=self.reviewer, rating=4)
+
+    def _detail(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            pass
+        return self.client.get(reverse('product_detail', args=[self.product.pk])).content.decode('utf-8')
+
+    def _rename(self, instance, field, value):
+        with self.captureOnCommitCallbacks(execute=True):
+            setattr(instance, field, value)
+            instance.save()
+
+    def test_renamed_seller_is_shown(self):
+        self.assertIn('Publicado por vendedor', self._detail())
+        self._rename(User.objects.get(pk=self.seller.pk), 'username', 'tienda_nueva')
+        self.assertIn('Publicado por tienda_nueva', self._detail())
+
+    def test_renamed_reviewer_is_shown(self):
+        self.assertIn('autora', self._detail())
+        self._rename(User.objects.get(pk=self.reviewer.pk), 'username', 'autora_nueva')
+        self.assertIn('autora_nueva', self._detail())
+
+    def test_renamed_category_is_shown_on_the_card(self):
+        self.client.get(reverse('home'))
+        self._rename(Category.objects.get(pk=self.category.pk), 'name', 'Decoración')
+        self.assertContains(self.client.get(reverse('home')), '<span class="badge bg-primary">Decoración</span>')
+
+    def test_login_does_not_invalidate(self):
+        version = get_versions([self.product.pk])[self.product.pk]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.login(username='vendedor', password='x')
+        self.assertEqual(get_versions([self.product.pk])[self.product.pk], version)
+
+
+@override_settings(PRODUCT_RENDITION_WIDTHS=[160, 320, 1024])
+class RenditionTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product, = make_products(1, self.category, self.seller)
+        # Con la imagen asignada por update() no se programa la generación en segundo plano
+        self.product.image.save('foto.jpg', jpeg_upload(), save=False)
+        Product.objects.filter(pk=self.product.pk).update(image=self.product.image.name)
+
+    def _render(self, **context):
+        template = Template("{% load product_images %}{% product_image product sizes='50vw' width=300 %}")
+        return template.render(Context(context))
+
+    def test_render_skips_widths_wider_than_the_original(self):
+        rendered = render_renditions(jpeg_upload().read(), (160, 320, 1024))
+        self.assertEqual((rendered['width'], rendered['height']), (800, 400))
+        for image_format in ('webp', 'jpeg'):
+            self.assertEqual(sorted(rendered['files'][image_format]), [160, 320, 800])
+        with Image.open(BytesIO(rendered['files']['jpeg'][320])) as thumbnail:
+            self.assertEqual(thumbnail.size, (320, 160))
+
+    def test_manifest_names_files_by_content(self):
+        rendered = render_renditions(jpeg_upload().read(), (160, 320))
+        manifest = store_renditions('products/images/foto.jpg', rendered)
+        self.assertEqual(
+            (manifest['source'], manifest['width'], manifest['height']), ('products/images/foto.jpg', 800, 400)
+        )
+        self.assertEqual(sorted(manifest['webp']), ['160', '320'])
+        for path in list(manifest['webp'].values()) + list(manifest['jpeg'].values()):
+            self.assertTrue(default_storage.exists(path))
+        self.assertEqual(store_renditions('products/images/foto.jpg', rendered), manifest)
+
+    def test_backfill_command_invalidates_fragments(self):
+        version = get_versions([self.product.pk])[self.product.pk]
+        call_command('generate_renditions', workers=1, stdout=StringIO(), stderr=StringIO())
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertTrue(is_current(product))
+        self.assertNotEqual(get_versions([self.product.pk])[self.product.pk], version)
+
+    def test_tag_uses_the_renditions(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.image_renditions = store_renditions(
+            product.image.name, render_renditions(jpeg_upload().read(), (160, 320, 1024))
+        )
+        html = self._render(product=product)
+        self.assertIn('<source type="image/webp" srcset="', html)
+        for width in ('160w', '320w', '800w'):
+            self.assertIn(width, html)
+        self.assertIn(f'src="{default_storage.url(product.image_renditions["jpeg"]["320"])}"', html)
+        self.assertIn('width="800" height="400"', html)
+        self.assertIn('sizes="50vw"', html)
+
+    def test_tag_falls_back_to_the_original_and_schedules_renditions(self):
+        product = Product.objects.get(pk=self.product.pk)
+        with mock.patch('products.templatetags.product_images.lazy_renditions') as queue:
+            html = self._render(product=product)
+        self.assertIn(f'<img src="{product.image.url}"', html)
+        self.assertNotIn('<picture>', html)
+        queue.schedule.assert_called_once_with(product.pk)
+
+        product.image = ''
+        self.assertEqual(self._render(product=product), '')
+
+
+class QueryPlanTests(TestCase):
+    """Cada camino de acceso del catálogo usa su índice (mismas reglas que check_query_plans)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixture = seed_catalog(3000)
+
+    def test_access_paths_use_their_indexes(self):
+        for name, queryset in access_paths(self.fixture):
+            with self.subTest(name):
+                plan = explain(queryset)
+                self.assertEqual(plan_problems(name, plan), [], '\n'.join(plan))
@@ -14,6 +14,7 @@ urlpatterns = [
     path('product/create/', ProductCreateView.as_view(), name='create_product'),
     path('product/<int:pk>/', ProductDetailView.as_view(), name='product_detail'),
     path('product/<int:pk>/review/', SubmitReviewView.as_view(), name='submit_review'),
+    path('product/<int:pk>/reviews/', views.product_reviews, name='product_reviews'),
     path('product/<int:pk>/edit/', ProductUpdateView.as_view(), name='edit_product'),
     path('product/<int:pk>/delete/', ProductDeleteView.as_view(), name='delete_product'),
     path('products/',views.products, name='products'),
@@ -1,5 +1,5 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import UserCreationForm
@@ -7,10 +7,26 @@ from django.contrib import messages
 from .models import Product, Category
 from .forms import ProductForm, ReviewForm
 from django.contrib.auth.models import User
-from .models import Product, Category, Wishlist
+from .models import Product, Category, Review, Wishlist
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, FormView
 from django.urls import reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.conf import settings
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.functional import SimpleLazyObject
+from .facets import catalog_facets, facet_links, parse_filters
+from .fragment_cache import get_versions, is_enabled as fragment_cache_enabled, prime_versions
+from .pagination import KeysetPaginator, RankedPaginator
+
+CATALOG_PAGE_SIZE = getattr(settings, 'CATALOG_PAGE_SIZE', 24)
+REVIEWS_PAGE_SIZE = getattr(settings, 'REVIEWS_PAGE_SIZE', 10)
+
+
+def _reviews_page(product_id, cursor=None):
+    """Una página de reseñas del producto, de la más reciente a la más antigua."""
+    reviews = Review.objects.filter(product_id=product_id).select_related('user')
+    return KeysetPaginator(reviews, per_page=REVIEWS_PAGE_SIZE).page(cursor)
 
 
 def home(request):
@@ -18,21 +34,42 @@ def home(request):
     category_filter = request.GET.get('category')
     price_min = request.GET.get('price_min')
     price_max = request.GET.get('price_max')
+    filters = parse_filters(request.GET)
 
     products = (
         Product.objects
         .published()
         .search_title(searchTerm)
-        .by_category_id(category_filter)
-        .price_between(price_min, price_max)
+        .by_category_id(filters['category'])
+        .price_between(filters['price_min'], filters['price_max'])
+        .with_tag(filters['tag'])
+        .min_rating(filters['min_rating'])
+        .for_listing()
     )
-
-    categories = Category.objects.all()
+    # Con búsqueda se conserva el orden por relevancia; el catálogo va por fecha
+    paginator_class = RankedPaginator if searchTerm else KeysetPaginator
+    page = paginator_class(products, per_page=CATALOG_PAGE_SIZE).page(request.GET.get('cursor'))
+    # Versiones de las tarjetas en una sola lectura de la caché de fragmentos
+    prime_versions(page)
+
+    # Filtros actuales sin el cursor, para armar los enlaces de navegación
+    filter_params = request.GET.copy()
+    filter_params.pop('cursor', None)
+
+    # Conteos por faceta para los filtros actuales (cacheados por firma de filtros)
+    facets = facet_links(catalog_facets(filters), request.GET)
+    counts = {option['id']: option['count'] for option in facets['category']}
+    categories = list(Category.objects.all())
+    for category in categories:
+        category.product_count = counts.get(category.id, 0)
 
     context = {
-        'products': products,
+        'products': page,
+        'page': page,
+        'filter_query': filter_params.urlencode(),
         'searchTerm': searchTerm,
         'categories': categories,
+        'facets': facets,
         'selected_category': category_filter,
         'price_min': price_min,
         'price_max': price_max
@@ -108,6 +145,17 @@ class ProductDetailView(DetailView):
     model = Product
     template_name = 'product_detail.html'
 
+    def get_queryset(self):
+        return Product.objects.select_related('seller', 'category')
+
+    def get_object(self, queryset=None):
+        # La versión se lee antes que el producto: si un cambio entra entre
+        # ambas lecturas, el fragmento queda con la versión vieja y no se reusa
+        version = get_versions([self.kwargs['pk']])[self.kwargs['pk']] if fragment_cache_enabled() else None
+        product = super().get_object(queryset)
+        product._fragment_version = version
+        return product
+
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         in_wishlist = False
@@ -115,15 +163,29 @@ class ProductDetailView(DetailView):
             in_wishlist = Wishlist.objects.filter(user=self.request.user, product=self.object).exists()
         ctx['in_wishlist'] = in_wishlist
         ctx['review_form'] = ReviewForm()
-        ctx['reviews'] = self.object.reviews.select_related('user')
+        # Solo la primera página; el resto se pide con product_reviews ("Ver más").
+        # El histograma sale de los contadores del producto (products.ratings).
+        # Perezosa: si el fragmento de reseñas está en caché no se consulta.
+        product_id, cursor = self.object.pk, self.request.GET.get('reviews_cursor')
+        ctx['reviews_cursor'] = cursor or ''
+        ctx['reviews'] = SimpleLazyObject(lambda: _reviews_page(product_id, cursor))
         return ctx
 
 
+def product_reviews(request, pk):
+    """Siguiente página de reseñas en JSON: HTML ya renderizado y el cursor siguiente."""
+    product = get_object_or_404(Product.objects.only('id'), pk=pk)
+    page = _reviews_page(product.pk, request.GET.get('cursor'))
+    return JsonResponse({
+        'html': render_to_string('partials/_reviews.html', {'reviews': page}, request=request),
+        'next_cursor': page.next_cursor,
+    })
+
+
 class SubmitReviewView(LoginRequiredMixin, FormView):
     form_class = ReviewForm
 
     def form_valid(self, form):
-        from .models import Review
         product = get_object_or_404(Product, pk=self.kwargs['pk'])
 
         # Moderation strategy (simple): basic profanity filter / length check
@@ -133,14 +195,16 @@ class SubmitReviewView(LoginRequiredMixin, FormView):
             messages.error(self.request, 'Tu reseña parece contener spam o enlaces no permitidos.')
             return redirect('product_detail', pk=product.pk)
 
-        Review.objects.update_or_create(
-            product=product,
-            user=self.request.user,
-            defaults={
-                'rating': rating,
-                'comment': comment,
-            }
-        )
+        # La reseña y los agregados del producto (señales de Review) se confirman juntos
+        with transaction.atomic():
+            Review.objects.update_or_create(
+                product=product,
+                user=self.request.user,
+                defaults={
+                    'rating': rating,
+                    'comment': comment,
+                }
+            )
         messages.success(self.request, '¡Gracias por tu reseña!')
         return redirect('product_detail', pk=product.pk)
 
@@ -0,0 +1,114 @@
+"""
+Checks and benchmarks the dynamic batching of server.py without a GPU.
+
+Runs Gemma3API directly (no HTTP) on a tiny random-weight Gemma 3 checkpoint:
+    1. Correctness: greedy outputs of a batch must match the same requests run
+       one at a time, i.e. padding and per-request streams do not mix rows.
+    2. Throughput: requests/s for each batch size, plus the hit rate of the
+       processed-image cache.
+
+Usage:
+    python batch_benchmark.py --batch-sizes 1 2 4 8 --requests 32
+    MODEL_ID=google/gemma-3-4b-it python batch_benchmark.py --device cuda
+"""
+import argparse
+import base64
+import io
+import os
+import time
+
+TINY_MODEL_ID = "trl-internal-testing/tiny-Gemma3ForConditionalGeneration"
+os.environ.setdefault("MODEL_ID", TINY_MODEL_ID)
+
+from PIL import Image  # noqa: E402
+from litserve.specs.openai import ChatCompletionRequest  # noqa: E402
+
+from server import Gemma3API  # noqa: E402
+
+PROMPTS = [
+    "Describe this image in detail.",
+    "What product is shown?",
+    "Suggest a title, a category and a price for this product in JSON.",
+    "List the colors.",
+]
+COLORS = ["red", "green", "blue", "white", "black", "orange", "purple", "gray"]
+
+
+def make_request(index, max_tokens):
+    """OpenAI-style request with a small generated image as a data URL."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (64 + index * 8, 64), COLORS[index % len(COLORS)]).save(buffer, format="PNG")
+    image_url = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("utf-8")
+    return ChatCompletionRequest(
+        model="gemma3",
+        messages=[{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": PROMPTS[index % len(PROMPTS)]},
+                {"type": "image_url", "image_url": {"url": image_url}},
+            ],
+        }],
+        max_tokens=max_tokens,
+    )
+
+
+def run_batch(api, requests):
+    """Run requests the way LitServe does with max_batch_size > 1; returns the full texts."""
+    contexts = [{} for _ in requests]
+    decoded = [api.decode_request(request, context) for request, context in zip(requests, contexts)]
+    texts = ["" for _ in requests]
+    for step in api.predict(api.batch(decoded), contexts):
+        for row, delta in enumerate(api.unbatch(step)):
+            texts[row] += delta
+    return texts
+
+
+def run_single(api, request):
+    """Run one request the way LitServe does with max_batch_size = 1."""
+    context = {}
+    return "".join(api.predict(api.decode_request(request, context), context))
+
+
+def check(api, batch_size, max_tokens):
+    # Different prompt lengths and max_tokens force padding and per-row limits
+    requests = [make_request(i, max_tokens - i) for i in range(batch_size)]
+    expected = [run_single(api, request) for request in requests]
+    actual = run_batch(api, requests)
+    for row, (want, got) in enumerate(zip(expected, actual)):
+        if want != got:
+            raise SystemExit(f"✗ Row {row} differs in batch of {batch_size}:\n  single: {want!r}\n  batch:  {got!r}")
+    print(f"✓ Batch of {batch_size} matches sequential output")
+
+
+def benchmark(api, batch_sizes, total_requests, max_tokens):
+    requests = [make_request(i, max_tokens) for i in range(total_requests)]
+    run_batch(api, requests[:1])  # warm-up
+    baseline = None
+    print(f"{'batch':>6} {'req/s':>8} {'speedup':>8}")
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for offset in range(0, total_requests, batch_size):
+            run_batch(api, requests[offset:offset + batch_size])
+        throughput = total_requests / (time.perf_counter() - start)
+        baseline = baseline or throughput
+        print(f"{batch_size:>6} {throughput:>8.2f} {throughput / baseline:>7.2f}x")
+    # Every batch size after the first replays the same images
+    print(f"Image cache: {api.pixel_cache.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Correctness check and throughput benchmark for Gemma3API batching")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--skip-check", action="store_true")
+    args = parser.parse_args()
+
+    api = Gemma3API()
+    api.setup(args.device)
+    print(f"Model: {os.environ['MODEL_ID']} on {args.device}")
+
+    if not args.skip_check:
+        check(api, max(args.batch_sizes), args.max_tokens)
+    benchmark(api, args.batch_sizes, args.requests, args.max_tokens)
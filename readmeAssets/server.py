@@ -1,13 +1,18 @@
 # Necessary imports
+import base64
+import hashlib
 import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from threading import Thread
+from queue import Queue
+from threading import Lock, Thread
 import torch
 from transformers import (
     AutoProcessor,
     Gemma3ForConditionalGeneration,
-    TextIteratorStreamer,
 )
+from transformers.generation.streamers import BaseStreamer
 from transformers.image_utils import load_image
 import litserve as ls
 from litserve.specs.openai import ChatCompletionRequest
@@ -19,6 +24,133 @@ load_dotenv()
 # Access token for using the model
 access_token = os.environ.get("ACCESS_TOKEN")
 
+# Model and batching configuration (batch size 1 keeps the original behaviour)
+MODEL_ID = os.environ.get("MODEL_ID", "google/gemma-3-4b-it")
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "4"))
+BATCH_TIMEOUT = float(os.environ.get("BATCH_TIMEOUT", "0.05"))
+DEFAULT_MAX_NEW_TOKENS = 300
+
+# Image preprocessing: worker threads and processed-pixel cache size (entries)
+PREPROCESS_WORKERS = int(os.environ.get("PREPROCESS_WORKERS", "4"))
+IMAGE_CACHE_SIZE = int(os.environ.get("IMAGE_CACHE_SIZE", "256"))
+CACHE_STATS_EVERY = 100
+
+
+def image_digest(image_url):
+    """
+    SHA-256 of the image bytes for data URLs (the same photo sent twice gets
+    the same key); other URLs are keyed by the URL itself.
+    """
+    if image_url.startswith("data:") and "," in image_url:
+        try:
+            return hashlib.sha256(base64.b64decode(image_url.split(",", 1)[1])).hexdigest()
+        except ValueError:
+            pass
+    return hashlib.sha256(image_url.encode("utf-8")).hexdigest()
+
+
+class PixelCache:
+    """
+    Bounded LRU of processed pixel tensors keyed by image digest, with
+    hit/miss counters. Tensors are kept on CPU so the cache does not compete
+    with generation for GPU memory.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+
+class BatchTextIteratorStreamer(BaseStreamer):
+    """
+    Streamer for batched generation. `TextIteratorStreamer` only supports batch
+    size 1, so this keeps a token cache per row and, for every generation step,
+    queues a list with the new text of each request ("" when a row has nothing
+    new, has hit EOS or has reached its own max_new_tokens).
+    """
+
+    def __init__(self, tokenizer, max_new_tokens, timeout=None, **decode_kwargs):
+        self.tokenizer = tokenizer
+        self.max_new_tokens = list(max_new_tokens)
+        self.decode_kwargs = decode_kwargs
+        self.timeout = timeout
+        self.token_cache = [[] for _ in self.max_new_tokens]
+        self.printed = [0 for _ in self.max_new_tokens]
+        self.next_tokens_are_prompt = True
+        self.text_queue = Queue()
+        self.stop_signal = None
+
+    def put(self, value):
+        # The first call carries the (padded) prompt
+        if self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+
+        tokens = value.reshape(len(self.token_cache), -1)[:, -1].tolist()
+        deltas = []
+        for row, token in enumerate(tokens):
+            if len(self.token_cache[row]) >= self.max_new_tokens[row]:
+                deltas.append("")
+                continue
+            self.token_cache[row].append(token)
+            deltas.append(self._new_text(row, final=False))
+        self.text_queue.put(deltas, timeout=self.timeout)
+
+    def end(self):
+        deltas = [self._new_text(row, final=True) for row in range(len(self.token_cache))]
+        if any(deltas):
+            self.text_queue.put(deltas, timeout=self.timeout)
+        self.text_queue.put(self.stop_signal, timeout=self.timeout)
+
+    def _new_text(self, row, final):
+        text = self.tokenizer.decode(self.token_cache[row], **self.decode_kwargs)
+        # Hold back incomplete multi-byte characters until the next token
+        if not final and text.endswith("\ufffd"):
+            return ""
+        delta = text[self.printed[row]:]
+        self.printed[row] = len(text)
+        return delta
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        value = self.text_queue.get(timeout=self.timeout)
+        if value is self.stop_signal:
+            raise StopIteration()
+        return value
+
 
 class Gemma3API(ls.LitAPI):
     """
@@ -26,100 +158,171 @@ class Gemma3API(ls.LitAPI):
 
     Methods:
         - setup(device): Called once at startup for the task-specific setup.
-        - decode_request(request): Convert the request payload to model input.
+        - decode_request(request): Convert the request payload to model input; images are preprocessed in a thread pool.
+        - batch(inputs): Collate the decoded requests into one padded model input.
         - predict(model_inputs): Uses the model to generate a response for the given input.
+        - unbatch(output): Split a batched step into one output per request.
     """
 
     def setup(self, device):
         """
-        Sets up the model, processor and a text streamer for the Gemma 3 model.
+        Sets up the model, the processor and the image preprocessing pool and cache for the Gemma 3 model.
         """
-        model_id = "google/gemma-3-4b-it"
         self.device = device
         self.processor = AutoProcessor.from_pretrained(
-            model_id, token=access_token
+            MODEL_ID, token=access_token
         )
+        # Left padding so every row of a batch ends at the generation prompt
+        self.processor.tokenizer.padding_side = "left"
+        # bfloat16 on GPU; float32 keeps CPU runs (tests, benchmarks) fast and exact
+        self.dtype = torch.bfloat16 if str(device).startswith("cuda") else torch.float32
         self.model = (
             Gemma3ForConditionalGeneration.from_pretrained(
-                model_id,
-                torch_dtype=torch.bfloat16,
+                MODEL_ID,
+                torch_dtype=self.dtype,
                 token=access_token,
             )
             .eval()
             .to(self.device)
         )
-        self.streamer = TextIteratorStreamer(
-            self.processor.tokenizer,
-            skip_prompt=True,
-            skip_special_tokens=True,
-            clean_up_tokenization_spaces=False,
+        self.preprocess_pool = ThreadPoolExecutor(
+            max_workers=PREPROCESS_WORKERS, thread_name_prefix="preprocess"
         )
+        self.pixel_cache = PixelCache(IMAGE_CACHE_SIZE)
+        self.batches_served = 0
 
-    def decode_request(self, request: ChatCompletionRequest, context: dict):
+    def preprocess_image(self, image_url):
         """
-        Convert the request payload to model input.
+        Decode and process one image (resize + normalize) into pixel values,
+        reusing the cached tensor when the same image was seen before.
         """
-        # Set the generation arguments from the request
-        context["generation_args"] = {
-            "max_new_tokens": request.max_tokens if request.max_tokens else 300,
-        }
+        key = image_digest(image_url)
+        pixel_values = self.pixel_cache.get(key)
+        if pixel_values is None:
+            image = load_image(image_url)
+            pixel_values = self.processor.image_processor(image, return_tensors="pt")["pixel_values"]
+            self.pixel_cache.put(key, pixel_values)
+        return pixel_values
 
+    def decode_request(self, request: ChatCompletionRequest, context: dict):
+        """
+        Convert the request payload to the messages and generation arguments of one request.
+        Image decoding starts right away in the preprocessing pool; the
+        messages keep an image placeholder that the chat template renders.
+        """
         # Extract the messages from the request
         messages = []
+        pixel_futures = []
         for message in request.messages:
             msg_dict = message.model_dump(exclude_none=True)
             if isinstance(msg_dict.get("content"), list):
-                msg_dict["content"] = [
-                    (
-                        {
-                            "type": "image",
-                            "image": load_image(item["image_url"]["url"]),
-                        }
-                        if item.get("type") == "image_url" and "image_url" in item
-                        else item
-                    )
-                    for item in msg_dict["content"]
-                ]
+                content = []
+                for item in msg_dict["content"]:
+                    if item.get("type") == "image_url" and "image_url" in item:
+                        pixel_futures.append(
+                            self.preprocess_pool.submit(self.preprocess_image, item["image_url"]["url"])
+                        )
+                        content.append({"type": "image"})
+                    else:
+                        content.append(item)
+                msg_dict["content"] = content
             messages.append(msg_dict)
 
-        # Convert the messages to model input
-        return self.processor.apply_chat_template(
-            messages,
-            add_generation_prompt=True,
-            tokenize=True,
-            return_dict=True,
-            return_tensors="pt",
-        ).to(self.model.device, dtype=torch.bfloat16)
+        return {
+            "messages": messages,
+            "pixel_futures": pixel_futures,
+            "max_new_tokens": request.max_tokens if request.max_tokens else DEFAULT_MAX_NEW_TOKENS,
+        }
+
+    def batch(self, inputs):
+        """
+        Collate the decoded requests. Prompts are rendered and left-padded to
+        the longest one while the pool finishes the images; pixel values are
+        then concatenated in prompt order and the attention mask hides the padding.
+        """
+        # Same expansion the processor does: each image placeholder becomes the full image token sequence
+        texts = [
+            self.processor.apply_chat_template(
+                item["messages"], add_generation_prompt=True, tokenize=False
+            ).replace(self.processor.boi_token, self.processor.full_image_sequence)
+            for item in inputs
+        ]
+        model_inputs = self.processor.tokenizer(
+            texts, padding=True, add_special_tokens=False, return_tensors="pt"
+        )
+        model_inputs["token_type_ids"] = (
+            model_inputs["input_ids"] == self.processor.image_token_id
+        ).long()
+
+        pixel_values = [future.result() for item in inputs for future in item["pixel_futures"]]
+        if pixel_values:
+            model_inputs["pixel_values"] = torch.cat(pixel_values).to(dtype=self.dtype)
 
-    def predict(self, model_inputs, context: dict):
+        self.batches_served += 1
+        if self.batches_served % CACHE_STATS_EVERY == 0:
+            print(f"Image cache: {self.pixel_cache.stats()}")
+
+        return {
+            "model_inputs": model_inputs.to(self.model.device),
+            "max_new_tokens": [item["max_new_tokens"] for item in inputs],
+        }
+
+    def predict(self, batch, context):
         """
-        Run inference and stream the model output.
+        Run inference for the whole batch and stream the model output. Each
+        request gets its own decoding state, so concurrent requests are never
+        mixed in the same stream.
         """
+        # Without dynamic batching LitServe passes a single decoded request
+        batched = isinstance(context, list)
+        if not batched:
+            batch = self.batch([batch])
+
+        streamer = BatchTextIteratorStreamer(
+            self.processor.tokenizer,
+            batch["max_new_tokens"],
+            skip_special_tokens=True,
+            clean_up_tokenization_spaces=False,
+        )
+
         # Generation arguments for the model
         generation_kwargs = dict(
-            model_inputs,
-            streamer=self.streamer,
+            batch["model_inputs"],
+            streamer=streamer,
             eos_token_id=self.processor.tokenizer.eos_token_id,
+            pad_token_id=self.processor.tokenizer.pad_token_id,
             do_sample=False,
-            **context["generation_args"],
+            max_new_tokens=max(batch["max_new_tokens"]),
         )
 
         # Generate the response in a separate thread
         thread = Thread(target=self.model.generate, kwargs=generation_kwargs)
         thread.start()
 
-        # Stream the response
-        for text in self.streamer:
-            yield text
+        # Stream the response, one list of deltas per generation step
+        for deltas in streamer:
+            yield deltas if batched else deltas[0]
+        thread.join()
+
+    def unbatch(self, output):
+        """
+        Split one generation step into the text delta of each request.
+        """
+        return list(output)
 
 
 if __name__ == "__main__":
     # Create an instance of the Gemma3API class and run the server
     api = Gemma3API()
-    server = ls.LitServer(api, spec=ls.OpenAISpec())
-    
+    server = ls.LitServer(
+        api,
+        spec=ls.OpenAISpec(),
+        max_batch_size=MAX_BATCH_SIZE,
+        batch_timeout=BATCH_TIMEOUT,
+    )
+
     @server.app.get("/")
     def root():
         return {"status": "ok"}
 
-    server.run(port=8001)
\ No newline at end of file
+    server.run(port=8001)